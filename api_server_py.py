@@ -1,10 +1,23 @@
 # api_server.py - FastAPI Server Module
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, WebSocket
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 import uvicorn
+import json
+import base64
+import hashlib
 import threading
 from datetime import datetime
-from config import NETWORK_PORT, APP_VERSION, APP_CAPABILITIES
+from cryptography.exceptions import InvalidTag
+from config import (
+    NETWORK_PORT, APP_VERSION, APP_CAPABILITIES, WIRE_CONTENT_TYPE, WIRE_BATCH_CONTENT_TYPE,
+    WIRE_BATCH_MAX_MESSAGES, TRANSFER_MAX_CHUNK_SIZE
+)
+from encryption import key_fingerprint
+from session import SessionKeyError, DecryptionError
+from transfer import TransferError, TransferTooLarge
+from wire import decode_envelope, envelope_from_json, decode_channel_frame, decode_batch
 
 # Create FastAPI app
 app = FastAPI()
@@ -17,32 +30,203 @@ def set_app_instance(instance):
     global app_instance
     app_instance = instance
 
+async def deliver_envelope(envelope, client_ip=None):
+    """Hand a decoded envelope and the address it came from to the app. Returns (status code, status text)."""
+    if app_instance:
+        try:
+            # Decryption blocks, so keep it off the event loop
+            await run_in_threadpool(app_instance.handle_incoming_message, envelope, client_ip)
+        except SessionKeyError:
+            return 409, "unknown session key"
+        except DecryptionError:
+            return 422, "decryption failed"
+    return 200, "message received"
+
 @app.post("/message")
 async def receive_message(request: Request):
-    """Endpoint to receive encrypted messages."""
-    data = await request.json()
-    if app_instance:
-        app_instance.handle_incoming_message(
-            data["sender_id"], 
-            data["key"], 
-            data["iv"], 
-            data["message"],
-            data.get("auto_delete", False),
-            data.get("priority", False),
-            data.get("timestamp")
-        )
-    return {"status": "message received"}
+    """Endpoint to receive encrypted messages (binary envelope or JSON)."""
+    if app_instance and not app_instance.keys_ready.is_set():
+        return JSONResponse(status_code=503, content={"status": "keys not ready"})
+    
+    try:
+        if request.headers.get("content-type", "").startswith(WIRE_CONTENT_TYPE):
+            envelope = decode_envelope(await request.body())
+        else:
+            envelope = envelope_from_json(await request.json())
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"status": f"malformed message: {e}"})
+    
+    status_code, status = await deliver_envelope(envelope, request.client.host if request.client else None)
+    return JSONResponse(status_code=status_code, content={"status": status})
 
-@app.get("/info")
-async def get_info():
-    """Endpoint to get peer information."""
-    if app_instance:
-        return {
+@app.post("/messages")
+async def receive_messages(request: Request):
+    """Endpoint to receive a batch of messages (framed binary envelopes or a JSON array).
+    
+    Messages are handled in order and each gets its own status, so one
+    bad message does not fail the rest.
+    """
+    if app_instance and not app_instance.keys_ready.is_set():
+        return JSONResponse(status_code=503, content={"status": "keys not ready"})
+    
+    try:
+        if request.headers.get("content-type", "").startswith(WIRE_BATCH_CONTENT_TYPE):
+            items = decode_batch(await request.body())
+            decode = decode_envelope
+        else:
+            items = await request.json()
+            if not isinstance(items, list):
+                raise ValueError("expected a list of messages")
+            decode = envelope_from_json
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"status": f"malformed batch: {e}"})
+    if len(items) > WIRE_BATCH_MAX_MESSAGES:
+        return JSONResponse(status_code=413, content={"status": "batch too large"})
+    
+    client_ip = request.client.host if request.client else None
+    results = []
+    for item in items:
+        try:
+            status_code, status = await deliver_envelope(decode(item), client_ip)
+        except ValueError as e:
+            status_code, status = 400, f"malformed message: {e}"
+        results.append({"status": status_code, "detail": status})
+    return {"results": results}
+
+@app.websocket("/channel")
+async def channel(websocket: WebSocket):
+    """Long-lived peer channel: binary envelopes in, one ack per envelope out.
+    
+    Each frame is a sequence number and a binary envelope (see wire.py);
+    the ack repeats the sequence number with the status /message would
+    have returned. Frames are handled in order, so per-peer ordering holds.
+    """
+    await websocket.accept()
+    while True:
+        frame = await websocket.receive()
+        if frame['type'] == 'websocket.disconnect':
+            return
+        
+        if frame.get('text') is not None:
+            # Hello from the connecting peer: its open channel is its presence.
+            # The user_id is the peer's own claim, so only trust it from that peer's known address.
+            try:
+                hello = json.loads(frame['text'])
+            except ValueError:
+                continue
+            if app_instance and isinstance(hello, dict) and hello.get('type') == 'hello' \
+                    and isinstance(hello.get('user_id'), str):
+                peer_info = app_instance.peers.get(hello['user_id'])
+                if peer_info and websocket.client and peer_info.get('ip') == websocket.client.host:
+                    await run_in_threadpool(app_instance.network.mark_seen, hello['user_id'])
+            continue
+        
+        try:
+            seq, data = decode_channel_frame(frame['bytes'])
+        except ValueError:
+            await websocket.close(code=1002)
+            return
+        
+        if app_instance and not app_instance.keys_ready.is_set():
+            status_code, status = 503, "keys not ready"
+        else:
+            try:
+                status_code, status = await deliver_envelope(
+                    decode_envelope(data), websocket.client.host if websocket.client else None
+                )
+            except ValueError as e:
+                status_code, status = 400, f"malformed message: {e}"
+        await websocket.send_json({"type": "ack", "seq": seq, "status": status_code, "detail": status})
+
+@app.post("/transfer")
+async def start_transfer(request: Request):
+    """Endpoint to start or resume an incoming file transfer."""
+    if not app_instance or not app_instance.keys_ready.is_set():
+        return JSONResponse(status_code=503, content={"status": "keys not ready"})
+    
+    try:
+        metadata = await request.json()
+        received = await run_in_threadpool(app_instance.transfers.start_incoming, metadata)
+    except TransferTooLarge as e:
+        return JSONResponse(status_code=413, content={"status": f"invalid transfer: {e}"})
+    except (TransferError, KeyError, TypeError, ValueError) as e:
+        return JSONResponse(status_code=400, content={"status": f"invalid transfer: {e}"})
+    return {"received": received}
+
+@app.put("/transfer/{transfer_id}/{index}")
+async def upload_chunk(transfer_id: str, index: int, request: Request):
+    """Endpoint to receive one encrypted file chunk."""
+    if not app_instance or not app_instance.keys_ready.is_set():
+        return JSONResponse(status_code=503, content={"status": "keys not ready"})
+    
+    # Read the body with a hard cap so a peer cannot make us buffer unbounded data
+    chunk = bytearray()
+    async for data in request.stream():
+        chunk += data
+        if len(chunk) > TRANSFER_MAX_CHUNK_SIZE + 16:
+            return JSONResponse(status_code=413, content={"status": "chunk too large"})
+    
+    try:
+        path = await run_in_threadpool(app_instance.transfers.write_chunk, transfer_id, index, bytes(chunk))
+    except KeyError:
+        return JSONResponse(status_code=404, content={"status": "unknown transfer"})
+    except (TransferError, InvalidTag) as e:
+        return JSONResponse(status_code=400, content={"status": f"rejected chunk: {str(e) or 'authentication failed'}"})
+    return {"status": "chunk received", "complete": path is not None}
+
+@app.get("/transfer/{transfer_id}")
+async def transfer_status(transfer_id: str):
+    """Endpoint to report which chunks of a transfer have arrived."""
+    if not app_instance or not app_instance.keys_ready.is_set():
+        return JSONResponse(status_code=503, content={"status": "keys not ready"})
+    
+    try:
+        return app_instance.transfers.status(transfer_id)
+    except KeyError:
+        return JSONResponse(status_code=404, content={"status": "unknown transfer"})
+
+# (user_id, public key hash) -> {"full": (etag, body), "summary": (etag, body)}
+_info_cache = {}
+
+def info_bodies():
+    """Build our /info bodies and their ETags, once per identity."""
+    cache_key = (app_instance.user_id, app_instance.public_key_hash)
+    bodies = _info_cache.get(cache_key)
+    if bodies is None:
+        full = {
             "user_id": app_instance.user_id, 
             "public_key": app_instance.public_key_pem.decode(),
+            "x25519_public_key": base64.b64encode(app_instance.x25519_public_bytes).decode(),
+            "x25519_signature": base64.b64encode(app_instance.x25519_signature).decode(),
+            "fingerprint": app_instance.public_key_hash,
+            "x25519_fingerprint": key_fingerprint(app_instance.x25519_public_bytes),
             "version": APP_VERSION,
             "capabilities": APP_CAPABILITIES
         }
+        summary = {key: value for key, value in full.items() if key not in ("public_key", "x25519_public_key", "x25519_signature")}
+        bodies = {}
+        for name, body in (("full", full), ("summary", summary)):
+            etag = '"' + hashlib.sha256(json.dumps(body, sort_keys=True).encode()).hexdigest()[:16] + '"'
+            bodies[name] = (etag, body)
+        _info_cache.clear()
+        _info_cache[cache_key] = bodies
+    return bodies
+
+@app.get("/info")
+async def get_info(request: Request, fields: str = "full"):
+    """Endpoint to get peer information.
+    
+    fields=summary leaves out the public keys (fingerprints, version and
+    capabilities only). Responses carry an ETag; a request whose
+    If-None-Match matches it gets an empty 304.
+    """
+    if app_instance:
+        if not app_instance.keys_ready.is_set():
+            return JSONResponse(status_code=503, content={"error": "Keys not ready"})
+        etag, body = info_bodies()["summary" if fields == "summary" else "full"]
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return JSONResponse(content=body, headers={"ETag": etag})
     return {"error": "App not initialized"}
 
 @app.get("/ping")
@@ -57,7 +241,7 @@ def start_server(host_ip):
     print("="*50)
     print(f"◆ LOCAL IP ADDRESS: {host_ip}")
     print(f"◆ LISTENING PORT: {NETWORK_PORT}")
-    print(f"◆ ENCRYPTION: AES-256 | RSA-4096")
+    print(f"◆ ENCRYPTION: X25519 + CHACHA20-POLY1305 | AES-256 | RSA-4096")
     print("="*50)
     print("◆ Share your IP with trusted operators to connect")
     print("="*50 + "\n")
@@ -0,0 +1,461 @@
+# benchmark.py - Performance Benchmarks
+
+import argparse
+import base64
+import json
+import platform
+import random
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+import tempfile
+import time
+from datetime import datetime
+import os
+from concurrent.futures import ThreadPoolExecutor
+import cryptography
+from keystore import KeyStore
+from database import MessageDatabase, encode_cursor
+from persistence import PersistenceQueue
+from network import PeerSessionPool
+from history import MessageRecord
+from workers import DecryptPool
+from session import SessionManager
+from encryption import (
+    generate_keys, generate_x25519_keys, encrypt_message, decrypt_message, encrypt_message_bytes, encrypt_broadcast,
+    generate_session_key, encrypt_with_session_key,
+    serialize_public_key, deserialize_public_key, serialize_x25519_public_key, key_fingerprint
+)
+from config import SUITE_RSA, SUITE_X25519, MESSAGE_CHAR_LIMIT, RSA_KEY_SIZE, APP_VERSION, DB_BATCH_SIZE, DB_PAGE_SIZE
+
+def timed(func, *args, **kwargs):
+    """Run a function once and return (elapsed seconds, result)."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def average(func, runs):
+    """Return the mean wall time of a function over several runs."""
+    return sum(timed(func)[0] for _ in range(runs)) / runs
+
+def percentile(sorted_samples, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(0, min(len(sorted_samples) - 1, round(fraction * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+def measure(func, runs, warmup=1):
+    """Time a function repeatedly and return ops/sec and latency percentiles (ms)."""
+    for _ in range(warmup):
+        func()
+    samples = sorted(timed(func)[0] for _ in range(runs))
+    total = sum(samples)
+    return {
+        'runs': runs,
+        'ops_per_sec': runs / total if total else float('inf'),
+        'mean_ms': total / runs * 1000,
+        'min_ms': samples[0] * 1000,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'max_ms': samples[-1] * 1000
+    }
+
+def environment():
+    """Describe the machine and library versions a result was produced on."""
+    return {
+        'app_version': APP_VERSION,
+        'python': platform.python_version(),
+        'cryptography': cryptography.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'timestamp': datetime.now().isoformat()
+    }
+
+def write_json(path, report):
+    """Write a benchmark report to a JSON file for regression tracking."""
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"◆ RESULTS WRITTEN TO {path}")
+
+def compare_reports(baseline_path, report, tolerance):
+    """Print results that got slower than a previous JSON report."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {
+        (r['operation'], r['key_size'], r['message_size']): r['p50_ms'] for r in baseline['results']
+    }
+    regressions = 0
+    print(f"◆ COMPARED WITH {baseline_path} ({baseline['environment']['timestamp']})")
+    for result in report['results']:
+        old = previous.get((result['operation'], result['key_size'], result['message_size']))
+        if old and result['p50_ms'] > old * (1 + tolerance):
+            regressions += 1
+            print(f"  REGRESSION {result['operation']} RSA-{result['key_size']} "
+                  f"{result['message_size'] or ''}: p50 {old:.3f} ms -> {result['p50_ms']:.3f} ms")
+    print(f"  {regressions} regression(s) beyond {tolerance:.0%}")
+    return regressions
+
+def print_result(name, result):
+    """Print one benchmark result row."""
+    print(f"  {name:<34}{result['ops_per_sec']:>12.1f}{result['mean_ms']:>10.3f}"
+          f"{result['p50_ms']:>10.3f}{result['p95_ms']:>10.3f}{result['p99_ms']:>10.3f}")
+
+def bench_crypto(args):
+    """Micro-benchmark the encryption module for each key size and message size."""
+    sizes = args.sizes or [16, 256, MESSAGE_CHAR_LIMIT, MESSAGE_CHAR_LIMIT * 4, MESSAGE_CHAR_LIMIT * 16, MESSAGE_CHAR_LIMIT * 64]
+    report = {'environment': environment(), 'results': []}
+
+    for key_size in args.key_size:
+        print(f"◆ CRYPTO BENCHMARK (RSA-{key_size}, {args.runs} runs)")
+        print(f"  {'operation':<34}{'ops/sec':>12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+
+        def record(operation, result, message_size=None):
+            report['results'].append({
+                'operation': operation, 'key_size': key_size, 'message_size': message_size, **result
+            })
+            label = operation if message_size is None else f"{operation} ({message_size} B)"
+            print_result(label, result)
+
+        record('generate_keys', measure(lambda: generate_keys(key_size), args.keygen_runs, warmup=0))
+        private_key, public_key = generate_keys(key_size)
+        pem = serialize_public_key(public_key)
+        record('serialize_public_key', measure(lambda: serialize_public_key(public_key), args.runs))
+        record('deserialize_public_key', measure(lambda: deserialize_public_key(pem), args.runs))
+
+        for size in sizes:
+            message = "X" * size
+            encrypted = encrypt_message(public_key, message)
+            record('encrypt_message', measure(lambda: encrypt_message(public_key, message), args.runs), size)
+            record('decrypt_message', measure(lambda: decrypt_message(private_key, *encrypted), args.runs), size)
+
+    if args.json:
+        write_json(args.json, report)
+    if args.baseline and compare_reports(args.baseline, report, args.tolerance):
+        raise SystemExit(1)
+
+def payload_size(key, iv, message):
+    """Size of the base64 key/iv/message fields as sent on the wire."""
+    return sum(len(base64.b64encode(field)) for field in (key or b'', iv, message))
+
+def bench_suites(args):
+    """Compare the RSA-4096 and X25519 cipher suites."""
+    message = "X" * args.size
+    rsa_keygen, (rsa_private, rsa_public) = timed(generate_keys)
+    x25519_keygen, (x25519_private, x25519_public) = timed(generate_x25519_keys)
+    identities = {
+        SUITE_RSA: (rsa_public, key_fingerprint(serialize_public_key(rsa_public)), rsa_keygen),
+        SUITE_X25519: (x25519_public, key_fingerprint(serialize_x25519_public_key(x25519_public)), x25519_keygen)
+    }
+
+    print(f"◆ CIPHER SUITE BENCHMARK ({args.runs} runs, {args.size} byte messages)")
+    print(f"  {'suite':<26}{'keygen ms':>12}{'first msg ms':>14}{'per msg us':>12}{'first bytes':>13}{'next bytes':>12}")
+
+    def legacy():
+        decrypt_message(rsa_private, *encrypt_message(rsa_public, message))
+
+    legacy_bytes = sum(len(field) for field in encrypt_message(rsa_public, message))
+    legacy_ms = average(legacy, args.runs) * 1000
+    print(f"  {'legacy rsa4096-aes256cfb':<26}{rsa_keygen * 1000:>12.1f}{legacy_ms:>14.3f}"
+          f"{legacy_ms * 1000:>12.1f}{legacy_bytes:>13}{legacy_bytes:>12}")
+
+    for suite, (public_key, fingerprint, keygen) in identities.items():
+        sender = SessionManager()
+        receiver = SessionManager(rsa_private, x25519_private)
+
+        def first_message():
+            sender.invalidate("PEER")
+            receiver.clear()
+            key_id, wrapped_key, nonce, ciphertext = sender.encrypt("PEER", public_key, fingerprint, message, suite)
+            receiver.decrypt("SELF", key_id, wrapped_key, nonce, ciphertext, suite)
+            return payload_size(wrapped_key, nonce, ciphertext)
+
+        def next_message():
+            key_id, wrapped_key, nonce, ciphertext = sender.encrypt("PEER", public_key, fingerprint, message, suite)
+            receiver.decrypt("SELF", key_id, wrapped_key, nonce, ciphertext, suite)
+            return payload_size(wrapped_key, nonce, ciphertext)
+
+        first_ms = average(first_message, args.runs) * 1000
+        first_bytes = first_message()
+        sender.confirm("PEER", sender.encrypt("PEER", public_key, fingerprint, message, suite)[0])
+        next_bytes = next_message()
+        per_message_us = average(next_message, args.runs * 10) * 1e6
+        print(f"  {suite:<26}{keygen * 1000:>12.1f}{first_ms:>14.3f}{per_message_us:>12.1f}{first_bytes:>13}{next_bytes:>12}")
+
+def bench_broadcast(args):
+    """Compare per-recipient session encryption with encrypt-once broadcast."""
+    message = "X" * args.size
+    session_keys = {i: (os.urandom(8).hex(), generate_session_key()) for i in range(max(args.recipients))}
+
+    print(f"◆ BROADCAST BENCHMARK ({args.size} byte messages, {args.runs} runs, warm sessions)")
+    print(f"  {'recipients':<12}{'per-peer AES ms':>17}{'broadcast AES ms':>18}{'per-peer ChaCha ms':>20}{'broadcast ChaCha ms':>21}")
+    for count in args.recipients:
+        recipients = {i: session_keys[i] for i in range(count)}
+        row = []
+        for suite in (SUITE_RSA, SUITE_X25519):
+            row.append(average(lambda: [
+                encrypt_with_session_key(key, message, key_id.encode(), suite) for key_id, key in recipients.values()
+            ], args.runs))
+            row.append(average(lambda: encrypt_broadcast(recipients, message, suite), args.runs))
+        print(f"  {count:<12}{row[0] * 1000:>17.3f}{row[1] * 1000:>18.3f}{row[2] * 1000:>20.3f}{row[3] * 1000:>21.3f}")
+
+def bench_ingest(args):
+    """Measure receive-path decryption throughput for different worker counts."""
+    private_key, public_key = generate_keys()
+    messages = [encrypt_message_bytes(public_key, "X" * MESSAGE_CHAR_LIMIT) for _ in range(args.messages)]
+    worker_counts = args.workers or sorted({1, 2, max(1, (os.cpu_count() or 1) // 2), os.cpu_count() or 1})
+
+    print(f"◆ INGEST BENCHMARK ({args.messages} legacy RSA-4096 messages)")
+    print(f"  {'workers':<10}{'msgs/sec':>12}{'speedup':>10}")
+
+    baseline = None
+    for workers in worker_counts:
+        pool = DecryptPool(private_key, workers=workers, use_processes=not args.threads)
+        pool.decrypt_legacy(*messages[0])  # start the workers before timing
+        # Concurrent requests arrive on the API server's thread pool
+        with ThreadPoolExecutor(max_workers=workers * 2) as server_threads:
+            elapsed, _ = timed(lambda: list(server_threads.map(lambda m: pool.decrypt_legacy(*m), messages)))
+        pool.shutdown()
+
+        rate = args.messages / elapsed
+        baseline = baseline or rate
+        print(f"  {workers:<10}{rate:>12.1f}{rate / baseline:>9.2f}x")
+
+def bench_db(args):
+    """Compare per-message commits with group commit in MessageDatabase."""
+    print(f"◆ DATABASE WRITE BENCHMARK ({args.messages} messages)")
+    print(f"  {'mode':<36}{'msgs/sec':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for label, batch_size in (("per-message commit", 1), (f"group commit (batch {args.batch_size})", args.batch_size)):
+            db = MessageDatabase("BENCH", path=f"{directory}/{batch_size}.db", batch_size=batch_size)
+            def write():
+                for i in range(args.messages):
+                    db.save_message("BENCH", "PEER", f"message {i}", "key", "iv")
+                db.flush()
+            elapsed, _ = timed(write)
+            db.close()
+            print(f"  {label:<36}{args.messages / elapsed:>12.1f}")
+
+        for durability in ("async", "commit"):
+            db = MessageDatabase("BENCH", path=f"{directory}/{durability}.db", batch_size=args.batch_size)
+            persistence = PersistenceQueue(db, durability=durability)
+            def enqueue():
+                for i in range(args.messages):
+                    persistence.save_message("BENCH", "PEER", f"message {i}", "key", "iv")
+            caller, _ = timed(enqueue)
+            drained, _ = timed(persistence.close)
+            db.close()
+            metrics = persistence.metrics()
+            print(f"  {f'persistence queue ({durability})':<36}{args.messages / (caller + drained):>12.1f}"
+                  f"  caller {caller / args.messages * 1e6:.1f} us/msg, {metrics['batches']} batches")
+
+def bench_history(args):
+    """Time history pages at increasing depth: keyset tokens vs OFFSET."""
+    with tempfile.TemporaryDirectory() as directory:
+        db = MessageDatabase("BENCH", path=f"{directory}/history.db")
+        peers = [f"PEER-{i}" for i in range(args.peers)]
+        with db.conn:
+            db.conn.executemany('''
+                INSERT INTO messages (sender, recipient, conversation, message, timestamp)
+                VALUES (?, ?, ?, ?, datetime('2026-01-01', ? || ' seconds'))
+            ''', ((peers[i % args.peers], "BENCH", peers[i % args.peers], f"message {i}", i)
+                  for i in range(args.rows)))
+        peer_rows = args.rows // args.peers
+
+        print(f"◆ HISTORY PAGING BENCHMARK ({args.rows} rows, {args.peers} peers, page {args.page_size})")
+        print(f"  {'query':<34}{'ops/sec':>12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for depth in (0.0, 0.5, 0.99):
+            offset = int(peer_rows * depth)
+            message_id, timestamp = db.conn.execute('''
+                SELECT id, timestamp FROM messages WHERE conversation = ?
+                ORDER BY timestamp DESC, id DESC LIMIT 1 OFFSET ?
+            ''', (peers[0], offset)).fetchone()
+            token = encode_cursor(timestamp, message_id) if offset else None
+
+            def keyset():
+                db.get_message_page(peers[0], args.page_size, before=token)
+
+            def offset_query():
+                db.conn.execute('''
+                    SELECT sender, recipient, message, timestamp FROM messages
+                    WHERE sender = ? OR recipient = ?
+                    ORDER BY timestamp DESC LIMIT ? OFFSET ?
+                ''', (peers[0], peers[0], args.page_size, offset)).fetchall()
+
+            print_result(f"keyset page at row {offset}", measure(keyset, args.runs))
+            print_result(f"sender OR recipient + OFFSET {offset}", measure(offset_query, args.runs))
+        db.close()
+
+def bench_search(args):
+    """Time full-text history search over a synthetic history."""
+    letters = random.Random(0)
+    words = ["".join(letters.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(7)) for _ in range(args.vocabulary)]
+    with tempfile.TemporaryDirectory() as directory:
+        db = MessageDatabase("BENCH", path=f"{directory}/search.db")
+        with db.conn:
+            db.conn.executemany('''
+                INSERT INTO messages (sender, recipient, conversation, message)
+                VALUES ('PEER', 'BENCH', 'PEER', ?)
+            ''', ((" ".join(words[(i * 7 + j * 13) % args.vocabulary] for j in range(12)),)
+                  for i in range(args.rows)))
+
+        print(f"◆ SEARCH BENCHMARK ({args.rows} rows, {'FTS5' if db.search_enabled else 'LIKE fallback'})")
+        print(f"  {'query':<34}{'ops/sec':>12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for query in (words[1], f"{words[1]} {words[14]}", words[2][:3], "missing"):
+            print_result(f"'{query}'", measure(lambda: db.search_messages(query), args.runs))
+        db.close()
+
+def bench_memory(args):
+    """Measure history bytes/message: dict + datetime entries vs MessageRecord."""
+    start = datetime(2026, 1, 1).timestamp()
+
+    def dict_entry(text, index):
+        moment = datetime.fromtimestamp(start + index)
+        return {'type': 'received', 'message': text, 'timestamp': moment, 'auto_delete': False, 'priority': False}
+
+    def record_entry(text, index):
+        return MessageRecord.create(text, sent=False, moment=datetime.fromtimestamp(start + index))
+
+    print("◆ HISTORY MEMORY BENCHMARK (message text excluded)")
+    print(f"  {'layout':<24}{'messages':>12}{'bytes/msg':>12}{'total MB':>12}")
+    for count in args.counts:
+        texts = [f"message {i}" for i in range(count)]
+        for label, build in (("dict + datetime", dict_entry), ("MessageRecord", record_entry)):
+            tracemalloc.start()
+            entries = [build(text, index) for index, text in enumerate(texts)]
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            print(f"  {label:<24}{count:>12}{size / count:>12.1f}{size / 1e6:>12.1f}")
+            del entries
+
+class _EchoHandler(BaseHTTPRequestHandler):
+    """Minimal keep-alive HTTP endpoint standing in for a peer's /message."""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+def bench_http(args):
+    """Compare per-message round trips: new connection each time vs pooled keep-alive."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _EchoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/message"
+    payload = b"X" * args.size
+    pool = PeerSessionPool()
+
+    def pooled():
+        with pool.session("127.0.0.1") as session:
+            session.post(url, data=payload)
+
+    print(f"◆ HTTP ROUND TRIP BENCHMARK ({args.runs} messages of {args.size} bytes, localhost)")
+    print(f"  {'client':<34}{'ops/sec':>12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    print_result("new connection per message", measure(lambda: requests.post(url, data=payload), args.runs))
+    print_result("pooled keep-alive session", measure(pooled, args.runs))
+    pool.close()
+    server.shutdown()
+
+def bench_startup(args):
+    """Compare cold (generate) and warm (keystore load) identity startup."""
+    with tempfile.TemporaryDirectory() as directory:
+        keystore = KeyStore(directory)
+        user_id = "BENCH-1"
+
+        cold = []
+        for _ in range(args.runs):
+            elapsed, _ = timed(keystore.generate_in_background(
+                user_id, args.passphrase, lambda *keys: None
+            ).join)
+            cold.append(elapsed)
+
+        warm = [timed(keystore.load, user_id, args.passphrase)[0] for _ in range(args.runs)]
+
+        handoff = []
+        for _ in range(args.runs):
+            elapsed, thread = timed(
+                keystore.generate_in_background, "BENCH-2", args.passphrase, lambda *keys: None
+            )
+            handoff.append(elapsed)
+            thread.join()
+
+    print(f"◆ STARTUP BENCHMARK ({args.runs} runs)")
+    print(f"  cold launch (generate + store): {sum(cold) / len(cold) * 1000:10.1f} ms")
+    print(f"  warm launch (keystore load):    {sum(warm) / len(warm) * 1000:10.1f} ms")
+    print(f"  background handoff to UI:       {sum(handoff) / len(handoff) * 1000:10.3f} ms")
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="SilentNet performance benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    startup = commands.add_parser("startup", help="identity key startup time")
+    startup.add_argument("--runs", type=int, default=3)
+    startup.add_argument("--passphrase", default="benchmark")
+    startup.set_defaults(func=bench_startup)
+
+    suites = commands.add_parser("suites", help="compare RSA-4096 and X25519 cipher suites")
+    suites.add_argument("--runs", type=int, default=50)
+    suites.add_argument("--size", type=int, default=MESSAGE_CHAR_LIMIT)
+    suites.set_defaults(func=bench_suites)
+
+    crypto = commands.add_parser("crypto", help="encryption.py micro-benchmarks")
+    crypto.add_argument("--runs", type=int, default=200)
+    crypto.add_argument("--keygen-runs", type=int, default=5)
+    crypto.add_argument("--key-size", type=int, nargs="+", default=[RSA_KEY_SIZE])
+    crypto.add_argument("--sizes", type=int, nargs="+", help="message sizes in bytes")
+    crypto.add_argument("--json", help="write results to a JSON file")
+    crypto.add_argument("--baseline", help="previous JSON results to compare against")
+    crypto.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown before flagging")
+    crypto.set_defaults(func=bench_crypto)
+
+    broadcast = commands.add_parser("broadcast", help="per-recipient vs encrypt-once fan-out")
+    broadcast.add_argument("--runs", type=int, default=20)
+    broadcast.add_argument("--size", type=int, default=MESSAGE_CHAR_LIMIT)
+    broadcast.add_argument("--recipients", type=int, nargs="+", default=[1, 4, 16, 64])
+    broadcast.set_defaults(func=bench_broadcast)
+
+    db = commands.add_parser("db", help="message database write throughput")
+    db.add_argument("--messages", type=int, default=2000)
+    db.add_argument("--batch-size", type=int, default=DB_BATCH_SIZE)
+    db.set_defaults(func=bench_db)
+
+    history = commands.add_parser("history", help="history page latency by depth")
+    history.add_argument("--rows", type=int, default=200000)
+    history.add_argument("--peers", type=int, default=4)
+    history.add_argument("--page-size", type=int, default=DB_PAGE_SIZE)
+    history.add_argument("--runs", type=int, default=20)
+    history.set_defaults(func=bench_history)
+
+    search = commands.add_parser("search", help="full-text history search latency")
+    search.add_argument("--rows", type=int, default=200000)
+    search.add_argument("--vocabulary", type=int, default=5000)
+    search.add_argument("--runs", type=int, default=20)
+    search.set_defaults(func=bench_search)
+
+    memory = commands.add_parser("memory", help="in-memory history bytes per message")
+    memory.add_argument("--counts", type=int, nargs="+", default=[100000, 1000000])
+    memory.set_defaults(func=bench_memory)
+
+    http = commands.add_parser("http", help="per-message HTTP round trip, pooled vs not")
+    http.add_argument("--runs", type=int, default=500)
+    http.add_argument("--size", type=int, default=MESSAGE_CHAR_LIMIT)
+    http.set_defaults(func=bench_http)
+
+    ingest = commands.add_parser("ingest", help="receive-path decrypt throughput by worker count")
+    ingest.add_argument("--messages", type=int, default=400)
+    ingest.add_argument("--workers", type=int, nargs="+")
+    ingest.add_argument("--threads", action="store_true", help="use threads instead of processes")
+    ingest.set_defaults(func=bench_ingest)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -22,21 +22,106 @@ COLORS = {
 NETWORK_PORT = 8000
 NETWORK_TIMEOUT = 3
 STATUS_CHECK_INTERVAL = 30  # seconds
+PING_TIMEOUT = 1  # seconds per /ping health probe
+PING_CONCURRENCY = 32  # peers probed at once
+PEER_BACKOFF_MAX = 600  # longest wait in seconds between probes of an offline peer
+SCAN_NETWORKS = None  # CIDRs to scan, e.g. ["192.168.1.0/24"]; None = /24 of each local interface
+SCAN_CONCURRENCY = 256  # hosts probed at once
+SCAN_CONNECT_TIMEOUT = 0.3  # seconds for the TCP pre-check
+SCAN_MAX_HOSTS = 65536  # refuse larger scans
+HTTP_POOL_SIZE = 4  # keep-alive connections per peer
+HTTP_IDLE_TIMEOUT = 120  # seconds before an unused peer connection is closed
+HTTP_MAX_PEERS = 64  # peers with open connections, least recently used closed first
+CHANNEL_ENABLED = True  # keep a WebSocket open to peers that support it; HTTP otherwise
+CHANNEL_CONNECT_TIMEOUT = 2  # seconds to open a channel
+CHANNEL_PING_INTERVAL = 20  # seconds between keepalive pings on an idle channel
+CHANNEL_RETRY_INTERVAL = 30  # seconds before reopening a channel that failed to connect
+
+# LAN Discovery (opt-in)
+DISCOVERY_ENABLED = False
+DISCOVERY_GROUP = "239.192.77.77"  # administratively scoped multicast group
+DISCOVERY_PORT = 8001
+DISCOVERY_INTERVAL = 5  # seconds between beacons
+DISCOVERY_TTL = 20  # seconds a discovered peer stays listed without a new beacon
+DISCOVERY_INTERFACE = "0.0.0.0"  # local address to send and listen on; 0.0.0.0 = default
 AUTO_DELETE_CHECK_INTERVAL = 60  # seconds
 
 # Encryption Settings
 RSA_KEY_SIZE = 4096
 AES_KEY_SIZE = 32
 IV_SIZE = 16
+NONCE_SIZE = 12
+
+# Cipher Suites (most preferred first)
+SUITE_X25519 = "x25519-chacha20poly1305"
+SUITE_RSA = "rsa4096-aes256gcm"
+CIPHER_SUITES = [SUITE_X25519, SUITE_RSA]
+
+# Database
+DB_BATCH_SIZE = 64  # messages per group commit
+DB_BATCH_MAX_LATENCY = 0.05  # seconds a message may wait before commit
+DB_PAGE_SIZE = 50  # messages per history page
+DB_READ_POOL_SIZE = 4  # read-only connections for history queries
+DB_PURGE_BATCH_SIZE = 500  # rows deleted per purge transaction
+MESSAGE_RETENTION_DAYS = None  # None = keep messages until deleted
+DB_SEARCH_LIMIT = 50  # results per history search
+DB_VACUUM_PAGES = 1000  # free pages released per incremental vacuum step
+ARCHIVE_AFTER_DAYS = 30  # move older messages into compressed archive segments
+ARCHIVE_SEGMENT_SIZE = 1000  # messages per archive segment
+ARCHIVE_CHECK_INTERVAL = 3600  # seconds between archive runs
+
+# Persistence Queue
+PERSIST_QUEUE_SIZE = 10000  # messages waiting for the writer before callers block
+PERSIST_DURABILITY = "async"  # "async" = fire-and-forget, "commit" = wait for commit
+
+# Outbox (store-and-forward)
+OUTBOX_WORKERS = 4  # concurrent deliveries, one peer each
+OUTBOX_RETRY_BASE = 2  # seconds before the first retry to an unreachable peer
+OUTBOX_RETRY_MAX = 300  # longest wait between retries
+OUTBOX_BATCH_SIZE = 64  # queued messages sent to a peer in one request
+OUTBOX_MAX_ATTEMPTS = 100  # failed sends before a message is moved to the dead-letter table
+
+# In-Memory History
+HISTORY_CACHE_MESSAGES = 200  # recent messages kept per peer
+HISTORY_CACHE_PEERS = 32  # peers kept in memory, least recently active evicted
+
+# Crypto Workers
+CRYPTO_WORKERS = None  # None = one per CPU core
+CRYPTO_USE_PROCESSES = True  # False = threads in this process
+
+# Identity Keystore
+KEYSTORE_DIR = "keystore"
+KEYSTORE_ALLOW_PLAINTEXT = False  # allow an empty passphrase, storing identity keys unencrypted
+
+# Session Keys
+SESSION_REKEY_INTERVAL = 3600  # seconds
+SESSION_REKEY_MESSAGES = 1000  # messages per session key
+SESSION_CACHE_SIZE = 256  # cached sessions per direction
+
+# Wire Format
+WIRE_VERSION = 1
+WIRE_CONTENT_TYPE = "application/x-silentnet-envelope"
+WIRE_BATCH_CONTENT_TYPE = "application/x-silentnet-batch"
+WIRE_BATCH_MAX_MESSAGES = 256  # largest batch we accept from a peer
+WIRE_SEEN_MESSAGE_IDS = 8192  # recent incoming message ids remembered to drop resends
+
+# File Transfer
+TRANSFER_CHUNK_SIZE = 1024 * 1024  # plaintext bytes per chunk
+TRANSFER_MAX_CHUNK_SIZE = 8 * 1024 * 1024  # largest chunk we accept from a peer
+TRANSFER_MAX_FILE_SIZE = 4 * 1024 ** 3  # largest file we accept from a peer
+TRANSFER_NONCE_PREFIX_SIZE = 8  # plus a 4-byte chunk counter
+TRANSFER_DIR = "downloads"
+TRANSFER_RETRIES = 5
 
 # UI Configuration
 WINDOW_WIDTH = 1200
 WINDOW_HEIGHT = 800
 WINDOW_ALPHA = 0.98
 MESSAGE_CHAR_LIMIT = 1000
+CALLSIGN_MAX_LENGTH = 32  # characters; must fit the envelope's one-byte length prefix
 AUTO_DELETE_TIME = 300  # 5 minutes in seconds
 
 # Application Info
 APP_NAME = "SILENTNET"
 APP_VERSION = "2.0"
-APP_CAPABILITIES = ["encryption", "priority", "auto_delete"]
\ No newline at end of file
+APP_CAPABILITIES = ["encryption", "priority", "auto_delete", "session_keys", "binary_wire", "file_transfer", "channel", "batch", "broadcast", "message_id", *CIPHER_SUITES]
@@ -1,22 +1,111 @@
 # database.py - Database Operations
 
+import re
+import json
+import zlib
+import base64
+import queue
 import sqlite3
-from datetime import datetime
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from config import (
+    DB_BATCH_SIZE, DB_BATCH_MAX_LATENCY, DB_PAGE_SIZE, DB_READ_POOL_SIZE,
+    DB_PURGE_BATCH_SIZE, MESSAGE_RETENTION_DAYS, AUTO_DELETE_TIME, DB_SEARCH_LIMIT,
+    DB_VACUUM_PAGES, ARCHIVE_AFTER_DAYS, ARCHIVE_SEGMENT_SIZE
+)
+
+# Bumped whenever setup_database gains a migration step
+SCHEMA_VERSION = 5
+
+def search_terms(text):
+    """Split a search box entry into plain word terms."""
+    return re.findall(r'\w+', text)
+
+def archive_snippet(message, terms, size=12):
+    """Build a snippet for an archived match the way FTS5's snippet() does.
+    
+    Words matching a term (the last one as a prefix) are wrapped in
+    [brackets], showing up to size words around the first match.
+    """
+    terms = [term.lower() for term in terms]
+    
+    def matches(word):
+        word = ''.join(search_terms(word)).lower()
+        return word in terms[:-1] or word.startswith(terms[-1])
+    
+    words = message.split()
+    hits = [index for index, word in enumerate(words) if matches(word)]
+    start = max(0, min(hits[0] - size // 4, len(words) - size)) if hits else 0
+    window = [f'[{word}]' if matches(word) else word for word in words[start:start + size]]
+    return ('…' if start else '') + ' '.join(window) + ('…' if start + size < len(words) else '')
+
+def sql_timestamp(moment):
+    """Format a datetime the way SQLite's CURRENT_TIMESTAMP does (UTC)."""
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def relative_scores(rows):
+    """Replace the bm25 rank ending each row with its share of the best rank in rows.
+    
+    bm25 ranks are negative, lower being better, so the best match
+    scores 1.0 and weaker matches approach 0.
+    """
+    best = min((row[-1] for row in rows), default=0)
+    if not best:
+        return [(*row[:-1], 1.0) for row in rows]
+    return [(*row[:-1], row[-1] / best) for row in rows]
+
+def encode_cursor(timestamp, message_id):
+    """Build an opaque pagination token for a message position."""
+    return base64.urlsafe_b64encode(f"{timestamp}|{message_id}".encode()).decode()
+
+def decode_cursor(token):
+    """Parse a pagination token. Raises ValueError if it is malformed."""
+    try:
+        timestamp, message_id = base64.urlsafe_b64decode(token.encode()).decode().rsplit('|', 1)
+        return timestamp, int(message_id)
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid pagination token: {token!r}") from e
 
 class MessageDatabase:
     """Handle all database operations for message storage."""
     
-    def __init__(self, user_id):
+    def __init__(self, user_id, path=None, batch_size=DB_BATCH_SIZE, max_latency=DB_BATCH_MAX_LATENCY,
+                 read_pool_size=DB_READ_POOL_SIZE, auto_delete_time=AUTO_DELETE_TIME,
+                 retention_days=MESSAGE_RETENTION_DAYS):
         self.user_id = user_id
-        self.conn = sqlite3.connect(
-            f'{user_id}_messages.db', 
-            check_same_thread=False
-        )
+        self.auto_delete_time = auto_delete_time
+        self.retention_days = retention_days
+        self.path = path or f'{user_id}_messages.db'
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # Safe in WAL mode: a crash can only lose the last commits, never corrupt
+        self.conn.execute('PRAGMA synchronous=NORMAL')
         self.cursor = self.conn.cursor()
         self.setup_database()
+        
+        self.readers = queue.LifoQueue()
+        for _ in range(read_pool_size):
+            self.readers.put(self._connect_reader())
+        
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.pending = []
+        self.first_pending_at = None
+        self.closed = False
+        self.flush_errors = 0
+        self.last_flush_error = None
+        self.lock = threading.RLock()
+        self.condition = threading.Condition(self.lock)
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
     
     def setup_database(self):
-        """Create the messages table if it doesn't exist."""
+        """Create the messages table if it doesn't exist and migrate old files."""
+        # Applies directly to a new file; older files are converted below
+        self.conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
         self.cursor.execute('''
             CREATE TABLE IF NOT EXISTS messages (
                 id INTEGER PRIMARY KEY,
@@ -31,43 +120,573 @@ class MessageDatabase:
             )
         ''')
         self.conn.commit()
+        
+        version = self.cursor.execute('PRAGMA user_version').fetchone()[0]
+        migrations = [
+            self._migrate_conversations, self._migrate_expiry, self._migrate_search, self._migrate_archive,
+            self._migrate_archive_search
+        ]
+        for target, migrate in enumerate(migrations[version:], start=version + 1):
+            with self.conn:
+                migrate()
+                self.conn.execute(f'PRAGMA user_version = {target}')
+        
+        # Switching an existing file to incremental auto-vacuum takes one full
+        # VACUUM, which cannot run inside a migration's transaction
+        if self.conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            self.conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            self.conn.execute('VACUUM')
+        
+        self.search_enabled = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'archive_fts'"
+        ).fetchone() is not None
     
-    def save_message(self, sender, recipient, message, key, iv, priority=0, auto_delete=0):
-        """Save a message to the database."""
-        self.cursor.execute('''
-            INSERT INTO messages (sender, recipient, message, key, iv, priority, auto_delete)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (sender, recipient, message, key, iv, priority, auto_delete))
+    def _migrate_conversations(self):
+        """v1: add an indexed conversation column for per-peer history."""
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(messages)')]
+        if 'conversation' not in columns:
+            self.conn.execute('ALTER TABLE messages ADD COLUMN conversation TEXT')
+        self.conn.execute('''
+            UPDATE messages
+            SET conversation = CASE WHEN sender = ? THEN recipient ELSE sender END
+            WHERE conversation IS NULL
+        ''', (self.user_id,))
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_messages_conversation
+            ON messages (conversation, timestamp, id)
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_messages_timestamp
+            ON messages (timestamp, id)
+        ''')
+    
+    def _migrate_expiry(self):
+        """v2: add an indexed expires_at column for auto-delete messages."""
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(messages)')]
+        if 'expires_at' not in columns:
+            self.conn.execute('ALTER TABLE messages ADD COLUMN expires_at DATETIME')
+        self.conn.execute('''
+            UPDATE messages
+            SET expires_at = datetime(timestamp, ?)
+            WHERE auto_delete = 1 AND expires_at IS NULL
+        ''', (f'+{self.auto_delete_time} seconds',))
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_messages_expires_at
+            ON messages (expires_at) WHERE expires_at IS NOT NULL
+        ''')
+    
+    def _migrate_search(self):
+        """v3: add an FTS5 index over message text, maintained by triggers."""
+        try:
+            self.conn.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+                USING fts5(message, content='messages', content_rowid='id')
+            ''')
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5; search_messages falls back to LIKE
+            return
+        self.conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, message) VALUES (new.id, new.message);
+            END
+        ''')
+        self.conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+            END
+        ''')
+        self.conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message ON messages BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+                INSERT INTO messages_fts (rowid, message) VALUES (new.id, new.message);
+            END
+        ''')
+        self.conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+    
+    def _migrate_archive(self):
+        """v4: add compressed archive segments."""
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS archive_segments (
+                id INTEGER PRIMARY KEY,
+                conversation TEXT,
+                first_timestamp DATETIME,
+                first_id INTEGER,
+                last_timestamp DATETIME,
+                last_id INTEGER,
+                count INTEGER,
+                data BLOB
+            )
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_archive_conversation
+            ON archive_segments (conversation, last_timestamp, last_id)
+        ''')
+        self.conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_archive_range
+            ON archive_segments (last_timestamp, last_id)
+        ''')
+    
+    def _migrate_archive_search(self):
+        """v5: index archived message text in a contentless FTS5 table."""
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone() is None:
+            # No FTS5; search_messages scans the segments instead
+            return
+        self.conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS archive_fts
+            USING fts5(message, content='')
+        ''')
+        # One row per archived message, keyed by its archive_fts rowid. Message
+        # ids are not used directly: SQLite may reuse them once archived rows
+        # leave the hot table
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS archive_index (
+                id INTEGER PRIMARY KEY,
+                segment_id INTEGER,
+                message_id INTEGER
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_index_segment ON archive_index (segment_id)')
+        for segment_id, data in self.conn.execute('SELECT id, data FROM archive_segments').fetchall():
+            self._index_segment(segment_id, json.loads(zlib.decompress(data)))
+    
+    def _index_segment(self, segment_id, rows):
+        """Add an archive segment's messages to the archive search index. Caller holds the lock."""
+        for row in rows:
+            index_id = self.conn.execute(
+                'INSERT INTO archive_index (segment_id, message_id) VALUES (?, ?)', (segment_id, row[0])
+            ).lastrowid
+            self.conn.execute('INSERT INTO archive_fts (rowid, message) VALUES (?, ?)', (index_id, row[3]))
+    
+    def _drop_segments(self, segment_ids):
+        """Delete archive segments and their search postings. Caller holds the lock."""
+        for segment_id in segment_ids:
+            if self.search_enabled:
+                data = self.conn.execute('SELECT data FROM archive_segments WHERE id = ?', (segment_id,)).fetchone()[0]
+                messages = {row[0]: row[3] for row in json.loads(zlib.decompress(data))}
+                entries = self.conn.execute(
+                    'SELECT id, message_id FROM archive_index WHERE segment_id = ?', (segment_id,)
+                ).fetchall()
+                # Contentless FTS5 needs the original text to remove a row
+                self.conn.executemany(
+                    "INSERT INTO archive_fts (archive_fts, rowid, message) VALUES ('delete', ?, ?)",
+                    [(index_id, messages[message_id]) for index_id, message_id in entries]
+                )
+                self.conn.execute('DELETE FROM archive_index WHERE segment_id = ?', (segment_id,))
+            self.conn.execute('DELETE FROM archive_segments WHERE id = ?', (segment_id,))
+    
+    def _connect_reader(self):
+        """Open a read-only connection to the database file."""
+        uri = Path(self.path).absolute().as_uri() + '?mode=ro'
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+    
+    @contextmanager
+    def _reader(self):
+        """Borrow a read-only connection from the pool."""
+        conn = self.readers.get()
+        try:
+            yield conn
+        finally:
+            self.readers.put(conn)
+    
+    def save_message(self, sender, recipient, message, key, iv, priority=0, auto_delete=0, expires_at=None):
+        """Queue a message for the next group commit.
+        
+        Auto-delete messages expire auto_delete_time seconds from now
+        unless an explicit expires_at datetime is given.
+        """
+        if expires_at is None and auto_delete:
+            expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.auto_delete_time)
+        expires_at = sql_timestamp(expires_at) if expires_at else None
+        conversation = recipient if sender == self.user_id else sender
+        
+        with self.condition:
+            self.pending.append(
+                (sender, recipient, conversation, message, key, iv, priority, auto_delete, expires_at)
+            )
+            if len(self.pending) >= self.batch_size:
+                self._flush_pending()
+            elif len(self.pending) == 1:
+                self.first_pending_at = time.monotonic()
+                self.condition.notify()
+    
+    def _flush_pending(self):
+        """Insert and commit all pending messages. Caller holds the lock."""
+        if not self.pending:
+            return
+        self.cursor.executemany('''
+            INSERT INTO messages
+                (sender, recipient, conversation, message, key, iv, priority, auto_delete, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', self.pending)
         self.conn.commit()
+        self.pending = []
+        self.first_pending_at = None
+    
+    def _flush_loop(self):
+        """Commit pending messages once the oldest reaches the latency bound."""
+        with self.condition:
+            while not self.closed:
+                if not self.pending:
+                    self.condition.wait()
+                    continue
+                remaining = self.first_pending_at + self.max_latency - time.monotonic()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+                try:
+                    self._flush_pending()
+                except Exception as e:
+                    # Disk full, database locked...: keep the rows and retry after a pause
+                    self.conn.rollback()
+                    self.flush_errors += 1
+                    self.last_flush_error = e
+                    self.condition.wait(self.max_latency)
+    
+    def flush(self):
+        """Commit all pending messages now."""
+        with self.condition:
+            self._flush_pending()
     
     def get_messages(self, peer_id=None, limit=100):
-        """Retrieve messages from the database."""
+        """Retrieve the most recent messages from the database."""
+        return self.get_message_page(peer_id, limit)['messages']
+    
+    def get_message_page(self, peer_id=None, limit=DB_PAGE_SIZE, before=None, after=None):
+        """Retrieve one page of history, newest first.
+        
+        Pages are addressed by keyset tokens rather than offsets, so each
+        page is a single index range scan however deep into the history
+        it is. Pass the returned 'before' token to scroll back to older
+        messages and 'after' to move forward to newer ones. A token is
+        None when there is nothing further in that direction. Messages
+        are (sender, recipient, message, timestamp, priority,
+        auto_delete) rows.
+        """
+        if before and after:
+            raise ValueError("Pass either before or after, not both")
+        
+        bound = decode_cursor(before or after) if before or after else None
+        conditions, params = [], []
         if peer_id:
-            self.cursor.execute('''
-                SELECT sender, recipient, message, timestamp 
+            conditions.append('conversation = ?')
+            params.append(peer_id)
+        if bound:
+            conditions.append(f"(timestamp, id) {'>' if after else '<'} (?, ?)")
+            params.extend(bound)
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        order = 'ASC' if after else 'DESC'
+        
+        with self._reader() as conn:
+            # Fetch one extra row to learn whether another page exists
+            rows = conn.execute(f'''
+                SELECT id, sender, recipient, message, timestamp, priority, auto_delete 
                 FROM messages 
-                WHERE sender = ? OR recipient = ?
-                ORDER BY timestamp DESC
+                {where}
+                ORDER BY timestamp {order}, id {order}
                 LIMIT ?
-            ''', (peer_id, peer_id, limit))
+            ''', (*params, limit + 1)).fetchall()
+            rows = self._merge_archive(conn, peer_id, bound, bool(after), rows, limit + 1)
+        
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if after:
+            rows.reverse()
+            older, newer = True, more
         else:
-            self.cursor.execute('''
-                SELECT sender, recipient, message, timestamp 
-                FROM messages 
-                ORDER BY timestamp DESC
+            older, newer = more, bool(before)
+        
+        return {
+            'messages': [row[1:] for row in rows],
+            'before': encode_cursor(rows[-1][4], rows[-1][0]) if rows and older else None,
+            'after': encode_cursor(rows[0][4], rows[0][0]) if rows and newer else None
+        }
+    
+    def _merge_archive(self, conn, peer_id, bound, ascending, rows, count):
+        """Merge archived messages beyond bound into a page of hot rows.
+        
+        Segments are visited nearest first and only decompressed while
+        they could still contain one of the best count rows, so recent
+        pages never touch the archive.
+        """
+        def position(row):
+            return (row[4], row[0])
+        
+        conditions, params = [], []
+        if peer_id:
+            conditions.append('conversation = ?')
+            params.append(peer_id)
+        if ascending:
+            if bound:
+                conditions.append('(last_timestamp, last_id) > (?, ?)')
+                params.extend(bound)
+            order = 'first_timestamp, first_id'
+        else:
+            if bound:
+                conditions.append('(first_timestamp, first_id) < (?, ?)')
+                params.extend(bound)
+            order = 'last_timestamp DESC, last_id DESC'
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        
+        segments = conn.execute(f'''
+            SELECT id, first_timestamp, first_id, last_timestamp, last_id
+            FROM archive_segments
+            {where}
+            ORDER BY {order}
+        ''', params).fetchall()
+        
+        for segment_id, first_timestamp, first_id, last_timestamp, last_id in segments:
+            if len(rows) >= count:
+                worst = position(rows[count - 1])
+                if ascending and (first_timestamp, first_id) > worst:
+                    break
+                if not ascending and (last_timestamp, last_id) < worst:
+                    break
+            data = conn.execute('SELECT data FROM archive_segments WHERE id = ?', (segment_id,)).fetchone()[0]
+            archived = [tuple(row) for row in json.loads(zlib.decompress(data))]
+            if bound:
+                archived = [row for row in archived if (position(row) > bound if ascending else position(row) < bound)]
+            rows = sorted(rows + archived, key=position, reverse=not ascending)[:count]
+        return rows
+    
+    def search_messages(self, text, peer_id=None, limit=DB_SEARCH_LIMIT):
+        """Search message history, archived messages included, best matches first.
+        
+        Every word in the query must appear in a message; the last word
+        also matches as a prefix. Returns (sender, recipient, message,
+        snippet, timestamp) rows, with matches in the snippet wrapped in
+        [brackets].
+        """
+        terms = search_terms(text)
+        if not terms:
+            return []
+        
+        with self._reader() as conn:
+            if not self.search_enabled:
+                return self._scan_messages(conn, terms, peer_id, limit)
+            
+            match = ' '.join(f'"{term}"' for term in terms) + '*'
+            conditions, params = ['messages_fts MATCH ?'], [match]
+            if peer_id:
+                conditions.append('m.conversation = ?')
+                params.append(peer_id)
+            hot = conn.execute(f'''
+                SELECT m.sender, m.recipient, m.message,
+                       snippet(messages_fts, 0, '[', ']', '…', 12), m.timestamp, rank
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                WHERE {' AND '.join(conditions)}
+                ORDER BY rank
                 LIMIT ?
-            ''', (limit,))
+            ''', (*params, limit)).fetchall()
+            archived = self._search_archive(conn, match, terms, peer_id, limit)
         
-        return self.cursor.fetchall()
+        # bm25 scores depend on each index's own corpus statistics, so they are
+        # only comparable after scaling each source by its best match
+        rows = relative_scores(hot) + relative_scores(archived)
+        return [row[:5] for row in sorted(rows, key=lambda row: row[5], reverse=True)[:limit]]
     
-    def delete_old_messages(self, days=7):
-        """Delete messages older than specified days."""
-        self.cursor.execute('''
-            DELETE FROM messages 
-            WHERE timestamp < datetime('now', '-? days')
-        ''', (days,))
-        self.conn.commit()
+    def _search_archive(self, conn, match, terms, peer_id, limit):
+        """Find archived matches, decompressing each segment with a hit once."""
+        conditions, params = ['archive_fts MATCH ?'], [match]
+        if peer_id:
+            conditions.append('s.conversation = ?')
+            params.append(peer_id)
+        hits = conn.execute(f'''
+            SELECT i.message_id, rank, i.segment_id
+            FROM archive_fts
+            JOIN archive_index i ON i.id = archive_fts.rowid
+            JOIN archive_segments s ON s.id = i.segment_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY rank
+            LIMIT ?
+        ''', (*params, limit)).fetchall()
+        
+        segments = {}
+        for segment_id in {hit[2] for hit in hits}:
+            data = conn.execute('SELECT data FROM archive_segments WHERE id = ?', (segment_id,)).fetchone()[0]
+            segments[segment_id] = {row[0]: row for row in json.loads(zlib.decompress(data))}
+        
+        rows = []
+        for message_id, rank, segment_id in hits:
+            _, sender, recipient, message, timestamp = segments[segment_id][message_id][:5]
+            rows.append((sender, recipient, message, archive_snippet(message, terms), timestamp, rank))
+        return rows
+    
+    def _scan_messages(self, conn, terms, peer_id, limit):
+        """Search without FTS5: LIKE over the hot table plus a scan of the archive, newest first."""
+        conditions = ['message LIKE ?'] * len(terms)
+        params = [f'%{term}%' for term in terms]
+        if peer_id:
+            conditions.append('conversation = ?')
+            params.append(peer_id)
+        rows = conn.execute(f'''
+            SELECT sender, recipient, message, message, timestamp
+            FROM messages
+            WHERE {' AND '.join(conditions)}
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
+        ''', (*params, limit)).fetchall()
+        
+        where, params = ('WHERE conversation = ?', (peer_id,)) if peer_id else ('', ())
+        segments = conn.execute(f'''
+            SELECT last_timestamp, data FROM archive_segments
+            {where}
+            ORDER BY last_timestamp DESC, last_id DESC
+        ''', params).fetchall()
+        lowered = [term.lower() for term in terms]
+        for last_timestamp, data in segments:
+            # Segments are older than every hot row, so stop once the page is full
+            if len(rows) >= limit and last_timestamp < rows[limit - 1][4]:
+                break
+            for _, sender, recipient, message, timestamp, *_ in json.loads(zlib.decompress(data)):
+                if all(term in message.lower() for term in lowered):
+                    rows.append((sender, recipient, message, message, timestamp))
+            rows = sorted(rows, key=lambda row: row[4], reverse=True)[:limit]
+        return rows
+    
+    def _purge(self, condition, params, batch_size):
+        """Delete matching rows in bounded batches.
+        
+        Each batch is its own transaction and the writer lock is released
+        between batches, so a large purge never stalls incoming writes.
+        Returns {conversation: rows deleted}.
+        """
+        deleted = {}
+        while True:
+            with self.condition:
+                self._flush_pending()
+                rows = self.conn.execute(f'''
+                    SELECT id, conversation FROM messages
+                    WHERE {condition}
+                    LIMIT ?
+                ''', (*params, batch_size)).fetchall()
+                if rows:
+                    with self.conn:
+                        self.conn.executemany('DELETE FROM messages WHERE id = ?', [(row[0],) for row in rows])
+            for _, conversation in rows:
+                deleted[conversation] = deleted.get(conversation, 0) + 1
+            if len(rows) < batch_size:
+                return deleted
+    
+    def purge_expired(self, batch_size=DB_PURGE_BATCH_SIZE):
+        """Delete expired auto-delete messages and anything past retention.
+        
+        Returns {conversation: rows deleted}.
+        """
+        now = sql_timestamp(datetime.now(timezone.utc))
+        deleted = self._purge('expires_at <= ?', (now,), batch_size)
+        if self.retention_days is not None:
+            for conversation, count in self.delete_old_messages(self.retention_days, batch_size).items():
+                deleted[conversation] = deleted.get(conversation, 0) + count
+        return deleted
+    
+    def set_retention(self, days):
+        """Keep messages for the given number of days, or forever with None."""
+        if days is not None and days < 0:
+            raise ValueError("Retention must be zero or more days")
+        self.retention_days = days
+    
+    def get_retention(self):
+        """Return the retention period in days, or None to keep messages forever."""
+        return self.retention_days
+    
+    def delete_old_messages(self, days=7, batch_size=DB_PURGE_BATCH_SIZE):
+        """Delete messages older than specified days. Returns {conversation: rows deleted}.
+        
+        Archive segments are dropped once their newest message is past
+        the cutoff.
+        """
+        age = f'-{days} days'
+        deleted = self._purge("timestamp < datetime('now', ?)", (age,), batch_size)
+        with self.condition:
+            with self.conn:
+                segments = self.conn.execute('''
+                    SELECT id, conversation, count FROM archive_segments
+                    WHERE last_timestamp < datetime('now', ?)
+                ''', (age,)).fetchall()
+                self._drop_segments([segment[0] for segment in segments])
+        for _, conversation, count in segments:
+            deleted[conversation] = deleted.get(conversation, 0) + count
+        return deleted
+    
+    def clear_messages(self):
+        """Delete every stored message, archived ones and their search index included."""
+        with self.condition:
+            self.pending = []
+            self.first_pending_at = None
+            with self.conn:
+                # The messages_fts triggers empty the hot search index
+                self.conn.execute('DELETE FROM messages')
+                if self.search_enabled:
+                    self.conn.execute("INSERT INTO archive_fts (archive_fts) VALUES ('delete-all')")
+                    self.conn.execute('DELETE FROM archive_index')
+                self.conn.execute('DELETE FROM archive_segments')
+    
+    def archive_old_messages(self, days=ARCHIVE_AFTER_DAYS, segment_size=ARCHIVE_SEGMENT_SIZE):
+        """Move messages older than days into compressed archive segments.
+        
+        Each segment holds up to segment_size messages of one
+        conversation and is written in the same transaction that removes
+        them from the hot table, together with its search postings.
+        Auto-delete messages are left to expire. Returns the number of
+        messages archived.
+        """
+        age = f'-{days} days'
+        with self._reader() as conn:
+            conversations = [row[0] for row in conn.execute('''
+                SELECT DISTINCT conversation FROM messages
+                WHERE timestamp < datetime('now', ?) AND expires_at IS NULL
+            ''', (age,))]
+        
+        archived = 0
+        for conversation in conversations:
+            while True:
+                with self.condition:
+                    self._flush_pending()
+                    rows = self.conn.execute('''
+                        SELECT id, sender, recipient, message, timestamp, priority, auto_delete
+                        FROM messages
+                        WHERE conversation = ? AND timestamp < datetime('now', ?) AND expires_at IS NULL
+                        ORDER BY timestamp, id
+                        LIMIT ?
+                    ''', (conversation, age, segment_size)).fetchall()
+                    if rows:
+                        # Keys and IVs are not kept: archived messages are stored decrypted
+                        data = zlib.compress(json.dumps(rows, separators=(',', ':')).encode(), 9)
+                        with self.conn:
+                            segment_id = self.conn.execute('''
+                                INSERT INTO archive_segments
+                                    (conversation, first_timestamp, first_id, last_timestamp, last_id, count, data)
+                                VALUES (?, ?, ?, ?, ?, ?, ?)
+                            ''', (conversation, rows[0][4], rows[0][0], rows[-1][4], rows[-1][0], len(rows), data)).lastrowid
+                            if self.search_enabled:
+                                self._index_segment(segment_id, rows)
+                            self.conn.executemany('DELETE FROM messages WHERE id = ?', [(row[0],) for row in rows])
+                archived += len(rows)
+                if len(rows) < segment_size:
+                    break
+        return archived
+    
+    def vacuum(self, pages=DB_VACUUM_PAGES):
+        """Return free pages to the filesystem a few at a time. Returns pages freed."""
+        freed = 0
+        while True:
+            with self.condition:
+                free = self.conn.execute('PRAGMA freelist_count').fetchone()[0]
+                self.conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+                remaining = self.conn.execute('PRAGMA freelist_count').fetchone()[0]
+            freed += free - remaining
+            if not remaining or remaining == free:
+                return freed
     
     def close(self):
-        """Close the database connection."""
+        """Flush pending messages and close the database connection."""
+        with self.condition:
+            self._flush_pending()
+            self.closed = True
+            self.condition.notify()
+        self.flusher.join()
+        while not self.readers.empty():
+            self.readers.get_nowait().close()
         self.conn.close()
\ No newline at end of file
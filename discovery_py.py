@@ -0,0 +1,154 @@
+# discovery.py - LAN Multicast Discovery
+
+import json
+import time
+import socket
+import struct
+import threading
+from config import (
+    NETWORK_PORT, APP_NAME, APP_VERSION, APP_CAPABILITIES,
+    DISCOVERY_GROUP, DISCOVERY_PORT, DISCOVERY_INTERVAL, DISCOVERY_TTL, DISCOVERY_INTERFACE
+)
+
+BEACON_TYPE = "silentnet-beacon"
+BEACON_MAX_SIZE = 4096
+
+class DiscoveryService:
+    """Announce ourselves on a LAN multicast group and collect other peers' beacons.
+    
+    Every interval seconds a small JSON beacon with our callsign, API
+    port, key fingerprint and capabilities is multicast; beacons from
+    others land in a table that expires entries after ttl seconds of
+    silence. Reading the table is instant, so discovery needs no subnet
+    sweep. Beacons are unauthenticated hints: connecting still fetches
+    and checks the peer's keys over HTTP.
+    """
+    
+    def __init__(self, app_instance, group=DISCOVERY_GROUP, port=DISCOVERY_PORT, interval=DISCOVERY_INTERVAL,
+                 ttl=DISCOVERY_TTL, interface=DISCOVERY_INTERFACE, found_callback=None):
+        self.app = app_instance
+        self.group = group
+        self.port = port
+        self.interval = interval
+        self.ttl = ttl
+        self.interface = interface
+        self.found_callback = found_callback  # called with (user_id, entry) for newly seen peers
+        self.discovered = {}  # user_id -> {'ip', 'port', 'fingerprint', 'capabilities', 'version', 'expires'}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.sender = None
+        self.receiver = None
+    
+    def _beacon(self):
+        """Build our beacon, or None until our identity key is ready."""
+        if not self.app.keys_ready.is_set():
+            return None
+        return json.dumps({
+            'type': BEACON_TYPE,
+            'app': APP_NAME,
+            'user_id': self.app.user_id,
+            'port': NETWORK_PORT,
+            'fingerprint': self.app.public_key_hash,
+            'version': APP_VERSION,
+            'capabilities': APP_CAPABILITIES
+        }, separators=(',', ':')).encode()
+    
+    def _open_receiver(self):
+        """Bind the listening socket and join the multicast group."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            # Lets several instances on one host share the port
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', self.port))
+        membership = struct.pack('4s4s', socket.inet_aton(self.group), socket.inet_aton(self.interface))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        sock.settimeout(1)
+        return sock
+    
+    def _open_sender(self):
+        """Create the socket beacons are multicast from."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        # Stay on the local network segment, but hear other instances on this host
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        if self.interface != '0.0.0.0':
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.interface))
+        return sock
+    
+    def start(self):
+        """Start announcing and listening in the background."""
+        receiver_sock = self._open_receiver()
+        sender_sock = self._open_sender()
+        self.receiver = threading.Thread(target=self._receive_loop, args=(receiver_sock,), daemon=True)
+        self.sender = threading.Thread(target=self._send_loop, args=(sender_sock,), daemon=True)
+        self.receiver.start()
+        self.sender.start()
+    
+    def _send_loop(self, sock):
+        """Multicast a beacon every interval until stopped."""
+        with sock:
+            while not self.stopped.is_set():
+                beacon = self._beacon()
+                if beacon:
+                    try:
+                        sock.sendto(beacon, (self.group, self.port))
+                    except OSError:
+                        pass  # network down; try again next interval
+                self.stopped.wait(self.interval)
+    
+    def _receive_loop(self, sock):
+        """Record beacons from other peers until stopped."""
+        with sock:
+            while not self.stopped.is_set():
+                try:
+                    data, (ip, _) = sock.recvfrom(BEACON_MAX_SIZE)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    if self.stopped.is_set():
+                        return
+                    continue
+                self.handle_beacon(data, ip)
+    
+    def handle_beacon(self, data, ip):
+        """Parse one beacon and update the discovered-peer table."""
+        try:
+            beacon = json.loads(data)
+            if beacon.get('type') != BEACON_TYPE:
+                return
+            user_id = str(beacon['user_id'])
+            entry = {
+                'ip': ip,
+                'port': int(beacon['port']),
+                'fingerprint': str(beacon.get('fingerprint', '')),
+                'capabilities': list(beacon.get('capabilities', [])),
+                'version': str(beacon.get('version', '')),
+                'expires': time.monotonic() + self.ttl
+            }
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return
+        if user_id == self.app.user_id:
+            return
+        
+        with self.lock:
+            previous = self.discovered.get(user_id)
+            is_new = previous is None or previous['expires'] < time.monotonic() or previous['ip'] != ip
+            self.discovered[user_id] = entry
+        if is_new and self.found_callback:
+            self.found_callback(user_id, dict(entry))
+    
+    def peers(self):
+        """Return {user_id: entry} for peers heard from within the TTL."""
+        now = time.monotonic()
+        with self.lock:
+            for user_id in [u for u, entry in self.discovered.items() if entry['expires'] < now]:
+                del self.discovered[user_id]
+            return {user_id: dict(entry) for user_id, entry in self.discovered.items()}
+    
+    def stop(self):
+        """Stop announcing and listening."""
+        self.stopped.set()
+        for thread in (self.sender, self.receiver):
+            if thread:
+                thread.join()
@@ -2,17 +2,24 @@
 
 import os
 import base64
+import struct
+import hashlib
+from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.hazmat.primitives.asymmetric import padding, rsa, x25519
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.backends import default_backend
-from config import RSA_KEY_SIZE, AES_KEY_SIZE, IV_SIZE
+from config import RSA_KEY_SIZE, AES_KEY_SIZE, IV_SIZE, NONCE_SIZE, SUITE_X25519, TRANSFER_CHUNK_SIZE
 
-def generate_keys():
+X25519_SIGNATURE_CONTEXT = b"silentnet x25519 key"
+
+def generate_keys(key_size=RSA_KEY_SIZE):
     """Generate RSA private and public keys."""
     private_key = rsa.generate_private_key(
         public_exponent=65537, 
-        key_size=RSA_KEY_SIZE, 
+        key_size=key_size, 
         backend=default_backend()
     )
     public_key = private_key.public_key()
@@ -29,8 +36,45 @@ def deserialize_public_key(pem_data):
     """Deserialize a public key from PEM format."""
     return serialization.load_pem_public_key(pem_data, backend=default_backend())
 
-def encrypt_message(public_key, message):
-    """Encrypt a message using AES-256 and RSA-4096."""
+def serialize_private_key(private_key, passphrase=None):
+    """Serialize a private key to PEM, encrypted when a passphrase is given."""
+    if passphrase:
+        encryption = serialization.BestAvailableEncryption(passphrase.encode())
+    else:
+        encryption = serialization.NoEncryption()
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=encryption
+    )
+
+def deserialize_private_key(pem_data, passphrase=None, trusted=False):
+    """Deserialize a private key from PEM format.
+    
+    Trusted keys (ones we generated and stored ourselves) skip the RSA
+    consistency check, which otherwise dominates load time.
+    """
+    return serialization.load_pem_private_key(
+        pem_data,
+        password=passphrase.encode() if passphrase else None,
+        backend=default_backend(),
+        unsafe_skip_rsa_key_validation=trusted
+    )
+
+def key_fingerprint(public_key_pem):
+    """Return the short SHA-256 fingerprint of a PEM public key."""
+    return hashlib.sha256(public_key_pem).hexdigest()[:16].upper()
+
+def oaep_padding():
+    """Return the RSA-OAEP padding used for all key wrapping."""
+    return padding.OAEP(
+        mgf=padding.MGF1(algorithm=hashes.SHA256()), 
+        algorithm=hashes.SHA256(), 
+        label=None
+    )
+
+def encrypt_message_bytes(public_key, message):
+    """Encrypt a message using AES-256 and RSA-4096, returning raw bytes."""
     # Generate AES key and IV
     aes_key = os.urandom(AES_KEY_SIZE)
     iv = os.urandom(IV_SIZE)
@@ -45,14 +89,13 @@ def encrypt_message(public_key, message):
     encrypted_message = encryptor.update(message.encode()) + encryptor.finalize()
     
     # Encrypt AES key with RSA
-    encrypted_aes_key = public_key.encrypt(
-        aes_key, 
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()), 
-            algorithm=hashes.SHA256(), 
-            label=None
-        )
-    )
+    encrypted_aes_key = public_key.encrypt(aes_key, oaep_padding())
+    
+    return encrypted_aes_key, iv, encrypted_message
+
+def encrypt_message(public_key, message):
+    """Encrypt a message using AES-256 and RSA-4096."""
+    encrypted_aes_key, iv, encrypted_message = encrypt_message_bytes(public_key, message)
     
     # Return base64 encoded values
     return (
@@ -61,22 +104,10 @@ def encrypt_message(public_key, message):
         base64.b64encode(encrypted_message).decode()
     )
 
-def decrypt_message(private_key, encrypted_aes_key_b64, iv_b64, encrypted_message_b64):
-    """Decrypt a message using AES-256 and RSA-4096."""
-    # Decode from base64
-    encrypted_aes_key = base64.b64decode(encrypted_aes_key_b64)
-    iv = base64.b64decode(iv_b64)
-    encrypted_message = base64.b64decode(encrypted_message_b64)
-    
-    # Decrypt AES key with RSA
-    aes_key = private_key.decrypt(
-        encrypted_aes_key, 
-        padding.OAEP(
-            mgf=padding.MGF1(algorithm=hashes.SHA256()), 
-            algorithm=hashes.SHA256(), 
-            label=None
-        )
-    )
+def decrypt_message_bytes(private_key, encrypted_aes_key, iv, encrypted_message):
+    """Decrypt raw (bytes or memoryview) AES-256 and RSA-4096 message parts."""
+    # Decrypt AES key with RSA (the backend needs bytes, not a memoryview)
+    aes_key = private_key.decrypt(bytes(encrypted_aes_key), oaep_padding())
     
     # Decrypt message with AES
     cipher = Cipher(
@@ -87,4 +118,199 @@ def decrypt_message(private_key, encrypted_aes_key_b64, iv_b64, encrypted_messag
     decryptor = cipher.decryptor()
     decrypted_message = decryptor.update(encrypted_message) + decryptor.finalize()
     
-    return decrypted_message.decode()
\ No newline at end of file
+    return decrypted_message.decode()
+
+def decrypt_message(private_key, encrypted_aes_key_b64, iv_b64, encrypted_message_b64):
+    """Decrypt a message using AES-256 and RSA-4096."""
+    return decrypt_message_bytes(
+        private_key,
+        base64.b64decode(encrypted_aes_key_b64),
+        base64.b64decode(iv_b64),
+        base64.b64decode(encrypted_message_b64)
+    )
+
+def generate_x25519_keys():
+    """Generate X25519 private and public keys."""
+    private_key = x25519.X25519PrivateKey.generate()
+    return private_key, private_key.public_key()
+
+def serialize_x25519_public_key(public_key):
+    """Serialize an X25519 public key to its raw 32 bytes."""
+    return public_key.public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+
+def deserialize_x25519_public_key(raw_data):
+    """Deserialize an X25519 public key from its raw 32 bytes."""
+    return x25519.X25519PublicKey.from_public_bytes(raw_data)
+
+def _x25519_signature_padding():
+    """Return the RSA-PSS padding used to sign X25519 keys."""
+    return padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH)
+
+def sign_x25519_public_key(private_key, raw_data):
+    """Sign our raw X25519 public key with the RSA identity key, binding it to our KEY HASH."""
+    return private_key.sign(X25519_SIGNATURE_CONTEXT + raw_data, _x25519_signature_padding(), hashes.SHA256())
+
+def verify_x25519_public_key(public_key, raw_data, signature):
+    """Return True if a raw X25519 public key was signed by the given RSA identity key."""
+    try:
+        public_key.verify(signature, X25519_SIGNATURE_CONTEXT + raw_data, _x25519_signature_padding(), hashes.SHA256())
+    except InvalidSignature:
+        return False
+    return True
+
+def _derive_wrap_key(shared_secret, ephemeral_public, recipient_public):
+    """Derive a one-time key-wrapping key from an X25519 shared secret."""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=AES_KEY_SIZE,
+        salt=ephemeral_public + recipient_public,
+        info=b"silentnet key wrap",
+        backend=default_backend()
+    ).derive(shared_secret)
+
+def generate_session_key():
+    """Generate a random 256-bit session key."""
+    return os.urandom(AES_KEY_SIZE)
+
+def wrap_session_key(public_key, session_key):
+    """Encrypt a session key to a peer's RSA or X25519 public key.
+    
+    X25519 keys use an ephemeral key agreement, producing
+    ephemeral public key || nonce || ChaCha20-Poly1305 ciphertext.
+    """
+    if not isinstance(public_key, x25519.X25519PublicKey):
+        return public_key.encrypt(session_key, oaep_padding())
+    
+    ephemeral_private = x25519.X25519PrivateKey.generate()
+    ephemeral_public = serialize_x25519_public_key(ephemeral_private.public_key())
+    wrap_key = _derive_wrap_key(
+        ephemeral_private.exchange(public_key),
+        ephemeral_public,
+        serialize_x25519_public_key(public_key)
+    )
+    nonce = os.urandom(NONCE_SIZE)
+    return ephemeral_public + nonce + ChaCha20Poly1305(wrap_key).encrypt(nonce, session_key, None)
+
+def unwrap_session_key(private_key, wrapped_key):
+    """Decrypt a session key with our RSA or X25519 private key."""
+    wrapped_key = bytes(wrapped_key)  # may be a memoryview; the key backends need bytes
+    if not isinstance(private_key, x25519.X25519PrivateKey):
+        return private_key.decrypt(wrapped_key, oaep_padding())
+    
+    ephemeral_public = wrapped_key[:32]
+    nonce = wrapped_key[32:32 + NONCE_SIZE]
+    wrap_key = _derive_wrap_key(
+        private_key.exchange(deserialize_x25519_public_key(ephemeral_public)),
+        ephemeral_public,
+        serialize_x25519_public_key(private_key.public_key())
+    )
+    return ChaCha20Poly1305(wrap_key).decrypt(nonce, wrapped_key[32 + NONCE_SIZE:], None)
+
+def _session_cipher(session_key, suite):
+    """Return the AEAD cipher used by a cipher suite."""
+    if suite == SUITE_X25519:
+        return ChaCha20Poly1305(session_key)
+    return AESGCM(session_key)
+
+def encrypt_with_session_key(session_key, message, associated_data=None, suite=None):
+    """Encrypt a message with the suite's AEAD cipher, returning (nonce, ciphertext)."""
+    nonce = os.urandom(NONCE_SIZE)
+    ciphertext = _session_cipher(session_key, suite).encrypt(nonce, message.encode(), associated_data)
+    return nonce, ciphertext
+
+def decrypt_with_session_key(session_key, nonce, ciphertext, associated_data=None, suite=None):
+    """Decrypt and authenticate a session message."""
+    return _session_cipher(session_key, suite).decrypt(nonce, ciphertext, associated_data).decode()
+
+def _broadcast_associated_data(key_id):
+    """Bind a wrapped content key to its session and keep it apart from session messages."""
+    return b'broadcast:' + key_id.encode()
+
+def wrap_content_key(session_key, content_key, key_id, suite=None):
+    """Encrypt a broadcast content key under a session key, returning nonce || ciphertext."""
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + _session_cipher(session_key, suite).encrypt(nonce, content_key, _broadcast_associated_data(key_id))
+
+def unwrap_content_key(session_key, wrapped_key, key_id, suite=None):
+    """Decrypt a broadcast content key wrapped under a session key."""
+    wrapped_key = bytes(wrapped_key)
+    return _session_cipher(session_key, suite).decrypt(
+        wrapped_key[:NONCE_SIZE], wrapped_key[NONCE_SIZE:], _broadcast_associated_data(key_id)
+    )
+
+def encrypt_broadcast(session_keys, message, suite=None):
+    """Encrypt a message once for several recipients of the same suite.
+    
+    The body is encrypted a single time under a fresh content key, and
+    only the content key is wrapped for each recipient, under the
+    session key already shared with it, so receivers need no
+    private-key operation. Takes a dict of recipient id -> (key_id,
+    session key) and returns (nonce, ciphertext, wrapped_keys).
+    """
+    content_key = generate_session_key()
+    nonce, ciphertext = encrypt_with_session_key(content_key, message, None, suite)
+    wrapped_keys = {
+        recipient_id: wrap_content_key(session_key, content_key, key_id, suite)
+        for recipient_id, (key_id, session_key) in session_keys.items()
+    }
+    return nonce, ciphertext, wrapped_keys
+
+def _chunk_nonce(nonce_prefix, index):
+    """Build a chunk nonce from the per-stream prefix and the chunk counter."""
+    return nonce_prefix + struct.pack('!I', index)
+
+def encrypt_chunk(session_key, nonce_prefix, index, chunk, final, suite=None):
+    """Encrypt one stream chunk.
+    
+    The chunk index is part of the nonce and the final flag is
+    authenticated, so chunks cannot be reordered, dropped or truncated
+    without detection.
+    """
+    associated_data = b'\x01' if final else b'\x00'
+    return _session_cipher(session_key, suite).encrypt(_chunk_nonce(nonce_prefix, index), chunk, associated_data)
+
+def decrypt_chunk(session_key, nonce_prefix, index, ciphertext, final, suite=None):
+    """Decrypt and authenticate one stream chunk."""
+    associated_data = b'\x01' if final else b'\x00'
+    return _session_cipher(session_key, suite).decrypt(_chunk_nonce(nonce_prefix, index), ciphertext, associated_data)
+
+def _read_chunks(source, chunk_size):
+    """Yield fixed-size chunks from a file object or an iterable of bytes."""
+    if hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        buffer = bytearray()
+        for data in source:
+            buffer += data
+            while len(buffer) >= chunk_size:
+                yield bytes(buffer[:chunk_size])
+                del buffer[:chunk_size]
+        if buffer:
+            yield bytes(buffer)
+
+def encrypt_stream(session_key, nonce_prefix, source, chunk_size=TRANSFER_CHUNK_SIZE, suite=None, start_index=0):
+    """Encrypt a file object or generator chunk by chunk.
+    
+    Yields (index, ciphertext) pairs, holding at most two chunks in memory.
+    An empty source still yields one (empty) final chunk.
+    """
+    index = start_index
+    pending = None
+    for chunk in _read_chunks(source, chunk_size):
+        if pending is not None:
+            yield index, encrypt_chunk(session_key, nonce_prefix, index, pending, False, suite)
+            index += 1
+        pending = chunk
+    yield index, encrypt_chunk(session_key, nonce_prefix, index, pending or b'', True, suite)
+
+def decrypt_stream(session_key, nonce_prefix, chunks, chunk_count, suite=None):
+    """Decrypt (index, ciphertext) pairs from encrypt_stream, yielding plaintext chunks."""
+    for index, ciphertext in chunks:
+        yield decrypt_chunk(session_key, nonce_prefix, index, ciphertext, index == chunk_count - 1, suite)
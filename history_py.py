@@ -0,0 +1,213 @@
+# history.py - In-Memory Message History
+
+import time
+import calendar
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from config import HISTORY_CACHE_MESSAGES, HISTORY_CACHE_PEERS, DB_PAGE_SIZE
+from database import encode_cursor, decode_cursor
+
+RECORD_SENT = 0x01
+RECORD_AUTO_DELETE = 0x02
+RECORD_PRIORITY = 0x04
+
+# A page token positioned before the first message of any conversation
+HISTORY_START = encode_cursor('', 0)
+
+class MessageRecord:
+    """One history message: its text, an epoch-seconds timestamp and flag bits.
+    
+    Slotted, with an int timestamp and the booleans packed into one int,
+    this is a fraction of the size of the equivalent dict plus datetime.
+    """
+    
+    __slots__ = ('message', 'timestamp', 'flags')
+    
+    def __init__(self, message, timestamp, flags=0):
+        self.message = message
+        self.timestamp = timestamp
+        self.flags = flags
+    
+    @classmethod
+    def create(cls, message, sent, auto_delete=False, priority=False, moment=None):
+        """Build a record from readable fields; moment defaults to now."""
+        flags = ((RECORD_SENT if sent else 0) |
+                 (RECORD_AUTO_DELETE if auto_delete else 0) |
+                 (RECORD_PRIORITY if priority else 0))
+        timestamp = int(moment.timestamp()) if moment else int(time.time())
+        return cls(message, timestamp, flags)
+    
+    @property
+    def type(self):
+        """'sent' or 'received'."""
+        return 'sent' if self.flags & RECORD_SENT else 'received'
+    
+    @property
+    def auto_delete(self):
+        """Whether the message expires after AUTO_DELETE_TIME."""
+        return bool(self.flags & RECORD_AUTO_DELETE)
+    
+    @property
+    def priority(self):
+        """Whether the message was sent as high priority."""
+        return bool(self.flags & RECORD_PRIORITY)
+    
+    @property
+    def time(self):
+        """The timestamp as a local datetime."""
+        return datetime.fromtimestamp(self.timestamp)
+    
+    def __repr__(self):
+        return f"MessageRecord({self.type}, {self.time:%Y-%m-%d %H:%M:%S}, {self.message!r})"
+
+class HistoryCache:
+    """Keep the recent messages of recently active peers in memory.
+    
+    Each peer holds at most per_peer messages and at most max_peers
+    peers are cached; the least recently active peer is evicted first.
+    A peer's cache is filled from MessageDatabase the first time it is
+    read, and older messages are paged in from the database on demand,
+    so memory stays flat however long the session runs. Only get and
+    load_older touch the database; call them off the Tk thread.
+    """
+    
+    def __init__(self, db, user_id, per_peer=HISTORY_CACHE_MESSAGES, max_peers=HISTORY_CACHE_PEERS):
+        self.db = db
+        self.user_id = user_id
+        self.per_peer = per_peer
+        self.max_peers = max_peers
+        # peer_id -> {'messages': deque,
+        #             'start': page token of the loaded window's oldest row,
+        #                      '' if the window reached the start of history,
+        #             'dropped': records pushed out of the deque since it was loaded,
+        #             'gap': dropped records load_older has yet to return,
+        #             'before': where load_older continues once the gap is returned}
+        self.peers = OrderedDict()
+        # peer_id -> records appended while the peer's cache is being loaded
+        self.loading = {}
+        self.lock = threading.Lock()
+    
+    def _from_row(self, row):
+        """Convert a get_message_page row into a MessageRecord."""
+        sender, recipient, message, timestamp, priority, auto_delete = row
+        # Database timestamps are UTC
+        epoch = calendar.timegm(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))
+        flags = ((RECORD_SENT if sender == self.user_id else 0) |
+                 (RECORD_AUTO_DELETE if auto_delete else 0) |
+                 (RECORD_PRIORITY if priority else 0))
+        return MessageRecord(message, epoch, flags)
+    
+    def _peer(self, peer_id):
+        """Return a peer's cache, loading it from the database if needed.
+        
+        The query runs without the lock, so appends never wait on it;
+        records appended meanwhile are collected and added after the
+        loaded page. If another thread installed the peer's cache first,
+        that one is kept.
+        """
+        with self.lock:
+            cached = self.peers.get(peer_id)
+            if cached is not None:
+                self.peers.move_to_end(peer_id)
+                return cached
+            arrived = self.loading.setdefault(peer_id, [])
+        
+        try:
+            page = self.db.get_message_page(peer_id, self.per_peer)
+        finally:
+            with self.lock:
+                if self.loading.get(peer_id) is arrived:
+                    del self.loading[peer_id]
+        
+        with self.lock:
+            cached = self.peers.get(peer_id)
+            if cached is not None:
+                self.peers.move_to_end(peer_id)
+                return cached
+            messages = deque(
+                (self._from_row(row) for row in reversed(page['messages'])), maxlen=self.per_peer
+            )
+            messages.extend(arrived)
+            start = page['before'] or ''
+            cached = {'messages': messages, 'start': start, 'dropped': 0, 'gap': 0, 'before': start}
+            self.peers[peer_id] = cached
+            while len(self.peers) > self.max_peers:
+                self.peers.popitem(last=False)
+            return cached
+    
+    def append(self, peer_id, record):
+        """Record a sent or received MessageRecord for a peer.
+        
+        Peers that are not cached are left alone rather than loaded, so
+        this never blocks on the database; the record reaches their
+        cache through MessageDatabase the next time they are read.
+        """
+        with self.lock:
+            arrived = self.loading.get(peer_id)
+            if arrived is not None:
+                arrived.append(record)
+            cached = self.peers.get(peer_id)
+            if cached is None:
+                return
+            self.peers.move_to_end(peer_id)
+            messages = cached['messages']
+            if len(messages) == messages.maxlen:
+                # The oldest record drops out of memory; it stays on screen
+                # until the next get, after which load_older pages it back in
+                cached['dropped'] += 1
+            messages.append(record)
+    
+    def get(self, peer_id):
+        """Return a peer's cached messages, oldest first."""
+        cached = self._peer(peer_id)
+        with self.lock:
+            # load_older walks back from the window returned here
+            cached['gap'] = cached['dropped']
+            cached['before'] = cached['start']
+            return list(cached['messages'])
+    
+    def load_older(self, peer_id, limit=DB_PAGE_SIZE):
+        """Return the next page of messages older than those already seen, oldest first.
+        
+        Successive calls walk further back from the window the last get
+        returned; an empty list means the start of the history was
+        reached. Older pages are returned to the caller, not cached.
+        """
+        cached = self._peer(peer_id)
+        with self.lock:
+            start, gap, before = cached['start'], cached['gap'], cached['before']
+        
+        if gap:
+            # Records that left the window are the oldest rows from its loaded start
+            # on, so this never depends on how far the persistence queue has got
+            if start:
+                timestamp, message_id = decode_cursor(start)
+                floor = encode_cursor(timestamp, message_id - 1)
+            else:
+                floor = HISTORY_START
+            rows = self.db.get_message_page(peer_id, gap, after=floor)['messages'][:limit]
+            with self.lock:
+                if cached['gap'] == gap:
+                    cached['gap'] = gap - len(rows) if rows else 0
+            if rows:
+                return [self._from_row(row) for row in reversed(rows)]
+        
+        if before == '':
+            return []
+        
+        page = self.db.get_message_page(peer_id, limit, before=before)
+        with self.lock:
+            if cached['before'] == before:
+                cached['before'] = page['before'] or ''
+        return [self._from_row(row) for row in reversed(page['messages'])]
+    
+    def evict(self, peer_id):
+        """Drop a peer's cache; it is reloaded from the database when next used."""
+        with self.lock:
+            self.peers.pop(peer_id, None)
+    
+    def clear(self):
+        """Drop every cached peer."""
+        with self.lock:
+            self.peers.clear()
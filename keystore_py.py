@@ -0,0 +1,69 @@
+# keystore.py - Identity Key Storage
+
+import os
+import re
+import threading
+from encryption import generate_keys, serialize_private_key, deserialize_private_key
+from config import KEYSTORE_DIR, KEYSTORE_ALLOW_PLAINTEXT
+
+class KeyStore:
+    """Persist passphrase-protected identity keys as PEM files per callsign.
+
+    Each callsign has one file per key kind: 'identity' for the RSA key
+    and 'x25519' for the key agreement key. Keys are only written
+    unencrypted when allow_plaintext is set.
+    """
+
+    def __init__(self, directory=KEYSTORE_DIR, allow_plaintext=KEYSTORE_ALLOW_PLAINTEXT):
+        self.directory = directory
+        self.allow_plaintext = allow_plaintext
+
+    def path(self, user_id, kind='identity'):
+        """Return the key file path for a callsign."""
+        safe_id = re.sub(r'[^A-Za-z0-9_-]', '_', user_id)
+        return os.path.join(self.directory, f"{safe_id}_{kind}.pem")
+
+    def exists(self, user_id, kind='identity'):
+        """Check whether a key is stored for a callsign."""
+        return os.path.exists(self.path(user_id, kind))
+
+    def load(self, user_id, passphrase=None, kind='identity'):
+        """Load a keypair for a callsign.
+
+        Raises ValueError if the passphrase is wrong.
+        """
+        with open(self.path(user_id, kind), 'rb') as f:
+            private_key = deserialize_private_key(f.read(), passphrase, trusted=True)
+        return private_key, private_key.public_key()
+
+    def save(self, user_id, private_key, passphrase=None, kind='identity'):
+        """Write a private key to disk, readable only by the current user.
+
+        Raises ValueError for an empty passphrase unless plaintext keys are allowed.
+        """
+        if not passphrase and not self.allow_plaintext:
+            raise ValueError("A passphrase is required to store identity keys")
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(user_id, kind)
+        tmp_path = path + '.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(serialize_private_key(private_key, passphrase))
+        os.replace(tmp_path, path)
+        return path
+
+    def generate_in_background(self, user_id, passphrase, callback, error_callback=None):
+        """Generate and store a new identity keypair without blocking the caller."""
+        def generate():
+            try:
+                private_key, public_key = generate_keys()
+                self.save(user_id, private_key, passphrase)
+            except Exception as e:
+                if error_callback:
+                    error_callback(e)
+                return
+            callback(private_key, public_key)
+
+        thread = threading.Thread(target=generate, daemon=True)
+        thread.start()
+        return thread
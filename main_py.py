@@ -1,17 +1,29 @@
 # main.py - Main Application File
 
 import tkinter as tk
-from tkinter import messagebox, simpledialog
+from tkinter import messagebox, simpledialog, filedialog
 import os
-import hashlib
+import base64
 import threading
 import time
+from collections import OrderedDict
 from datetime import datetime
 
 # Import custom modules
 from config import *
-from encryption import generate_keys, serialize_public_key, deserialize_public_key, encrypt_message, decrypt_message
+from encryption import (
+    serialize_public_key, encrypt_message_bytes, key_fingerprint,
+    generate_x25519_keys, serialize_x25519_public_key, sign_x25519_public_key, encrypt_broadcast
+)
+from session import SessionManager, SessionKeyError, DecryptionError, negotiate_suite
+from keystore import KeyStore
+from workers import DecryptPool
+from transfer import TransferManager
 from database import MessageDatabase
+from persistence import PersistenceQueue
+from outbox import Outbox
+from history import HistoryCache, MessageRecord
+from discovery import DiscoveryService
 from network import NetworkManager
 from ui_manager import UIManager
 from custom_widgets import MilitaryButton
@@ -24,7 +36,7 @@ class SecureChatApp:
         self.root = root
         self.message_count = 0
         self.start_time = datetime.now()
-        self.encryption_level = "AES-256 | RSA-4096"
+        self.encryption_level = "X25519 | CHACHA20-POLY1305 | AES-256 | RSA-4096"
         
         # Initialize components
         self.initialize_user()
@@ -42,7 +54,7 @@ class SecureChatApp:
         """Show the login dialog."""
         dialog = tk.Toplevel(self.root)
         dialog.title("AUTHENTICATION REQUIRED")
-        dialog.geometry("400x250")
+        dialog.geometry("400x330")
         dialog.configure(bg=COLORS['bg_dark'])
         dialog.resizable(False, False)
         dialog.transient(self.root)
@@ -111,37 +123,138 @@ class SecureChatApp:
             font=('Consolas', 8)
         ).pack()
         
+        # Keystore passphrase entry
+        tk.Label(
+            dialog, 
+            text="KEYSTORE PASSPHRASE:",
+            bg=COLORS['bg_dark'],
+            fg=COLORS['text_secondary'], 
+            font=('Consolas', 10)
+        ).pack(pady=(10, 0))
+        
+        self.passphrase_entry = tk.Entry(
+            dialog, 
+            bg=COLORS['bg_light'], 
+            fg=COLORS['accent_green'],
+            insertbackground=COLORS['accent_green'], 
+            font=('Consolas', 12, 'bold'),
+            relief=tk.FLAT, 
+            justify='center',
+            show='*'
+        )
+        self.passphrase_entry.pack(pady=5, padx=40, fill=tk.X)
+        
         def authenticate():
             callsign = self.callsign_entry.get().strip().upper()
             if not callsign:
                 callsign = f"OPERATOR-{os.urandom(2).hex().upper()}"
+            if len(callsign) > CALLSIGN_MAX_LENGTH:
+                messagebox.showerror("INVALID CALLSIGN", f"Callsign must be at most {CALLSIGN_MAX_LENGTH} characters", parent=dialog)
+                return
+            passphrase = self.passphrase_entry.get()
+            if not passphrase:
+                if not KEYSTORE_ALLOW_PLAINTEXT:
+                    messagebox.showerror("PASSPHRASE REQUIRED", "Enter a passphrase to protect your identity keys", parent=dialog)
+                    return
+                messagebox.showwarning(
+                    "UNPROTECTED KEYSTORE",
+                    "No passphrase given: identity keys will be stored UNENCRYPTED on disk", parent=dialog
+                )
             self.user_id = callsign
+            self.passphrase = passphrase
             dialog.destroy()
         
         auth_btn = MilitaryButton(dialog, text="◆ AUTHENTICATE ◆", command=authenticate)
         auth_btn.pack(pady=20)
         
         self.callsign_entry.bind('<Return>', lambda e: authenticate())
+        self.passphrase_entry.bind('<Return>', lambda e: authenticate())
         
         # Wait for dialog to close
         self.root.wait_window(dialog)
     
     def initialize_encryption(self):
-        """Initialize encryption keys."""
-        self.private_key, self.public_key = generate_keys()
+        """Load the identity keys, or generate them in the background."""
+        self.keystore = KeyStore()
+        self.keys_ready = threading.Event()
+        self.private_key = self.public_key = self.public_key_pem = None
+        self.public_key_hash = "GENERATING"
+        self.sessions = SessionManager()
+        self.decrypt_pool = None
+        
+        try:
+            # Decrypt the identity first so a wrong passphrase never writes new key files
+            identity = None
+            if self.keystore.exists(self.user_id):
+                identity = self.keystore.load(self.user_id, self.passphrase)
+            self.initialize_x25519_keys()
+            if identity:
+                self.set_identity_keys(*identity)
+        except (ValueError, TypeError):
+            messagebox.showerror("AUTHENTICATION FAILED", f"Invalid passphrase for {self.user_id}")
+            self.root.destroy()
+            raise SystemExit(1)
+        
+        if not self.keys_ready.is_set():
+            self.keystore.generate_in_background(
+                self.user_id, self.passphrase,
+                lambda private_key, public_key: self.root.after(0, lambda: self.on_keys_generated(private_key, public_key)),
+                lambda e: self.root.after(0, lambda: self.ui.add_message_to_display(f"KEY GENERATION FAILED: {str(e)}", msg_type='error'))
+            )
+    
+    def initialize_x25519_keys(self):
+        """Load or create the X25519 key agreement keypair (fast enough to run inline)."""
+        if self.keystore.exists(self.user_id, 'x25519'):
+            self.x25519_private_key, self.x25519_public_key = self.keystore.load(self.user_id, self.passphrase, 'x25519')
+        else:
+            self.x25519_private_key, self.x25519_public_key = generate_x25519_keys()
+            self.keystore.save(self.user_id, self.x25519_private_key, self.passphrase, 'x25519')
+        self.x25519_public_bytes = serialize_x25519_public_key(self.x25519_public_key)
+        self.sessions.x25519_private_key = self.x25519_private_key
+    
+    def set_identity_keys(self, private_key, public_key):
+        """Install the identity keypair and mark encryption as ready."""
+        self.private_key, self.public_key = private_key, public_key
         self.public_key_pem = serialize_public_key(self.public_key)
-        self.public_key_hash = hashlib.sha256(self.public_key_pem).hexdigest()[:16].upper()
+        self.public_key_hash = key_fingerprint(self.public_key_pem)
+        # Peers only use our X25519 key once this proves it belongs to the verified RSA key
+        self.x25519_signature = sign_x25519_public_key(self.private_key, self.x25519_public_bytes)
+        self.sessions.private_key = self.private_key
+        self.decrypt_pool = DecryptPool(self.private_key, self.x25519_private_key)
+        self.sessions.unwrapper = self.decrypt_pool.unwrap_session_key
+        self.keys_ready.set()
+    
+    def on_keys_generated(self, private_key, public_key):
+        """Handle completion of background key generation."""
+        self.set_identity_keys(private_key, public_key)
+        self.ui.encryption_label.config(
+            text=f"ENCRYPTION: {self.encryption_level} | KEY HASH: {self.public_key_hash}"
+        )
+        self.ui.add_message_to_display(f"RSA-4096 KEYPAIR READY - KEY HASH: {self.public_key_hash}", msg_type='system')
+        self.ui.security_status.set_status('online')
     
     def initialize_data_structures(self):
         """Initialize data structures."""
         self.peers = {}
-        self.message_history = {}
         self.auto_delete_time = AUTO_DELETE_TIME
+        self.seen_message_ids = OrderedDict()  # (sender_id, msg_id) of recent incoming messages
+        self.seen_lock = threading.Lock()
+        self.pending_sends = {}  # msg_id -> {'waiting': recipient ids, 'total', 'delivered', 'failed'}
+        self.pending_lock = threading.Lock()
     
     def initialize_modules(self):
         """Initialize all modules."""
         self.db = MessageDatabase(self.user_id)
+        self.persistence = PersistenceQueue(self.db)
+        self.history = HistoryCache(self.db, self.user_id)
+        self.outbox = Outbox(
+            self.user_id, self.deliver_message,
+            delivered_callback=self.on_outbox_delivered, recovered_callback=self.on_outbox_recovered,
+            failed_callback=self.on_outbox_failed, dead_callback=self.on_outbox_dead
+        )
         self.network = NetworkManager(self)
+        self.network.online_callback = self.outbox.flush
+        self.transfers = TransferManager(self)
         self.ui = UIManager(self.root, self)
     
     def setup_ui(self):
@@ -158,14 +271,54 @@ class SecureChatApp:
         # Start monitors
         self.start_status_monitor()
         self.start_auto_delete_monitor()
+        self.start_archive_monitor()
+        self.start_discovery()
         self.update_time()
+        
+        self.root.protocol("WM_DELETE_WINDOW", self.shutdown)
+    
+    def start_discovery(self):
+        """Start LAN multicast discovery if enabled."""
+        self.discovery = None
+        if not DISCOVERY_ENABLED:
+            return
+        
+        def on_found(peer_id, entry):
+            if peer_id not in self.peers:
+                self.ui.add_message_to_display(f"PEER DISCOVERED: {peer_id} at {entry['ip']}", msg_type='system')
+        
+        try:
+            self.discovery = DiscoveryService(self, found_callback=on_found)
+            self.discovery.start()
+        except OSError as e:
+            self.discovery = None
+            self.ui.add_message_to_display(f"LAN DISCOVERY UNAVAILABLE: {str(e)}", msg_type='error')
+    
+    def shutdown(self):
+        """Flush pending writes and stop background workers before exiting."""
+        if self.discovery:
+            self.discovery.stop()
+        self.outbox.close()
+        self.persistence.close()
+        self.db.close()
+        self.network.close()
+        if self.decrypt_pool:
+            self.decrypt_pool.shutdown()
+        self.root.destroy()
     
     def animate_boot_sequence(self):
         """Display boot sequence animation."""
+        if self.keys_ready.is_set():
+            key_messages = [
+                "RSA-4096 KEYPAIR LOADED FROM KEYSTORE",
+                f"PUBLIC KEY HASH: {self.public_key_hash}"
+            ]
+        else:
+            key_messages = ["GENERATING RSA-4096 KEYPAIR IN BACKGROUND..."]
+        
         messages = [
             "INITIALIZING SECURE CHANNEL...",
-            f"GENERATING RSA-4096 KEYPAIR...",
-            f"PUBLIC KEY HASH: {self.public_key_hash}",
+            *key_messages,
             "ESTABLISHING ENCRYPTED DATABASE...",
             f"STARTING NETWORK LISTENER ON PORT {NETWORK_PORT}...",
             f"OPERATOR {self.user_id} AUTHENTICATED",
@@ -176,7 +329,8 @@ class SecureChatApp:
             self.root.after(i * 300, lambda m=msg: self.ui.add_message_to_display(m, msg_type='system'))
         
         self.root.after(len(messages) * 300, lambda: self.ui.network_status.set_status('online'))
-        self.root.after(len(messages) * 300 + 100, lambda: self.ui.security_status.set_status('online'))
+        if self.keys_ready.is_set():
+            self.root.after(len(messages) * 300 + 100, lambda: self.ui.security_status.set_status('online'))
     
     def update_time(self):
         """Update time display."""
@@ -228,17 +382,23 @@ class SecureChatApp:
                 peer_info = self.network.connect_to_peer(peer_ip)
                 if peer_info:
                     peer_id = peer_info['user_id']
-                    peer_pub_key_pem = peer_info['public_key'].encode()
+                    capabilities = peer_info.get('capabilities', [])
                     
                     self.peers[peer_id] = {
                         "ip": peer_ip,
-                        "public_key": deserialize_public_key(peer_pub_key_pem),
+                        **self.network.peer_keys(peer_info),
+                        "capabilities": capabilities,
+                        "suite": negotiate_suite(capabilities),
                         "status": "online",
                         "last_seen": datetime.now()
                     }
                     
+                    if "x25519_public_key" not in self.peers[peer_id] and self.peers[peer_id]["suite"] == SUITE_X25519:
+                        self.peers[peer_id]["suite"] = SUITE_RSA
+                    
                     self.ui.update_peer_list(self.peers)
                     self.ui.add_message_to_display(f"◆ SECURE CHANNEL ESTABLISHED WITH {peer_id} ◆", msg_type='system')
+                    self.outbox.flush(peer_id)
                     dialog.destroy()
             except Exception as e:
                 self.ui.add_message_to_display(f"CONNECTION ERROR: {str(e)}", msg_type='error')
@@ -250,11 +410,61 @@ class SecureChatApp:
         """Handle peer selection."""
         selection = self.ui.peers_listbox.curselection()
         if selection:
-            index = selection[0]
-            peer_text = self.ui.peers_listbox.get(index)
-            peer_name = peer_text[2:]  # Remove status indicator
-            self.ui.selected_peer.set(peer_name)
-            self.ui.add_message_to_display(f"◆ SWITCHED CHANNEL TO {peer_name} ◆", msg_type='system')
+            # Remove status indicator
+            peer_names = [self.ui.peers_listbox.get(index)[2:] for index in selection]
+            self.ui.selected_peers = peer_names
+            self.ui.selected_peer.set(peer_names[0])
+            if len(peer_names) > 1:
+                self.ui.add_message_to_display(f"◆ BROADCAST CHANNEL: {', '.join(peer_names)} ◆", msg_type='system')
+            else:
+                self.ui.add_message_to_display(f"◆ SWITCHED CHANNEL TO {peer_names[0]} ◆", msg_type='system')
+                self.show_history(peer_names[0])
+    
+    def history_lines(self, peer_id, records):
+        """Format MessageRecords as (message, msg_type) display lines."""
+        lines = []
+        for record in records:
+            moment = record.time.strftime("%Y-%m-%d %H:%M:%S")
+            if record.type == 'sent':
+                lines.append((f"[{moment}] YOU → {peer_id}:", 'timestamp'))
+            else:
+                lines.append((f"[{moment}] {peer_id} → YOU:", 'timestamp'))
+            lines.append((f"  {record.message}", record.type))
+        return lines
+    
+    def show_history(self, peer_id):
+        """Show a peer's recent messages; the cache may have to load them from the database."""
+        def load():
+            try:
+                records = self.history.get(peer_id)
+            except Exception as e:
+                self.ui.add_message_to_display(f"HISTORY UNAVAILABLE: {str(e)}", msg_type='error')
+                return
+            for message, msg_type in self.history_lines(peer_id, records):
+                self.ui.add_message_to_display(message, msg_type=msg_type)
+        
+        threading.Thread(target=load, daemon=True).start()
+    
+    def load_older_history(self):
+        """Page older messages with the selected peer in above the current display."""
+        recipient_ids = self.ui.get_selected_peers()
+        if len(recipient_ids) != 1:
+            self.ui.add_message_to_display("SELECT ONE PEER TO LOAD OLDER MESSAGES", msg_type='error')
+            return
+        peer_id = recipient_ids[0]
+        
+        def load():
+            try:
+                records = self.history.load_older(peer_id)
+            except Exception as e:
+                self.ui.add_message_to_display(f"HISTORY UNAVAILABLE: {str(e)}", msg_type='error')
+                return
+            if not records:
+                self.ui.add_message_to_display(f"START OF HISTORY WITH {peer_id}", msg_type='system')
+                return
+            self.ui.prepend_to_display(self.history_lines(peer_id, records))
+        
+        threading.Thread(target=load, daemon=True).start()
     
     def send_message_enter(self, event):
         """Handle Enter key press in message entry."""
@@ -263,74 +473,262 @@ class SecureChatApp:
             return 'break'
     
     def send_message(self):
-        """Send an encrypted message."""
+        """Queue an encrypted message for the selected peer, or for several at once.
+        
+        Delivery happens on the outbox workers, so the UI never waits on
+        the network; peers that are offline get the message when they
+        come back. The message is shown as QUEUED until every recipient
+        acknowledged it.
+        """
         message = self.ui.message_entry.get("1.0", "end-1c").strip()
-        recipient_id = self.ui.selected_peer.get()
+        recipient_ids = self.ui.get_selected_peers()
         
-        if not message or not recipient_id:
+        if not message or not recipient_ids:
             return
         
         if len(message) > MESSAGE_CHAR_LIMIT:
             self.ui.add_message_to_display("ERROR: MESSAGE EXCEEDS 1000 CHARACTER LIMIT", msg_type='error')
             return
         
-        recipient_info = self.peers.get(recipient_id)
-        if not recipient_info:
-            self.ui.add_message_to_display("ERROR: RECIPIENT NOT FOUND", msg_type='error')
+        missing = [recipient_id for recipient_id in recipient_ids if recipient_id not in self.peers]
+        if missing:
+            self.ui.add_message_to_display(f"ERROR: RECIPIENT NOT FOUND: {', '.join(missing)}", msg_type='error')
             return
         
-        try:
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        # Hold the lock until the message is shown, so a fast delivery
+        # cannot update a status that is not on screen yet
+        with self.pending_lock:
+            try:
+                msg_id = self.outbox.enqueue(
+                    recipient_ids, message, self.ui.priority_var.get(), self.ui.auto_delete_var.get()
+                )
+            except Exception as e:
+                self.ui.add_message_to_display(f"OUTBOX ERROR: {str(e)}", msg_type='error')
+                return
+            self.pending_sends[msg_id] = {
+                'waiting': set(recipient_ids), 'total': len(recipient_ids), 'delivered': 0, 'failed': 0
+            }
+            self.ui.add_outgoing_message(msg_id, f"[{timestamp}] YOU → {', '.join(recipient_ids)}:", message)
+        
+        self.message_count += 1
+        self.ui.message_entry.delete("1.0", tk.END)
+        self.ui.update_char_counter()
+    
+    def deliver_message(self, recipient_ids, messages):
+        """Encrypt and send queued messages; called from the outbox workers.
+        
+        messages is a list of (message, priority, auto_delete, timestamp, msg_id).
+        Each peer gets all of its messages in one call to the network,
+        which batches them where the peer supports it. Messages are stored
+        in history once the peer acknowledged them. Returns recipient id
+        -> delivered flag per message.
+        """
+        recipients = {
+            recipient_id: self.peers[recipient_id]
+            for recipient_id in recipient_ids if recipient_id in self.peers
+        }
+        results = {recipient_id: [False] * len(messages) for recipient_id in recipient_ids}
+        if not recipients:
+            return results
+        
+        envelopes_by_peer = {recipient_id: [] for recipient_id in recipients}
+        for message, priority, auto_delete, timestamp, msg_id in messages:
             # Add priority flag if enabled
             msg_with_metadata = message
-            if self.ui.priority_var.get():
+            if priority:
                 msg_with_metadata = f"[PRIORITY] {message}"
             
-            encrypted_key, iv, encrypted_msg = encrypt_message(recipient_info["public_key"], msg_with_metadata)
-            
-            payload = {
-                "sender_id": self.user_id,
-                "key": encrypted_key,
-                "iv": iv,
-                "message": encrypted_msg,
-                "auto_delete": self.ui.auto_delete_var.get(),
-                "priority": self.ui.priority_var.get(),
-                "timestamp": datetime.now().isoformat()
-            }
+            encrypted_by_peer = self.encrypt_for_peers(recipients, msg_with_metadata)
+            for recipient_id, encrypted in encrypted_by_peer.items():
+                envelope = {
+                    "sender_id": self.user_id,
+                    **encrypted,
+                    "auto_delete": auto_delete,
+                    "priority": priority,
+                    "timestamp": timestamp
+                }
+                # Older peers reject the extra binary field
+                if "message_id" in recipients[recipient_id].get('capabilities', []):
+                    envelope["msg_id"] = msg_id
+                envelopes_by_peer[recipient_id].append(envelope)
+        
+        for recipient_id, envelopes in envelopes_by_peer.items():
+            recipient_info = recipients[recipient_id]
+            capabilities = recipient_info.get('capabilities', [])
+            sent_flags = self.network.send_messages(
+                recipient_info['ip'], envelopes,
+                "binary_wire" in capabilities, "channel" in capabilities, "batch" in capabilities
+            )
+            results[recipient_id] = sent_flags
             
-            if self.network.send_message(recipient_info['ip'], payload):
-                timestamp = datetime.now().strftime("%H:%M:%S")
-                self.ui.add_message_to_display(f"[{timestamp}] YOU → {recipient_id}:", msg_type='timestamp')
-                self.ui.add_message_to_display(f"  {message}", msg_type='sent')
+            for (message, priority, auto_delete, timestamp, _), envelope, sent in zip(messages, envelopes, sent_flags):
+                key_id = envelope["key_id"]
+                if key_id:
+                    if sent:
+                        self.sessions.confirm(recipient_id, key_id)
+                    else:
+                        # The peer may have lost our session key; start fresh next time
+                        self.sessions.invalidate(recipient_id)
+                
+                if not sent:
+                    continue
                 
                 # Store in history
-                if recipient_id not in self.message_history:
-                    self.message_history[recipient_id] = []
-                self.message_history[recipient_id].append({
-                    'type': 'sent',
-                    'message': message,
-                    'timestamp': datetime.now(),
-                    'auto_delete': self.ui.auto_delete_var.get()
-                })
+                self.history.append(recipient_id, MessageRecord.create(
+                    message, sent=True, priority=priority, auto_delete=auto_delete,
+                    moment=datetime.fromisoformat(timestamp)
+                ))
                 
-                self.message_count += 1
-                self.ui.message_entry.delete("1.0", tk.END)
-                self.ui.update_char_counter()
+                # Save to database; the peer already acknowledged the message, so a
+                # failed write must not turn the delivery into a dead letter
+                try:
+                    self.persistence.save_message(
+                        self.user_id, recipient_id, message,
+                        key_id or base64.b64encode(envelope["key"]).decode(), base64.b64encode(envelope["iv"]).decode(),
+                        int(priority), int(auto_delete)
+                    )
+                except Exception as e:
+                    self.ui.add_message_to_display(f"STORAGE FAILED FOR MESSAGE TO {recipient_id}: {str(e)}", msg_type='error')
+            
+            if any(sent_flags):
+                self.network.mark_seen(recipient_id)
+        
+        return results
+    
+    def on_outbox_failed(self, peer_id, pending):
+        """Report that a peer became unreachable with messages still queued."""
+        self.ui.add_message_to_display(
+            f"TRANSMISSION FAILED TO {peer_id} - {pending} MESSAGE(S) QUEUED FOR RETRY", msg_type='error'
+        )
+    
+    def on_outbox_recovered(self, peer_id):
+        """Report that a peer is reachable again and its queue is delivering."""
+        self.ui.add_message_to_display(f"{peer_id} REACHABLE AGAIN - DELIVERING QUEUED MESSAGES", msg_type='system')
+    
+    def on_outbox_delivered(self, peer_id, msg_ids):
+        """Mark messages acknowledged by a peer as delivered."""
+        self.update_send_status(peer_id, msg_ids, failed=False)
+    
+    def on_outbox_dead(self, peer_id, msg_ids, reason):
+        """Report messages the outbox gave up on."""
+        self.ui.add_message_to_display(
+            f"{len(msg_ids)} MESSAGE(S) TO {peer_id} NOT DELIVERED: {reason}", msg_type='error'
+        )
+        self.update_send_status(peer_id, msg_ids, failed=True)
+    
+    def update_send_status(self, peer_id, msg_ids, failed):
+        """Record one recipient's outcome for sent messages and update their status on screen."""
+        with self.pending_lock:
+            for msg_id in msg_ids:
+                pending = self.pending_sends.get(msg_id)
+                if not pending or peer_id not in pending['waiting']:
+                    # Queued before this run, or already settled
+                    continue
+                pending['waiting'].discard(peer_id)
+                pending['failed' if failed else 'delivered'] += 1
+                if not pending['waiting']:
+                    del self.pending_sends[msg_id]
                 
-                # Save to database
-                self.db.save_message(
-                    self.user_id, recipient_id, message, encrypted_key, iv,
-                    int(self.ui.priority_var.get()), int(self.ui.auto_delete_var.get())
-                )
+                total, delivered, failures = pending['total'], pending['delivered'], pending['failed']
+                if delivered == total:
+                    status = "DELIVERED"
+                elif failures == total:
+                    status = "FAILED"
+                else:
+                    status = f"DELIVERED {delivered}/{total}" + (f", {failures} FAILED" if failures else "")
+                msg_type = 'error' if failures else ('sent' if not pending['waiting'] else 'pending')
+                self.ui.set_message_status(msg_id, status, msg_type)
+    
+    def encrypt_for_peers(self, recipients, message):
+        """Encrypt a message for one or more peers.
+        
+        Peers that advertise broadcast and already hold a confirmed
+        session key share one body per cipher suite: encrypt_broadcast
+        encrypts it once and wraps the content key under each peer's
+        session key, so neither side runs a public-key operation. Every
+        other peer is encrypted individually with its own session.
+        Returns recipient id -> envelope fields.
+        """
+        encrypted_by_peer = {}
+        session_keys_by_suite = {}
+        for recipient_id, recipient_info in recipients.items():
+            suite, _, fingerprint = self.peer_suite_key(recipient_info)
+            session_key = None
+            if len(recipients) > 1 and suite and "broadcast" in recipient_info.get('capabilities', []):
+                session_key = self.sessions.broadcast_key(recipient_id, fingerprint, suite)
+            if session_key:
+                session_keys_by_suite.setdefault(suite, {})[recipient_id] = session_key
             else:
-                self.ui.add_message_to_display(f"TRANSMISSION FAILED", msg_type='error')
-                
-        except Exception as e:
-            self.ui.add_message_to_display(f"ENCRYPTION ERROR: {str(e)}", msg_type='error')
+                encrypted_by_peer[recipient_id] = self.encrypt_for_peer(recipient_id, recipient_info, message)
+        
+        for suite, session_keys in session_keys_by_suite.items():
+            nonce, ciphertext, wrapped_keys = encrypt_broadcast(session_keys, message, suite)
+            for recipient_id, wrapped_key in wrapped_keys.items():
+                encrypted_by_peer[recipient_id] = {
+                    "key": wrapped_key, "key_id": session_keys[recipient_id][0], "suite": suite,
+                    "iv": nonce, "message": ciphertext, "broadcast": True
+                }
+        
+        return {recipient_id: encrypted_by_peer[recipient_id] for recipient_id in recipients}
     
-    def handle_incoming_message(self, sender_id, key_b64, iv_b64, msg_b64, auto_delete=False, priority=False, timestamp=None):
-        """Handle incoming encrypted message."""
+    def peer_suite_key(self, peer_info):
+        """Return (suite, public key, fingerprint) to use when encrypting to a peer."""
+        suite = peer_info.get('suite')
+        if suite == SUITE_X25519:
+            return suite, peer_info["x25519_public_key"], peer_info["x25519_fingerprint"]
+        return suite, peer_info["public_key"], peer_info["fingerprint"]
+    
+    def encrypt_for_peer(self, recipient_id, recipient_info, message):
+        """Encrypt a message with the suite negotiated for a peer.
+        
+        Returns the raw envelope fields key, key_id, suite, iv and message.
+        """
+        suite, public_key, fingerprint = self.peer_suite_key(recipient_info)
+        if not suite:
+            encrypted_key, iv, encrypted_msg = encrypt_message_bytes(public_key, message)
+            return {"key": encrypted_key, "key_id": None, "suite": None, "iv": iv, "message": encrypted_msg}
+        
+        key_id, wrapped_key, nonce, ciphertext = self.sessions.encrypt(
+            recipient_id, public_key, fingerprint, message, suite
+        )
+        return {"key": wrapped_key, "key_id": key_id, "suite": suite, "iv": nonce, "message": ciphertext}
+    
+    def handle_incoming_message(self, envelope, client_ip=None):
+        """Handle an incoming message envelope (see wire.py).
+        
+        Called from the API server's thread pool; private-key work is
+        handed to the decrypt pool. client_ip is the address the
+        envelope arrived from, if known.
+        """
+        sender_id = envelope['sender_id']
+        key_id = envelope.get('key_id')
+        auto_delete = envelope.get('auto_delete', False)
+        priority = envelope.get('priority', False)
+        timestamp = envelope.get('timestamp')
+        
         try:
-            decrypted_message = decrypt_message(self.private_key, key_b64, iv_b64, msg_b64)
+            if key_id and envelope.get('broadcast'):
+                # Broadcast: content key wrapped under our session with the sender
+                decrypted_message = self.sessions.decrypt_broadcast(
+                    sender_id, key_id, envelope['key'], envelope['iv'], envelope['message'],
+                    envelope.get('suite') or SUITE_RSA
+                )
+            elif key_id:
+                decrypted_message = self.sessions.decrypt(
+                    sender_id, key_id, envelope['key'], envelope['iv'], envelope['message'],
+                    envelope.get('suite') or SUITE_RSA
+                )
+            else:
+                decrypted_message = self.decrypt_pool.decrypt_legacy(
+                    envelope['key'], envelope['iv'], envelope['message']
+                )
+            
+            # A resend of a message we already have: the sender missed our ack.
+            # Returning normally acknowledges it again.
+            msg_id = envelope.get('msg_id')
+            if msg_id and self.message_id_seen(sender_id, msg_id):
+                return
             
             # Check for priority flag
             if decrypted_message.startswith("[PRIORITY]"):
@@ -349,41 +747,138 @@ class SecureChatApp:
             
             self.ui.add_message_to_display(f"  {decrypted_message}", msg_type='received')
             
+            # sender_id is self-asserted, so only count the message as presence
+            # when it decrypted under a session and came from the peer's known address
+            peer_info = self.peers.get(sender_id)
+            if key_id and peer_info and client_ip == peer_info.get('ip'):
+                self.network.mark_seen(sender_id)
+            
             # Store in history
-            if sender_id not in self.message_history:
-                self.message_history[sender_id] = []
-            self.message_history[sender_id].append({
-                'type': 'received',
-                'message': decrypted_message,
-                'timestamp': msg_time,
-                'auto_delete': auto_delete,
-                'priority': priority
-            })
+            self.history.append(sender_id, MessageRecord.create(
+                decrypted_message, sent=False, auto_delete=auto_delete, priority=priority, moment=msg_time
+            ))
             
             self.message_count += 1
             
-            # Save to database
-            self.db.save_message(
-                sender_id, self.user_id, decrypted_message, key_b64, iv_b64,
-                int(priority), int(auto_delete)
-            )
+            # Save to database; the message was received either way, so a failed
+            # write in "commit" durability mode is reported as a storage failure
+            try:
+                self.persistence.save_message(
+                    sender_id, self.user_id, decrypted_message,
+                    key_id or base64.b64encode(envelope['key']).decode(), base64.b64encode(envelope['iv']).decode(),
+                    int(priority), int(auto_delete)
+                )
+            except Exception as e:
+                self.ui.add_message_to_display(f"STORAGE FAILED FOR MESSAGE FROM {sender_id}: {str(e)}", msg_type='error')
+            
+            # Only a handled message counts as delivered; a failed one may be resent
+            if msg_id:
+                self.claim_message_id(sender_id, msg_id)
             
+        except SessionKeyError:
+            # Let the API layer tell the sender to rekey
+            raise
         except Exception as e:
             self.ui.add_message_to_display(f"DECRYPTION FAILED FROM {sender_id}: {str(e)}", msg_type='error')
+            # Tell the sender, so its outbox retries instead of marking the message delivered
+            raise DecryptionError(str(e)) from e
+    
+    def message_id_seen(self, sender_id, msg_id):
+        """Whether this sender already delivered a message id."""
+        key = (sender_id, msg_id)
+        with self.seen_lock:
+            if key in self.seen_message_ids:
+                self.seen_message_ids.move_to_end(key)
+                return True
+        return False
+    
+    def claim_message_id(self, sender_id, msg_id):
+        """Remember an incoming message id; False if this sender already delivered it."""
+        key = (sender_id, msg_id)
+        with self.seen_lock:
+            if key in self.seen_message_ids:
+                self.seen_message_ids.move_to_end(key)
+                return False
+            self.seen_message_ids[key] = None
+            while len(self.seen_message_ids) > WIRE_SEEN_MESSAGE_IDS:
+                self.seen_message_ids.popitem(last=False)
+        return True
+    
+    def send_file(self):
+        """Send a file to the selected peer as a chunked, resumable transfer."""
+        recipient_id = self.ui.selected_peer.get()
+        recipient_info = self.peers.get(recipient_id)
+        if not recipient_info:
+            self.ui.add_message_to_display("ERROR: SELECT A PEER FIRST", msg_type='error')
+            return
+        
+        if not recipient_info.get('suite') or "file_transfer" not in recipient_info.get('capabilities', []):
+            self.ui.add_message_to_display(f"ERROR: {recipient_id} DOES NOT SUPPORT FILE TRANSFER", msg_type='error')
+            return
+        
+        path = filedialog.askopenfilename(title="SELECT FILE TO TRANSMIT")
+        if not path:
+            return
+        
+        filename = os.path.basename(path)
+        self.ui.add_message_to_display(f"TRANSMITTING {filename} TO {recipient_id}...", msg_type='system')
+        
+        reported = set()
+        def progress(sent, total):
+            percent = sent * 100 // total
+            step = percent - percent % 25
+            if step and step < 100 and step not in reported:
+                reported.add(step)
+                self.ui.add_message_to_display(f"  {filename}: {step}% TRANSMITTED", msg_type='system')
+        
+        def done(error):
+            if error:
+                self.ui.add_message_to_display(
+                    f"FILE TRANSFER INTERRUPTED: {str(error)} - SEND AGAIN TO RESUME", msg_type='error'
+                )
+            else:
+                self.ui.add_message_to_display(f"◆ {filename} DELIVERED TO {recipient_id} ◆", msg_type='system')
+        
+        self.transfers.send_file(recipient_id, recipient_info, path, progress, done)
+    
+    def handle_file_received(self, sender_id, path):
+        """Handle a completed incoming file transfer."""
+        self.ui.add_message_to_display(f"◆ FILE RECEIVED FROM {sender_id}: {path} ◆", msg_type='system')
     
     def scan_network(self):
         """Scan the network for peers."""
+        if self.discovery:
+            # Discovery keeps the peer table current; no sweep needed
+            discovered = self.discovery.peers()
+            self.ui.add_message_to_display(f"LAN DISCOVERY: {len(discovered)} PEER(S) ANNOUNCED", msg_type='system')
+            for peer_id, entry in discovered.items():
+                self.ui.add_message_to_display(f"  • {peer_id} at {entry['ip']}", msg_type='system')
+            return
+        
         self.ui.add_message_to_display("INITIATING NETWORK SCAN...", msg_type='system')
+        started = time.perf_counter()
+        
+        def display_peer(ip, peer_info):
+            self.ui.add_message_to_display(f"  • {peer_info['user_id']} at {ip}", msg_type='system')
         
         def display_results(found_peers):
+            elapsed = time.perf_counter() - started
             if found_peers:
-                self.ui.add_message_to_display(f"SCAN COMPLETE: {len(found_peers)} PEER(S) DETECTED", msg_type='system')
-                for ip, peer_id in found_peers:
-                    self.ui.add_message_to_display(f"  • {peer_id} at {ip}", msg_type='system')
+                self.ui.add_message_to_display(
+                    f"SCAN COMPLETE: {len(found_peers)} PEER(S) DETECTED IN {elapsed:.1f}S", msg_type='system'
+                )
             else:
-                self.ui.add_message_to_display("SCAN COMPLETE: NO PEERS DETECTED", msg_type='system')
+                self.ui.add_message_to_display(f"SCAN COMPLETE: NO PEERS DETECTED IN {elapsed:.1f}S", msg_type='system')
         
-        self.network.scan_network(lambda results: self.root.after(0, lambda: display_results(results)))
+        def display_error(error):
+            self.ui.add_message_to_display(f"SCAN FAILED: {error}", msg_type='error')
+        
+        # Peers are listed as they answer; the summary follows when the scan ends
+        self.network.scan_network(
+            lambda results: self.root.after(0, lambda: display_results(results)),
+            found_callback=lambda ip, info: self.root.after(0, lambda: display_peer(ip, info)),
+            error_callback=lambda e: self.root.after(0, lambda: display_error(e))
+        )
     
     def export_keys(self):
         """Export public keys."""
@@ -392,12 +887,48 @@ class SecureChatApp:
     
     def clear_history(self):
         """Clear message history."""
-        if messagebox.askyesno("CONFIRM", "Clear all message history? This cannot be undone."):
-            self.ui.message_display.config(state='normal')
-            self.ui.message_display.delete('1.0', tk.END)
-            self.ui.message_display.config(state='disabled')
-            self.message_history.clear()
+        if not messagebox.askyesno("CONFIRM", "Clear all message history? This cannot be undone."):
+            return
+        self.ui.message_display.config(state='normal')
+        self.ui.message_display.delete('1.0', tk.END)
+        self.ui.message_display.config(state='disabled')
+        
+        def clear():
+            try:
+                self.db.clear_messages()
+            except Exception as e:
+                self.ui.add_message_to_display(f"CLEAR FAILED: {str(e)}", msg_type='error')
+                return
+            # After the database, so a concurrent reload cannot bring old rows back
+            self.history.clear()
             self.ui.add_message_to_display("MESSAGE HISTORY CLEARED", msg_type='system')
+        
+        threading.Thread(target=clear, daemon=True).start()
+    
+    def search_history(self, event=None):
+        """Search stored message history for the search box text."""
+        query = self.ui.search_entry.get().strip()
+        if not query:
+            return
+        
+        def search():
+            start = time.perf_counter()
+            try:
+                results = self.db.search_messages(query)
+            except Exception as e:
+                self.ui.add_message_to_display(f"SEARCH FAILED: {str(e)}", msg_type='error')
+                return
+            elapsed = (time.perf_counter() - start) * 1000
+            
+            self.ui.add_message_to_display(
+                f"SEARCH '{query}': {len(results)} RESULT(S) IN {elapsed:.1f} MS", msg_type='system'
+            )
+            for sender, recipient, _, snippet, timestamp in results:
+                self.ui.add_message_to_display(f"[{timestamp}] {sender} → {recipient}:", msg_type='timestamp')
+                self.ui.add_message_to_display(f"  {snippet}", msg_type='received')
+        
+        # Keep the query off the Tk thread; add_message_to_display schedules its own UI updates
+        threading.Thread(target=search, daemon=True).start()
     
     def start_status_monitor(self):
         """Start monitoring peer status."""
@@ -410,24 +941,42 @@ class SecureChatApp:
         """Start monitoring for auto-delete messages."""
         def monitor():
             while True:
-                current_time = datetime.now()
-                for peer_id, messages in self.message_history.items():
-                    messages_to_delete = []
-                    for msg in messages:
-                        if msg.get('auto_delete'):
-                            if (current_time - msg['timestamp']).seconds > self.auto_delete_time:
-                                messages_to_delete.append(msg)
-                    
-                    for msg in messages_to_delete:
-                        messages.remove(msg)
-                        self.root.after(0, lambda p=peer_id: self.ui.add_message_to_display(
-                            f"AUTO-DELETED MESSAGE FROM {p}", msg_type='system'
-                        ))
+                # The database purges by its expiry index; only conversations
+                # that actually lost rows need their cached history reloaded
+                try:
+                    deleted = self.db.purge_expired()
+                except Exception as e:
+                    self.root.after(0, lambda e=e: self.ui.add_message_to_display(
+                        f"AUTO-DELETE PURGE FAILED: {e}", msg_type='error'
+                    ))
+                    deleted = {}
+                
+                for peer_id, count in deleted.items():
+                    self.history.evict(peer_id)
+                    self.root.after(0, lambda p=peer_id, c=count: self.ui.add_message_to_display(
+                        f"AUTO-DELETED {c} MESSAGE(S) FROM {p}", msg_type='system'
+                    ))
                 
                 time.sleep(AUTO_DELETE_CHECK_INTERVAL)
         
         thread = threading.Thread(target=monitor, daemon=True)
         thread.start()
+    
+    def start_archive_monitor(self):
+        """Periodically move old history into archive segments and compact the database."""
+        def monitor():
+            while True:
+                time.sleep(ARCHIVE_CHECK_INTERVAL)
+                try:
+                    if self.db.archive_old_messages():
+                        self.db.vacuum()
+                except Exception as e:
+                    self.root.after(0, lambda e=e: self.ui.add_message_to_display(
+                        f"HISTORY ARCHIVE FAILED: {e}", msg_type='error'
+                    ))
+        
+        thread = threading.Thread(target=monitor, daemon=True)
+        thread.start()
 
 def main():
     """Main entry point."""
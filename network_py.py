@@ -1,11 +1,221 @@
 # network.py - Network Operations
 
 import socket
+import asyncio
+import ipaddress
 import requests
 import threading
+import time
 import json
+import base64
+import random
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from config import NETWORK_PORT, NETWORK_TIMEOUT, STATUS_CHECK_INTERVAL
+from requests.adapters import HTTPAdapter
+from config import (
+    NETWORK_PORT, NETWORK_TIMEOUT, STATUS_CHECK_INTERVAL, WIRE_CONTENT_TYPE, WIRE_BATCH_CONTENT_TYPE,
+    SCAN_NETWORKS, SCAN_CONCURRENCY, SCAN_CONNECT_TIMEOUT, SCAN_MAX_HOSTS,
+    HTTP_POOL_SIZE, HTTP_IDLE_TIMEOUT, HTTP_MAX_PEERS,
+    PING_TIMEOUT, PING_CONCURRENCY, PEER_BACKOFF_MAX,
+    CHANNEL_ENABLED, CHANNEL_CONNECT_TIMEOUT, CHANNEL_PING_INTERVAL, CHANNEL_RETRY_INTERVAL
+)
+from encryption import (
+    deserialize_public_key, deserialize_x25519_public_key, verify_x25519_public_key, key_fingerprint
+)
+from wire import encode_envelope, envelope_to_json, encode_channel_frame, encode_batch
+
+try:
+    from websockets.sync.client import connect as websocket_connect
+    from websockets.exceptions import WebSocketException
+except ImportError:  # channels are optional; messages then always go over HTTP
+    websocket_connect = None
+    WebSocketException = None
+
+class PeerSessionPool:
+    """Keep-alive HTTP sessions, one per peer.
+    
+    Each peer gets a requests.Session holding up to pool_size open
+    connections, so repeated requests skip the TCP handshake. Sessions
+    unused for idle_timeout seconds are closed, and at most max_peers
+    are kept open, least recently used closed first. Sessions are
+    checked out for the length of a request, and one evicted while
+    another thread still uses it is closed when that thread is done.
+    """
+    
+    def __init__(self, pool_size=HTTP_POOL_SIZE, idle_timeout=HTTP_IDLE_TIMEOUT, max_peers=HTTP_MAX_PEERS):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.max_peers = max_peers
+        # peer_ip -> {'session', 'last_used', 'users': threads holding it, 'evicted'}
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def _evict(self, now):
+        """Take idle and surplus entries out of the pool, returning the sessions now safe to close. Caller holds the lock."""
+        stale = []
+        # The dict is in least-recently-used order, so idle sessions are at the front
+        while self.sessions:
+            oldest_ip, oldest = next(iter(self.sessions.items()))
+            if now - oldest['last_used'] < self.idle_timeout and len(self.sessions) < self.max_peers:
+                break
+            del self.sessions[oldest_ip]
+            oldest['evicted'] = True
+            if not oldest['users']:
+                stale.append(oldest['session'])
+        return stale
+    
+    @contextmanager
+    def session(self, peer_ip):
+        """Check out the session for a peer, opening one if needed."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.sessions.pop(peer_ip, None)
+            stale = self._evict(now)
+            if entry is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                entry = {'session': session, 'last_used': now, 'users': 0, 'evicted': False}
+            entry['last_used'] = now
+            entry['users'] += 1
+            self.sessions[peer_ip] = entry
+        
+        for old in stale:
+            old.close()
+        try:
+            yield entry['session']
+        finally:
+            with self.lock:
+                entry['users'] -= 1
+                entry['last_used'] = time.monotonic()
+                closing = entry['evicted'] and not entry['users']
+            if closing:
+                entry['session'].close()
+    
+    def reap(self):
+        """Close sessions that have been idle for idle_timeout; run periodically."""
+        with self.lock:
+            stale = self._evict(time.monotonic())
+        for old in stale:
+            old.close()
+    
+    def close(self):
+        """Close every pooled connection; sessions still in use close when returned."""
+        with self.lock:
+            idle = []
+            for entry in self.sessions.values():
+                entry['evicted'] = True
+                if not entry['users']:
+                    idle.append(entry['session'])
+            self.sessions.clear()
+        for session in idle:
+            session.close()
+
+class PeerChannel:
+    """A long-lived WebSocket to one peer.
+    
+    Envelopes go out as binary frames tagged with a sequence number, and
+    the peer answers each with an ack carrying the status /message would
+    have returned, so several messages can be in flight at once. The
+    socket's keepalive pings detect a dead peer; close_callback(channel)
+    runs once when the channel closes for any reason.
+    """
+    
+    def __init__(self, peer_ip, user_id, close_callback=None):
+        self.peer_ip = peer_ip
+        self.close_callback = close_callback
+        self.pending = {}  # seq -> [Event, status]
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        
+        self.ws = websocket_connect(
+            f"ws://{peer_ip}:{NETWORK_PORT}/channel",
+            open_timeout=CHANNEL_CONNECT_TIMEOUT,
+            ping_interval=CHANNEL_PING_INTERVAL,
+            ping_timeout=NETWORK_TIMEOUT,
+            close_timeout=1
+        )
+        self.ws.send(json.dumps({"type": "hello", "user_id": user_id}))
+        
+        self.reader = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader.start()
+    
+    def _read_loop(self):
+        """Match incoming acks to the messages waiting for them."""
+        try:
+            for frame in self.ws:
+                ack = json.loads(frame)
+                if ack.get('type') != 'ack':
+                    continue
+                with self.lock:
+                    waiter = self.pending.pop(ack['seq'], None)
+                if waiter:
+                    waiter[1] = ack['status']
+                    waiter[0].set()
+        except Exception:
+            pass
+        finally:
+            self._closed()
+    
+    def _closed(self):
+        """Fail every message still waiting and report the closure once."""
+        with self.lock:
+            if self.closed.is_set():
+                return
+            self.closed.set()
+            waiters = list(self.pending.values())
+            self.pending.clear()
+        for waiter in waiters:
+            waiter[0].set()
+        if self.close_callback:
+            self.close_callback(self)
+    
+    def send(self, data, timeout=NETWORK_TIMEOUT):
+        """Send an encoded envelope and wait for its ack.
+        
+        Returns the peer's status code, or None if the channel failed and
+        the message should go over HTTP instead.
+        """
+        return self.send_many([data], timeout)[0]
+    
+    def send_many(self, items, timeout=NETWORK_TIMEOUT):
+        """Send several encoded envelopes back to back, then wait for all acks.
+        
+        Returns a status code per item, None where the channel failed.
+        """
+        with self.lock:
+            if self.closed.is_set():
+                return [None] * len(items)
+            waiters = []
+            for _ in items:
+                self.seq += 1
+                waiters.append((self.seq, [threading.Event(), None]))
+                self.pending[self.seq] = waiters[-1][1]
+        
+        try:
+            for (seq, _), data in zip(waiters, items):
+                self.ws.send(encode_channel_frame(seq, data))
+        except Exception:
+            self.close()
+        
+        deadline = time.monotonic() + timeout
+        for _, waiter in waiters:
+            if not waiter[0].wait(max(0, deadline - time.monotonic())):
+                # No ack in time: the connection is stalled, so drop it
+                self.close()
+                break
+        return [waiter[1] for _, waiter in waiters]
+    
+    def close(self):
+        """Close the channel."""
+        try:
+            self.ws.close()
+        except Exception:
+            pass
+        self._closed()
 
 class NetworkManager:
     """Handle all network-related operations."""
@@ -13,89 +223,429 @@ class NetworkManager:
     def __init__(self, app_instance):
         self.app = app_instance
         self.local_ip = self.get_local_ip()
+        self.http = PeerSessionPool()
+        self.peer_health = {}  # peer_id -> {'failures': int, 'next_check': monotonic time}
+        self.health_lock = threading.Lock()
+        self.status_callback = None
+        self.online_callback = None  # (peer_id) when a peer comes back online, e.g. Outbox.flush
+        self.channels = {}  # peer_ip -> open PeerChannel
+        self.channel_retry = {}  # peer_ip -> monotonic time before which no reconnect is tried
+        self.channel_lock = threading.Lock()
+        self.info_cache = {}  # (peer_ip, summary) -> (ETag, /info body)
+        self.public_keys = {}  # fingerprint -> parsed public key
     
     @staticmethod
     def get_local_ip():
         """Get the local IP address."""
         return socket.gethostbyname(socket.gethostname())
     
+    @staticmethod
+    def get_local_ips():
+        """Get this machine's IPv4 addresses across interfaces."""
+        ips = set()
+        try:
+            for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+                ips.add(info[4][0])
+        except socket.gaierror:
+            pass
+        # The default-route address, which the hostname lookup may miss;
+        # connecting a UDP socket sends nothing
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                s.connect(('10.255.255.255', 1))
+                ips.add(s.getsockname()[0])
+        except OSError:
+            pass
+        return sorted(ip for ip in ips if not ip.startswith('127.')) or [NetworkManager.get_local_ip()]
+    
+    def local_networks(self):
+        """Return the /24 network of each local interface as CIDR strings."""
+        networks = {str(ipaddress.ip_network(f"{ip}/24", strict=False)) for ip in self.get_local_ips()}
+        return sorted(networks)
+    
+    def scan_hosts(self, networks):
+        """Expand CIDR ranges into the host addresses to probe, skipping our own."""
+        local_ips = set(self.get_local_ips()) | {self.local_ip}
+        hosts = []
+        seen = set()
+        for cidr in networks:
+            for address in ipaddress.ip_network(cidr, strict=False).hosts():
+                ip = str(address)
+                if ip not in local_ips and ip not in seen:
+                    seen.add(ip)
+                    hosts.append(ip)
+                    if len(hosts) > SCAN_MAX_HOSTS:
+                        raise ValueError(f"Scan exceeds {SCAN_MAX_HOSTS} hosts")
+        return hosts
+    
+    def fetch_info(self, peer_ip, summary=False, timeout=NETWORK_TIMEOUT):
+        """GET a peer's /info, revalidating the copy we hold with If-None-Match.
+        
+        summary asks for the lightweight variant without public keys. An
+        unchanged peer answers 304 and the cached body is returned.
+        Returns None on any other status; raises on connection errors.
+        """
+        cache_key = (peer_ip, summary)
+        cached = self.info_cache.get(cache_key)
+        with self.http.session(peer_ip) as session:
+            response = session.get(
+                f"http://{peer_ip}:{NETWORK_PORT}/info",
+                params={"fields": "summary"} if summary else None,
+                headers={"If-None-Match": cached[0]} if cached else None,
+                timeout=timeout
+            )
+        if response.status_code == 304 and cached:
+            return cached[1]
+        if response.status_code != 200:
+            return None
+        
+        info = response.json()
+        if response.headers.get('ETag'):
+            self.info_cache[cache_key] = (response.headers['ETag'], info)
+        return info
+    
+    def probe_peer(self, peer_ip, timeout=NETWORK_TIMEOUT):
+        """Fetch a host's /info summary, returning None if it is not a SilentNet peer."""
+        try:
+            peer_info = self.fetch_info(peer_ip, summary=True, timeout=timeout)
+            if isinstance(peer_info, dict) and 'user_id' in peer_info:
+                return peer_info
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+        return None
+    
     def connect_to_peer(self, peer_ip):
         """Establish connection with a peer."""
         try:
-            response = requests.get(
-                f"http://{peer_ip}:{NETWORK_PORT}/info", 
-                timeout=NETWORK_TIMEOUT
-            )
-            if response.status_code == 200:
-                return response.json()
+            return self.fetch_info(peer_ip)
         except requests.exceptions.RequestException as e:
             raise ConnectionError(f"Failed to connect to {peer_ip}: {str(e)}")
-        return None
     
-    def send_message(self, peer_ip, payload):
-        """Send an encrypted message to a peer."""
+    def peer_keys(self, peer_info):
+        """Return a peer's parsed public keys and their fingerprints from its /info.
+        
+        Parsed keys are cached by fingerprint, so a key seen before costs
+        one hash and no PEM parsing. The X25519 key is only returned when
+        signed by the RSA key, whose fingerprint is the KEY HASH users check.
+        """
+        public_key_pem = peer_info['public_key'].encode()
+        fingerprint = key_fingerprint(public_key_pem)
+        if fingerprint not in self.public_keys:
+            self.public_keys[fingerprint] = deserialize_public_key(public_key_pem)
+        keys = {"public_key": self.public_keys[fingerprint], "fingerprint": fingerprint}
+        
+        if peer_info.get('x25519_public_key') and peer_info.get('x25519_signature'):
+            x25519_raw = base64.b64decode(peer_info['x25519_public_key'])
+            signature = base64.b64decode(peer_info['x25519_signature'])
+            if not verify_x25519_public_key(keys["public_key"], x25519_raw, signature):
+                return keys
+            x25519_fingerprint = key_fingerprint(x25519_raw)
+            if x25519_fingerprint not in self.public_keys:
+                self.public_keys[x25519_fingerprint] = deserialize_x25519_public_key(x25519_raw)
+            keys["x25519_public_key"] = self.public_keys[x25519_fingerprint]
+            keys["x25519_fingerprint"] = x25519_fingerprint
+        return keys
+    
+    def open_channel(self, peer_ip):
+        """Return the open channel to a peer, connecting if needed; None if unavailable."""
+        if not CHANNEL_ENABLED or websocket_connect is None:
+            return None
+        
+        now = time.monotonic()
+        with self.channel_lock:
+            channel = self.channels.get(peer_ip)
+            if channel and not channel.closed.is_set():
+                return channel
+            if self.channel_retry.get(peer_ip, 0) > now:
+                return None
+            # Reserve the attempt so concurrent senders use HTTP instead of connecting too
+            self.channel_retry[peer_ip] = now + CHANNEL_RETRY_INTERVAL
+        
         try:
-            response = requests.post(
-                f"http://{peer_ip}:{NETWORK_PORT}/message", 
-                json=payload, 
-                timeout=NETWORK_TIMEOUT
-            )
+            channel = PeerChannel(peer_ip, self.app.user_id, self._channel_closed)
+        except (OSError, WebSocketException):
+            # Peer unreachable or not speaking WebSocket; HTTP until the retry interval passes
+            return None
+        
+        with self.channel_lock:
+            self.channels[peer_ip] = channel
+            self.channel_retry.pop(peer_ip, None)
+        return channel
+    
+    def _channel_closed(self, channel):
+        """Forget a closed channel and have the monitor recheck its peer right away."""
+        with self.channel_lock:
+            if self.channels.get(channel.peer_ip) is channel:
+                del self.channels[channel.peer_ip]
+        
+        with self.health_lock:
+            for peer_id, peer_info in list(self.app.peers.items()):
+                if peer_info['ip'] == channel.peer_ip and peer_id in self.peer_health:
+                    self.peer_health[peer_id]['next_check'] = 0
+    
+    def send_message(self, peer_ip, envelope, binary=False, channel=False):
+        """Send an encrypted message envelope to a peer.
+        
+        Peers that advertise binary_wire get the compact binary envelope;
+        older peers get the base64 JSON payload. Peers that also advertise
+        channel get it over their WebSocket when it is open, falling back
+        to an HTTP POST.
+        """
+        if binary and channel:
+            peer_channel = self.open_channel(peer_ip)
+            if peer_channel:
+                status = peer_channel.send(encode_envelope(envelope))
+                if status is not None:
+                    return status == 200
+        
+        try:
+            with self.http.session(peer_ip) as session:
+                if binary:
+                    response = session.post(
+                        f"http://{peer_ip}:{NETWORK_PORT}/message", 
+                        data=encode_envelope(envelope), 
+                        headers={"Content-Type": WIRE_CONTENT_TYPE},
+                        timeout=NETWORK_TIMEOUT
+                    )
+                else:
+                    response = session.post(
+                        f"http://{peer_ip}:{NETWORK_PORT}/message", 
+                        json=envelope_to_json(envelope), 
+                        timeout=NETWORK_TIMEOUT
+                    )
             return response.status_code == 200
         except requests.exceptions.RequestException:
             return False
     
-    def scan_network(self, callback):
-        """Scan the local network for other SilentNet instances."""
-        def scan():
-            base_ip = '.'.join(self.local_ip.split('.')[:-1])
-            found_peers = []
-            
-            for i in range(1, 255):
-                test_ip = f"{base_ip}.{i}"
-                if test_ip == self.local_ip:
-                    continue
-                
+    def send_messages(self, peer_ip, envelopes, binary=False, channel=False, batch=False):
+        """Send several envelopes to one peer, returning a delivered flag per envelope.
+        
+        Over a channel the frames are pipelined; otherwise peers that
+        advertise batch get them all in one POST to /messages. Older peers
+        get one request per message.
+        """
+        if len(envelopes) == 1:
+            return [self.send_message(peer_ip, envelopes[0], binary, channel)]
+        
+        results = [None] * len(envelopes)
+        if binary and channel:
+            peer_channel = self.open_channel(peer_ip)
+            if peer_channel:
+                statuses = peer_channel.send_many([encode_envelope(envelope) for envelope in envelopes])
+                results = [None if status is None else status == 200 for status in statuses]
+        
+        # Whatever the channel did not acknowledge goes over HTTP
+        retry = [index for index, result in enumerate(results) if result is None]
+        if retry and batch:
+            for index, result in zip(retry, self._post_batch(peer_ip, [envelopes[i] for i in retry], binary)):
+                results[index] = result
+        elif retry:
+            for index in retry:
+                results[index] = self.send_message(peer_ip, envelopes[index], binary)
+        return [bool(result) for result in results]
+    
+    def _post_batch(self, peer_ip, envelopes, binary):
+        """POST envelopes to /messages and return a delivered flag per envelope."""
+        try:
+            with self.http.session(peer_ip) as session:
+                if binary:
+                    response = session.post(
+                        f"http://{peer_ip}:{NETWORK_PORT}/messages",
+                        data=encode_batch([encode_envelope(envelope) for envelope in envelopes]),
+                        headers={"Content-Type": WIRE_BATCH_CONTENT_TYPE},
+                        timeout=NETWORK_TIMEOUT
+                    )
+                else:
+                    response = session.post(
+                        f"http://{peer_ip}:{NETWORK_PORT}/messages",
+                        json=[envelope_to_json(envelope) for envelope in envelopes],
+                        timeout=NETWORK_TIMEOUT
+                    )
+            if response.status_code != 200:
+                return [False] * len(envelopes)
+            return [item['status'] == 200 for item in response.json()['results']]
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError):
+            return [False] * len(envelopes)
+    
+    def start_transfer(self, peer_ip, metadata):
+        """Start or resume a file transfer, returning the chunk indices the peer holds."""
+        try:
+            with self.http.session(peer_ip) as session:
+                response = session.post(
+                    f"http://{peer_ip}:{NETWORK_PORT}/transfer", 
+                    json=metadata, 
+                    timeout=NETWORK_TIMEOUT
+                )
+            response.raise_for_status()
+            return response.json()['received']
+        except requests.exceptions.RequestException as e:
+            raise ConnectionError(f"Failed to start transfer with {peer_ip}: {str(e)}")
+    
+    def upload_chunk(self, peer_ip, transfer_id, index, chunk):
+        """Upload one encrypted file chunk."""
+        try:
+            with self.http.session(peer_ip) as session:
+                response = session.put(
+                    f"http://{peer_ip}:{NETWORK_PORT}/transfer/{transfer_id}/{index}", 
+                    data=chunk, 
+                    headers={"Content-Type": "application/octet-stream"},
+                    timeout=NETWORK_TIMEOUT * 10
+                )
+            return response.status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+    
+    async def _scan(self, hosts, concurrency, found_callback):
+        """Probe hosts concurrently and return (ip, user_id) for each peer found."""
+        semaphore = asyncio.Semaphore(concurrency)
+        loop = asyncio.get_running_loop()
+        found_peers = []
+        
+        async def probe(ip):
+            # A TCP connect weeds out hosts without our port open in one round trip
+            async with semaphore:
                 try:
-                    response = requests.get(
-                        f"http://{test_ip}:{NETWORK_PORT}/info", 
-                        timeout=0.5
+                    _, writer = await asyncio.wait_for(
+                        asyncio.open_connection(ip, NETWORK_PORT), SCAN_CONNECT_TIMEOUT
                     )
-                    if response.status_code == 200:
-                        peer_info = response.json()
-                        found_peers.append((test_ip, peer_info['user_id']))
-                except:
+                except (OSError, asyncio.TimeoutError):
+                    return
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except OSError:
                     pass
             
+            peer_info = await loop.run_in_executor(None, self.probe_peer, ip)
+            if peer_info:
+                found_peers.append((ip, peer_info['user_id']))
+                if found_callback:
+                    found_callback(ip, peer_info)
+        
+        await asyncio.gather(*(probe(ip) for ip in hosts))
+        return found_peers
+    
+    def scan_network(self, callback, networks=None, found_callback=None, error_callback=None,
+                     concurrency=SCAN_CONCURRENCY):
+        """Scan the network for other SilentNet instances.
+        
+        networks is a list of CIDR ranges, defaulting to SCAN_NETWORKS or
+        the /24 of every local interface. found_callback(ip, peer_info)
+        is called as each peer answers; callback(found_peers) gets the
+        full list of (ip, user_id) when the scan completes.
+        """
+        def scan():
+            try:
+                hosts = self.scan_hosts(networks or SCAN_NETWORKS or self.local_networks())
+            except ValueError as e:
+                if error_callback:
+                    error_callback(e)
+                return
+            found_peers = asyncio.run(self._scan(hosts, concurrency, found_callback))
             callback(found_peers)
         
         thread = threading.Thread(target=scan, daemon=True)
         thread.start()
+        return thread
+    
+    def ping_peer(self, peer_ip, timeout=PING_TIMEOUT):
+        """Check whether a peer answers /ping."""
+        try:
+            with self.http.session(peer_ip) as session:
+                response = session.get(f"http://{peer_ip}:{NETWORK_PORT}/ping", timeout=timeout)
+            return response.status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+    
+    def check_peer(self, peer_info):
+        """Probe a peer for the monitor; an open channel counts as online without a request.
+        
+        Reachable peers that support channels get one opened, so their
+        presence is pushed from then on instead of polled.
+        """
+        peer_ip = peer_info['ip']
+        with self.channel_lock:
+            channel = self.channels.get(peer_ip)
+        if channel and not channel.closed.is_set():
+            return True
+        
+        online = self.ping_peer(peer_ip)
+        if online and "channel" in peer_info.get('capabilities', []):
+            self.open_channel(peer_ip)
+        return online
+    
+    def _record_status(self, peer_id, peer_info, online):
+        """Update a peer's status and schedule its next probe. Returns True if the status changed."""
+        now = time.monotonic()
+        with self.health_lock:
+            health = self.peer_health.setdefault(peer_id, {'failures': 0, 'next_check': 0})
+            if online:
+                health['failures'] = 0
+                health['next_check'] = now + STATUS_CHECK_INTERVAL
+                peer_info['last_seen'] = datetime.now()
+            else:
+                # Exponential backoff with jitter so offline peers cost little
+                # and recovering peers are not probed in lockstep
+                health['failures'] += 1
+                backoff = min(STATUS_CHECK_INTERVAL * 2 ** (health['failures'] - 1), PEER_BACKOFF_MAX)
+                health['next_check'] = now + random.uniform(backoff / 2, backoff)
+            
+            status = 'online' if online else 'offline'
+            changed = peer_info.get('status') != status
+            peer_info['status'] = status
+        if changed and online and self.online_callback:
+            self.online_callback(peer_id)
+        return changed
+    
+    def mark_seen(self, peer_id):
+        """Mark a peer online because traffic arrived from it, without probing."""
+        peer_info = self.app.peers.get(peer_id)
+        if peer_info and self._record_status(peer_id, peer_info, True) and self.status_callback:
+            self.status_callback()
     
     def start_peer_monitor(self, peers, update_callback):
-        """Monitor peer connection status."""
+        """Monitor peer connection status.
+        
+        Due peers are pinged concurrently; online peers are rechecked every
+        STATUS_CHECK_INTERVAL and offline peers with growing backoff.
+        Peers with an open channel count as online without a ping, and are
+        rechecked as soon as the channel drops. update_callback only fires
+        when some peer's status changed.
+        """
+        self.status_callback = update_callback
+        
         def monitor():
-            import time
-            while True:
-                for peer_id, peer_info in peers.items():
-                    try:
-                        response = requests.get(
-                            f"http://{peer_info['ip']}:{NETWORK_PORT}/info", 
-                            timeout=1
-                        )
-                        if response.status_code == 200:
-                            peer_info['status'] = 'online'
-                            peer_info['last_seen'] = datetime.now()
-                        else:
-                            peer_info['status'] = 'offline'
-                    except:
-                        peer_info['status'] = 'offline'
-                
-                update_callback()
-                time.sleep(STATUS_CHECK_INTERVAL)
+            with ThreadPoolExecutor(max_workers=PING_CONCURRENCY, thread_name_prefix='ping') as executor:
+                while True:
+                    now = time.monotonic()
+                    with self.health_lock:
+                        due = [
+                            (peer_id, peer_info) for peer_id, peer_info in list(peers.items())
+                            if self.peer_health.get(peer_id, {'next_check': 0})['next_check'] <= now
+                        ]
+                    
+                    results = executor.map(lambda peer: self.check_peer(peer[1]), due)
+                    changed = False
+                    for (peer_id, peer_info), online in zip(due, results):
+                        changed |= self._record_status(peer_id, peer_info, online)
+                    if changed:
+                        update_callback()
+                    self.http.reap()
+                    
+                    # Wake at least every second so newly added peers are probed promptly
+                    time.sleep(1)
         
         thread = threading.Thread(target=monitor, daemon=True)
         thread.start()
     
+    def close(self):
+        """Close every channel and pooled connection."""
+        with self.channel_lock:
+            channels = list(self.channels.values())
+        for channel in channels:
+            channel.close()
+        self.http.close()
+    
     def export_public_key(self, user_id, public_key_pem, key_hash):
         """Export public key to a JSON file."""
         key_data = {
@@ -0,0 +1,243 @@
+# outbox.py - Store-and-Forward Outbound Queue
+
+import random
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from config import OUTBOX_WORKERS, OUTBOX_RETRY_BASE, OUTBOX_RETRY_MAX, OUTBOX_BATCH_SIZE, OUTBOX_MAX_ATTEMPTS
+
+class Outbox:
+    """Persist outgoing messages per peer and deliver them in the background."""
+    
+    def __init__(self, user_id, deliver, path=None, workers=OUTBOX_WORKERS, retry_base=OUTBOX_RETRY_BASE,
+                 retry_max=OUTBOX_RETRY_MAX, batch_size=OUTBOX_BATCH_SIZE, max_attempts=OUTBOX_MAX_ATTEMPTS,
+                 delivered_callback=None, recovered_callback=None, failed_callback=None, dead_callback=None):
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.max_attempts = max_attempts
+        self.delivered_callback = delivered_callback  # (peer_id, msg_ids) once the peer acknowledged them
+        self.recovered_callback = recovered_callback  # (peer_id) when a peer that was failing accepts messages again
+        self.failed_callback = failed_callback  # (peer_id, pending) when a peer becomes unreachable
+        self.dead_callback = dead_callback  # (peer_id, msg_ids, reason) when messages are given up on
+        
+        self.conn = sqlite3.connect(path or f'{user_id}_outbox.db', check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.setup_database()
+        
+        self.lock = threading.Lock()  # guards the connection and the state below
+        self.active = set()  # peers with a delivery in progress
+        self.retry_at = {}  # peer_id -> monotonic time of the next attempt
+        self.failures = {}  # peer_id -> consecutive failed attempts
+        self.stopped = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='outbox')
+        self.timer = threading.Thread(target=self._retry_loop, daemon=True)
+        self.timer.start()
+    
+    def setup_database(self):
+        """Create the outbox and dead_letter tables if they don't exist."""
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY,
+                peer_id TEXT,
+                message TEXT,
+                priority INTEGER DEFAULT 0,
+                auto_delete INTEGER DEFAULT 0,
+                created TEXT,
+                attempts INTEGER DEFAULT 0,
+                msg_id TEXT
+            )
+        ''')
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(outbox)')]
+        if 'msg_id' not in columns:
+            # Outboxes from before message ids: give queued messages one now
+            self.conn.execute('ALTER TABLE outbox ADD COLUMN msg_id TEXT')
+            self.conn.execute('UPDATE outbox SET msg_id = lower(hex(randomblob(8))) WHERE msg_id IS NULL')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_peer ON outbox (peer_id, id)')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                id INTEGER PRIMARY KEY,
+                peer_id TEXT,
+                message TEXT,
+                priority INTEGER,
+                auto_delete INTEGER,
+                created TEXT,
+                attempts INTEGER,
+                msg_id TEXT,
+                error TEXT,
+                failed TEXT
+            )
+        ''')
+        self.conn.commit()
+    
+    def _oldest(self, peer_id, limit=1):
+        """Return a peer's oldest queued messages, oldest first. Caller holds the lock."""
+        return self.conn.execute('''
+            SELECT id, message, priority, auto_delete, created, msg_id FROM outbox
+            WHERE peer_id = ? ORDER BY id LIMIT ?
+        ''', (peer_id, limit)).fetchall()
+    
+    def enqueue(self, peer_ids, message, priority=False, auto_delete=False):
+        """Queue a message for one or more peers and start delivering it. Returns its msg_id."""
+        created = datetime.now().isoformat()
+        # One id for every copy; receivers track ids per sender
+        msg_id = secrets.token_hex(8)
+        with self.lock:
+            with self.conn:
+                row_ids = {
+                    peer_id: self.conn.execute('''
+                        INSERT INTO outbox (peer_id, message, priority, auto_delete, created, msg_id)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', (peer_id, message, int(priority), int(auto_delete), created, msg_id)).lastrowid
+                    for peer_id in peer_ids
+                }
+            # Peers that are idle with nothing older queued get this message in one
+            # batch, so it can be encrypted once for all of them; the rest pick it
+            # up in order from their queue
+            ready = [
+                peer_id for peer_id in peer_ids
+                if peer_id not in self.active and peer_id not in self.retry_at
+                and self._oldest(peer_id)[0][0] == row_ids[peer_id]
+            ]
+            self.active.update(ready)
+        
+        if ready:
+            self.executor.submit(self._send_batch, ready, row_ids, message, priority, auto_delete, created, msg_id)
+        return msg_id
+    
+    def _attempt(self, peer_ids, messages):
+        """Call deliver. Returns (results, error).
+        
+        A network error is an ordinary failed attempt, retried later; any
+        other exception would fail the same way on every retry, so it is
+        returned for the messages to be dead-lettered.
+        """
+        try:
+            return self.deliver(peer_ids, [
+                (message, bool(priority), bool(auto_delete), created, msg_id)
+                for message, priority, auto_delete, created, msg_id in messages
+            ]), None
+        except OSError:
+            return {}, None
+        except Exception as e:
+            return {}, e
+    
+    def _send_batch(self, peer_ids, row_ids, message, priority, auto_delete, created, msg_id):
+        """Worker task: deliver a new message to several idle peers at once."""
+        results, error = self._attempt(peer_ids, [(message, priority, auto_delete, created, msg_id)])
+        for peer_id in peer_ids:
+            self._record(peer_id, [(row_ids[peer_id], msg_id)], results.get(peer_id, []), error)
+            # Each peer drains on its own worker so a slow peer does not hold up the rest
+            self.executor.submit(self._drain, peer_id)
+    
+    def _drain(self, peer_id):
+        """Worker task: deliver a peer's queued messages in order until empty or failing."""
+        while True:
+            with self.lock:
+                rows = []
+                if not self.stopped.is_set() and peer_id not in self.retry_at:
+                    rows = self._oldest(peer_id, self.batch_size)
+                if not rows:
+                    self.active.discard(peer_id)
+                    return
+            
+            results, error = self._attempt([peer_id], [row[1:] for row in rows])
+            self._record(peer_id, [(row[0], row[5]) for row in rows], results.get(peer_id, []), error)
+    
+    def _record(self, peer_id, rows, results, error=None):
+        """Settle an attempt at (row id, msg_id) rows.
+        
+        Acknowledged messages are removed. The rest are retried with
+        backoff, unless error is set or they reached max_attempts, in
+        which case they are dead-lettered.
+        """
+        delivered = [row for row, ok in zip(rows, results) if ok]
+        failed = [row for row in rows if row not in delivered]
+        with self.lock:
+            with self.conn:
+                self.conn.executemany('DELETE FROM outbox WHERE id = ?', [(row_id,) for row_id, _ in delivered])
+                self.conn.executemany(
+                    'UPDATE outbox SET attempts = attempts + 1 WHERE id = ?', [(row_id,) for row_id, _ in failed]
+                )
+                if error is not None:
+                    dead, reason = failed, f"{type(error).__name__}: {error}"
+                else:
+                    exhausted = {
+                        row_id for (row_id,) in self.conn.execute(
+                            f"SELECT id FROM outbox WHERE attempts >= ? AND id IN ({','.join('?' * len(failed))})",
+                            (self.max_attempts, *[row_id for row_id, _ in failed])
+                        )
+                    } if failed else set()
+                    dead = [row for row in failed if row[0] in exhausted]
+                    reason = f"not delivered after {self.max_attempts} attempts"
+                self._dead_letter([row_id for row_id, _ in dead], reason)
+            
+            retrying = [row for row in failed if row not in dead]
+            if not retrying:
+                recovered = self.failures.pop(peer_id, 0) > 0 and bool(delivered)
+                failures = 0
+            else:
+                failures = self.failures[peer_id] = self.failures.get(peer_id, 0) + 1
+                backoff = min(self.retry_base * 2 ** (failures - 1), self.retry_max)
+                self.retry_at[peer_id] = time.monotonic() + random.uniform(backoff / 2, backoff)
+                recovered = False
+        
+        if delivered and self.delivered_callback:
+            self.delivered_callback(peer_id, [msg_id for _, msg_id in delivered])
+        if dead and self.dead_callback:
+            self.dead_callback(peer_id, [msg_id for _, msg_id in dead], reason)
+        if recovered and self.recovered_callback:
+            self.recovered_callback(peer_id)
+        if failures == 1 and self.failed_callback:
+            self.failed_callback(peer_id, self.pending(peer_id))
+    
+    def _dead_letter(self, row_ids, reason):
+        """Move messages from the outbox to the dead_letter table. Caller holds the lock and a transaction."""
+        failed = datetime.now().isoformat()
+        for row_id in row_ids:
+            self.conn.execute('''
+                INSERT INTO dead_letter
+                    (peer_id, message, priority, auto_delete, created, attempts, msg_id, error, failed)
+                SELECT peer_id, message, priority, auto_delete, created, attempts, msg_id, ?, ?
+                FROM outbox WHERE id = ?
+            ''', (reason, failed, row_id))
+            self.conn.execute('DELETE FROM outbox WHERE id = ?', (row_id,))
+    
+    def _retry_loop(self):
+        """Restart delivery for peers whose backoff has elapsed."""
+        while not self.stopped.wait(1):
+            now = time.monotonic()
+            with self.lock:
+                due = [peer_id for peer_id, at in self.retry_at.items() if at <= now and peer_id not in self.active]
+                for peer_id in due:
+                    del self.retry_at[peer_id]
+                    self.active.add(peer_id)
+            for peer_id in due:
+                self.executor.submit(self._drain, peer_id)
+    
+    def flush(self, peer_id):
+        """Retry a peer's queued messages now, e.g. when it comes back online."""
+        with self.lock:
+            self.retry_at.pop(peer_id, None)
+            if peer_id in self.active or self.stopped.is_set() or not self._oldest(peer_id):
+                return
+            self.active.add(peer_id)
+        self.executor.submit(self._drain, peer_id)
+    
+    def pending(self, peer_id=None):
+        """Count queued messages, for one peer or all."""
+        with self.lock:
+            if peer_id:
+                return self.conn.execute('SELECT COUNT(*) FROM outbox WHERE peer_id = ?', (peer_id,)).fetchone()[0]
+            return self.conn.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
+    
+    def close(self):
+        """Stop delivering; undelivered messages stay queued for the next run."""
+        self.stopped.set()
+        self.timer.join()
+        self.executor.shutdown(wait=True)
+        self.conn.close()
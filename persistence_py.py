@@ -0,0 +1,137 @@
+# persistence.py - Background Message Persistence
+
+import queue
+import threading
+import time
+from config import PERSIST_QUEUE_SIZE, PERSIST_DURABILITY
+
+DURABILITY_MODES = ("async", "commit")
+
+# Queued to stop the writer thread
+_STOP = object()
+
+class PersistenceQueue:
+    """Move message writes off the network and UI threads.
+    
+    save_message only enqueues; a single writer thread drains the queue
+    into MessageDatabase, so callers never wait on disk. The queue is
+    bounded: when the writer falls behind, callers block until there is
+    room, and the time spent blocked shows up in metrics().
+    
+    In "async" durability mode save_message returns as soon as the
+    message is queued and the database's group commit decides when it
+    reaches disk; failed writes and group commits are only counted in
+    metrics(). In
+    "commit" mode it returns once the message has been committed,
+    raising if the write failed.
+    """
+    
+    def __init__(self, db, maxsize=PERSIST_QUEUE_SIZE, durability=PERSIST_DURABILITY):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode {durability!r}")
+        self.db = db
+        self.durability = durability
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.stats = {
+            'enqueued': 0,
+            'written': 0,
+            'errors': 0,
+            'batches': 0,
+            'blocked_puts': 0,
+            'blocked_seconds': 0.0,
+            'max_depth': 0,
+            'last_batch_seconds': 0.0
+        }
+        self.stats_lock = threading.Lock()
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+    
+    def save_message(self, sender, recipient, message, key, iv, priority=0, auto_delete=0):
+        """Queue a message for storage, waiting for the commit in "commit" mode."""
+        done = threading.Event() if self.durability == "commit" else None
+        item = {
+            'args': (sender, recipient, message, key, iv, priority, auto_delete),
+            'done': done,
+            'error': None
+        }
+        
+        try:
+            self.queue.put_nowait(item)
+            blocked = 0.0
+        except queue.Full:
+            # Backpressure: wait for the writer to make room
+            start = time.perf_counter()
+            self.queue.put(item)
+            blocked = time.perf_counter() - start
+        
+        with self.stats_lock:
+            self.stats['enqueued'] += 1
+            self.stats['max_depth'] = max(self.stats['max_depth'], self.queue.qsize())
+            if blocked:
+                self.stats['blocked_puts'] += 1
+                self.stats['blocked_seconds'] += blocked
+        
+        if done:
+            done.wait()
+            if item['error']:
+                raise item['error']
+    
+    def _write_loop(self):
+        """Drain the queue into the database until stopped."""
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not _STOP and len(batch) < self.db.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            stopping = batch[-1] is _STOP
+            items = batch[:-1] if stopping else batch
+            if items:
+                self._write(items)
+            if stopping:
+                return
+    
+    def _write(self, items):
+        """Hand one batch to the database and release any waiting callers."""
+        start = time.perf_counter()
+        error = None
+        try:
+            for item in items:
+                self.db.save_message(*item['args'])
+            if self.durability == "commit":
+                self.db.flush()
+        except Exception as e:
+            error = e
+        elapsed = time.perf_counter() - start
+        
+        with self.stats_lock:
+            self.stats['batches'] += 1
+            self.stats['last_batch_seconds'] = elapsed
+            if error:
+                self.stats['errors'] += len(items)
+            else:
+                self.stats['written'] += len(items)
+        
+        for item in items:
+            item['error'] = error
+            if item['done']:
+                item['done'].set()
+    
+    def metrics(self):
+        """Return queue depth and throughput counters."""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['depth'] = self.queue.qsize()
+        stats['capacity'] = self.queue.maxsize
+        stats['durability'] = self.durability
+        # Group commits the database's background flusher could not complete
+        stats['flush_errors'] = self.db.flush_errors
+        stats['last_flush_error'] = str(self.db.last_flush_error) if self.db.last_flush_error else None
+        return stats
+    
+    def close(self):
+        """Write everything queued, then stop the writer thread."""
+        self.queue.put(_STOP)
+        self.writer.join()
@@ -0,0 +1,176 @@
+# session.py - Session Key Management
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from encryption import (
+    generate_session_key, wrap_session_key, unwrap_session_key,
+    encrypt_with_session_key, decrypt_with_session_key, unwrap_content_key
+)
+from config import (
+    SESSION_REKEY_INTERVAL, SESSION_REKEY_MESSAGES, SESSION_CACHE_SIZE,
+    CIPHER_SUITES, SUITE_RSA, SUITE_X25519
+)
+
+def negotiate_suite(capabilities):
+    """Pick the preferred cipher suite a peer supports, or None for legacy peers."""
+    for suite in CIPHER_SUITES:
+        if suite in capabilities:
+            return suite
+    if "session_keys" in capabilities:
+        return SUITE_RSA
+    return None
+
+class SessionKeyError(Exception):
+    """Raised when a message references a session key we do not hold."""
+
+class DecryptionError(Exception):
+    """Raised when an incoming message cannot be decrypted."""
+
+class SessionManager:
+    """Cache per-peer session keys so key wrapping only runs once per session."""
+
+    def __init__(self, private_key=None, x25519_private_key=None, cache_size=SESSION_CACHE_SIZE,
+                 rekey_interval=SESSION_REKEY_INTERVAL, rekey_messages=SESSION_REKEY_MESSAGES):
+        self.private_key = private_key
+        self.x25519_private_key = x25519_private_key
+        self.unwrapper = None  # optional callable(suite, wrapped_key), e.g. DecryptPool
+        self.cache_size = cache_size
+        self.rekey_interval = rekey_interval
+        self.rekey_messages = rekey_messages
+        self.outbound = OrderedDict()  # (peer_id, fingerprint) -> session
+        self.inbound = OrderedDict()   # (peer_id, key_id) -> session
+        self.lock = threading.Lock()
+
+    def _expired(self, session, now):
+        """Check whether an outbound session is due for rekeying."""
+        return (session['count'] >= self.rekey_messages or
+                now - session['created'] >= self.rekey_interval)
+
+    def _store(self, cache, cache_key, session):
+        """Insert a session and evict the least recently used entries."""
+        cache[cache_key] = session
+        cache.move_to_end(cache_key)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _outbound_session(self, peer_id, public_key, fingerprint, suite):
+        """Return the current outbound session for a peer, rekeying if needed."""
+        now = time.monotonic()
+        cache_key = (peer_id, fingerprint)
+        session = self.outbound.get(cache_key)
+
+        if session is None or self._expired(session, now):
+            # Drop sessions bound to an older identity key of the same peer
+            for stale in [k for k in self.outbound if k[0] == peer_id]:
+                del self.outbound[stale]
+
+            key = generate_session_key()
+            session = {
+                'key_id': os.urandom(8).hex(),
+                'suite': suite,
+                'key': key,
+                'wrapped_key': wrap_session_key(public_key, key),
+                'created': now,
+                'count': 0,
+                'confirmed': False
+            }
+            self._store(self.outbound, cache_key, session)
+        else:
+            self.outbound.move_to_end(cache_key)
+
+        return session
+
+    def encrypt(self, peer_id, public_key, fingerprint, message, suite=SUITE_RSA):
+        """Encrypt a message for a peer.
+
+        The public key must match the suite (RSA or X25519). Returns
+        (key_id, wrapped_key, nonce, ciphertext); the wrapped key is None
+        once the peer has confirmed receipt of the session key.
+        """
+        with self.lock:
+            session = self._outbound_session(peer_id, public_key, fingerprint, suite)
+            session['count'] += 1
+            key_id = session['key_id']
+            key = session['key']
+            suite = session['suite']
+            wrapped_key = None if session['confirmed'] else session['wrapped_key']
+
+        nonce, ciphertext = encrypt_with_session_key(key, message, key_id.encode(), suite)
+        return key_id, wrapped_key, nonce, ciphertext
+
+    def broadcast_key(self, peer_id, fingerprint, suite):
+        """Return (key_id, key) of the peer's confirmed session for broadcasts.
+        
+        Counts as one use of the session. Returns None when there is no
+        current session the peer is known to hold, so the caller should
+        encrypt to the peer individually instead.
+        """
+        with self.lock:
+            session = self.outbound.get((peer_id, fingerprint))
+            if (session is None or not session['confirmed'] or session['suite'] != suite or
+                    self._expired(session, time.monotonic())):
+                return None
+            self.outbound.move_to_end((peer_id, fingerprint))
+            session['count'] += 1
+            return session['key_id'], session['key']
+
+    def confirm(self, peer_id, key_id):
+        """Mark a session key as delivered so it is no longer attached."""
+        with self.lock:
+            for (session_peer, _), session in self.outbound.items():
+                if session_peer == peer_id and session['key_id'] == key_id:
+                    session['confirmed'] = True
+
+    def invalidate(self, peer_id):
+        """Forget outbound sessions for a peer, forcing a rekey."""
+        with self.lock:
+            for stale in [k for k in self.outbound if k[0] == peer_id]:
+                del self.outbound[stale]
+
+    def unwrap_key(self, suite, wrapped_key):
+        """Unwrap a key sent to us, on the worker pool when one is attached."""
+        if self.unwrapper:
+            return self.unwrapper(suite, wrapped_key)
+        private_key = self.x25519_private_key if suite == SUITE_X25519 else self.private_key
+        return unwrap_session_key(private_key, wrapped_key)
+
+    def _inbound_key(self, peer_id, key_id, wrapped_key, suite):
+        """Return an inbound session key, unwrapping and caching a new key if attached."""
+        cache_key = (peer_id, key_id)
+        now = time.monotonic()
+
+        with self.lock:
+            session = self.inbound.get(cache_key)
+            if session and now - session['created'] >= self.rekey_interval * 2:
+                del self.inbound[cache_key]
+                session = None
+            if session:
+                self.inbound.move_to_end(cache_key)
+
+        if session is None:
+            if not wrapped_key:
+                raise SessionKeyError(f"Unknown session key {key_id} from {peer_id}")
+            # Unwrapping runs outside the lock so other peers are not stalled
+            session = {'key': self.unwrap_key(suite, wrapped_key), 'created': now}
+            with self.lock:
+                self._store(self.inbound, cache_key, session)
+
+        return session['key']
+
+    def decrypt(self, peer_id, key_id, wrapped_key, nonce, ciphertext, suite=SUITE_RSA):
+        """Decrypt a session message, unwrapping and caching a new key if attached."""
+        key = self._inbound_key(peer_id, key_id, wrapped_key, suite)
+        return decrypt_with_session_key(key, nonce, ciphertext, key_id.encode(), suite)
+
+    def decrypt_broadcast(self, peer_id, key_id, wrapped_content_key, nonce, ciphertext, suite=SUITE_RSA):
+        """Decrypt a broadcast whose content key is wrapped under our session with the sender."""
+        content_key = unwrap_content_key(self._inbound_key(peer_id, key_id, None, suite), wrapped_content_key, key_id, suite)
+        return decrypt_with_session_key(content_key, nonce, ciphertext, None, suite)
+
+    def clear(self):
+        """Forget all cached session keys."""
+        with self.lock:
+            self.outbound.clear()
+            self.inbound.clear()
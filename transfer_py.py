@@ -0,0 +1,327 @@
+# transfer.py - Chunked File Transfer
+
+import os
+import re
+import json
+import time
+import base64
+import hashlib
+import threading
+from cryptography.exceptions import InvalidTag
+from encryption import generate_session_key, wrap_session_key, encrypt_stream, decrypt_chunk
+from config import (
+    TRANSFER_CHUNK_SIZE, TRANSFER_MAX_CHUNK_SIZE, TRANSFER_MAX_FILE_SIZE, TRANSFER_NONCE_PREFIX_SIZE,
+    TRANSFER_DIR, TRANSFER_RETRIES, SUITE_X25519
+)
+
+TRANSFER_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+class TransferError(Exception):
+    """Raised when a transfer is invalid or cannot continue."""
+
+class TransferTooLarge(TransferError):
+    """Raised when an incoming file exceeds TRANSFER_MAX_FILE_SIZE."""
+
+class TransferManager:
+    """Send and receive files as resumable, chunk-encrypted transfers.
+
+    Files are split into fixed-size chunks, each encrypted and
+    authenticated on its own, so only one chunk is held in memory at a
+    time on either side. The receiver records which chunks it holds;
+    the sender asks for that list before uploading and skips chunks
+    already delivered, so an interrupted transfer resumes where it
+    stopped. Both sides keep their transfer state on disk, so resuming
+    also works after either one restarts; the sender's copy of the
+    transfer key is stored wrapped to its own X25519 key.
+    """
+
+    def __init__(self, app_instance, directory=TRANSFER_DIR, chunk_size=TRANSFER_CHUNK_SIZE):
+        self.app = app_instance
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.outgoing = {}  # (peer_id, key fingerprint, path, size, mtime) -> transfer state
+        self.incoming = {}  # transfer_id -> transfer state
+        self.lock = threading.Lock()
+
+    def send_file(self, peer_id, peer_info, path, progress_callback=None, done_callback=None):
+        """Send a file to a peer in the background.
+
+        progress_callback(chunks_sent, chunk_count) is called after each
+        chunk; done_callback(error) is called at the end with None on
+        success. Calling send_file again for the same unchanged file
+        resumes an interrupted transfer.
+        """
+        def send():
+            try:
+                self._send(peer_id, peer_info, path, progress_callback)
+            except Exception as e:
+                if done_callback:
+                    done_callback(e)
+                return
+            if done_callback:
+                done_callback(None)
+
+        thread = threading.Thread(target=send, daemon=True)
+        thread.start()
+        return thread
+
+    def _outgoing_path(self, state_key):
+        """Return where the state of an outgoing transfer is saved."""
+        digest = hashlib.sha256(json.dumps(state_key).encode()).hexdigest()[:32]
+        return os.path.join(self.directory, f".out-{digest}.json")
+
+    def _load_outgoing(self, state_key):
+        """Return an outgoing transfer's state saved by an earlier run, or None."""
+        try:
+            with open(self._outgoing_path(state_key)) as f:
+                saved = json.load(f)
+            if tuple(saved['state_key']) != state_key:
+                return None
+            key = self.app.sessions.unwrap_key(SUITE_X25519, base64.b64decode(saved['key']))
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, InvalidTag):
+            # Unreadable, or saved under an X25519 key we no longer have: start over
+            return None
+        return {
+            'state_key': state_key,
+            'key': key,
+            'nonce_prefix': base64.b64decode(saved['metadata']['nonce_prefix']),
+            'suite': saved['metadata']['suite'],
+            'metadata': saved['metadata']
+        }
+
+    def _save_outgoing(self, state):
+        """Save an outgoing transfer's state so a restarted sender can resume it."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._outgoing_path(state['state_key']), 'w') as f:
+            json.dump({
+                'state_key': state['state_key'],
+                'key': base64.b64encode(wrap_session_key(self.app.x25519_public_key, state['key'])).decode(),
+                'metadata': state['metadata']
+            }, f)
+
+    def _outgoing_state(self, peer_id, peer_info, path, stat):
+        """Return the transfer state for a file, reusing it when resuming."""
+        suite, public_key, fingerprint = self.app.peer_suite_key(peer_info)
+        # A peer that changed keys cannot unwrap the old transfer key, so it gets a new transfer
+        state_key = (peer_id, fingerprint, os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            state = self.outgoing.get(state_key) or self._load_outgoing(state_key)
+            if state is None:
+                if not suite:
+                    raise TransferError(f"{peer_id} does not support file transfer")
+                key = generate_session_key()
+                chunk_count = max(1, -(-stat.st_size // self.chunk_size))
+                state = {
+                    'state_key': state_key,
+                    'key': key,
+                    'nonce_prefix': os.urandom(TRANSFER_NONCE_PREFIX_SIZE),
+                    'suite': suite,
+                    'metadata': {
+                        'transfer_id': os.urandom(16).hex(),
+                        'sender_id': self.app.user_id,
+                        'filename': os.path.basename(path),
+                        'size': stat.st_size,
+                        'chunk_size': self.chunk_size,
+                        'chunk_count': chunk_count,
+                        'suite': suite,
+                        'key': base64.b64encode(wrap_session_key(public_key, key)).decode()
+                    }
+                }
+                state['metadata']['nonce_prefix'] = base64.b64encode(state['nonce_prefix']).decode()
+                self._save_outgoing(state)
+            self.outgoing[state_key] = state
+        return state
+
+    def _send(self, peer_id, peer_info, path, progress_callback):
+        """Upload every chunk the peer does not already hold."""
+        state = self._outgoing_state(peer_id, peer_info, path, os.stat(path))
+        metadata = state['metadata']
+        transfer_id = metadata['transfer_id']
+        chunk_count = metadata['chunk_count']
+
+        received = set(self.app.network.start_transfer(peer_info['ip'], metadata))
+        missing = [index for index in range(chunk_count) if index not in received]
+
+        if missing:
+            start = missing[0]
+            with open(path, 'rb') as f:
+                f.seek(start * self.chunk_size)
+                chunks = encrypt_stream(
+                    state['key'], state['nonce_prefix'], f, self.chunk_size, state['suite'], start
+                )
+                for index, ciphertext in chunks:
+                    if index in received:
+                        continue
+                    self._upload(peer_info['ip'], transfer_id, index, ciphertext)
+                    received.add(index)
+                    if progress_callback:
+                        progress_callback(len(received), chunk_count)
+
+        with self.lock:
+            self.outgoing.pop(state['state_key'], None)
+            try:
+                os.remove(self._outgoing_path(state['state_key']))
+            except FileNotFoundError:
+                pass
+
+    def _upload(self, peer_ip, transfer_id, index, ciphertext):
+        """Upload one chunk, retrying with exponential backoff."""
+        for attempt in range(TRANSFER_RETRIES):
+            if self.app.network.upload_chunk(peer_ip, transfer_id, index, ciphertext):
+                return
+            time.sleep(min(2 ** attempt, 30))
+        raise TransferError(f"Chunk {index} failed after {TRANSFER_RETRIES} attempts")
+
+    def _paths(self, transfer_id):
+        """Return the (data, metadata, index log) paths of an incoming transfer."""
+        base = os.path.join(self.directory, f".{transfer_id}")
+        return base + '.part', base + '.json', base + '.idx'
+
+    def start_incoming(self, metadata):
+        """Register an incoming transfer and return the chunk indices already held."""
+        transfer_id = metadata.get('transfer_id', '')
+        if not TRANSFER_ID_PATTERN.match(transfer_id):
+            raise TransferError("Invalid transfer id")
+
+        with self.lock:
+            state = self.incoming.get(transfer_id)
+            if state is None:
+                state = self._load_incoming(transfer_id, metadata)
+                self.incoming[transfer_id] = state
+            return sorted(state['received'])
+
+    def _check_metadata(self, metadata):
+        """Raise TransferError unless transfer metadata describes a valid, acceptable file."""
+        if not isinstance(metadata['size'], int) or metadata['size'] < 0:
+            raise TransferError("Invalid file size")
+        if metadata['size'] > TRANSFER_MAX_FILE_SIZE:
+            raise TransferTooLarge(f"File exceeds {TRANSFER_MAX_FILE_SIZE} bytes")
+        if not isinstance(metadata['chunk_size'], int) or not 0 < metadata['chunk_size'] <= TRANSFER_MAX_CHUNK_SIZE:
+            raise TransferError("Invalid chunk size")
+        if metadata['chunk_count'] != max(1, -(-metadata['size'] // metadata['chunk_size'])):
+            raise TransferError("Chunk count does not match file size")
+        if len(base64.b64decode(metadata['nonce_prefix'])) != TRANSFER_NONCE_PREFIX_SIZE:
+            raise TransferError("Invalid nonce prefix")
+
+    def _read_incoming(self, metadata_path, index_path):
+        """Return the saved (metadata, received chunks) of a transfer, or None if unusable."""
+        try:
+            with open(metadata_path) as f:
+                metadata = json.load(f)
+            self._check_metadata(metadata)
+            received = set()
+            if os.path.exists(index_path):
+                with open(index_path) as f:
+                    received = {int(line) for line in f if line.strip()}
+        except (ValueError, KeyError, TypeError, TransferError):
+            return None
+        if not all(0 <= index < metadata['chunk_count'] for index in received):
+            return None
+        return metadata, received
+
+    def _load_incoming(self, transfer_id, metadata):
+        """Create the state for an incoming transfer, resuming from disk if present."""
+        data_path, metadata_path, index_path = self._paths(transfer_id)
+        saved = None
+        if os.path.exists(metadata_path):
+            saved = self._read_incoming(metadata_path, index_path)
+            if saved is None:
+                # Truncated or corrupt state: drop it and start the transfer over
+                for path in (data_path, metadata_path, index_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        if saved:
+            metadata, received = saved
+        else:
+            self._check_metadata(metadata)
+            received = set()
+
+        key = self.app.sessions.unwrap_key(metadata['suite'], base64.b64decode(metadata['key']))
+
+        if not saved:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(data_path, 'wb') as f:
+                f.truncate(metadata['size'])
+            with open(metadata_path, 'w') as f:
+                json.dump(metadata, f)
+
+        return {
+            'metadata': metadata,
+            'key': key,
+            'nonce_prefix': base64.b64decode(metadata['nonce_prefix']),
+            'received': received,
+            'file': open(data_path, 'r+b'),
+            'index_log': open(index_path, 'a'),
+            'lock': threading.Lock()
+        }
+
+    def write_chunk(self, transfer_id, index, ciphertext):
+        """Decrypt and store one chunk. Returns the saved file path once complete."""
+        with self.lock:
+            state = self.incoming.get(transfer_id)
+        if state is None:
+            raise KeyError(transfer_id)
+
+        metadata = state['metadata']
+        chunk_count = metadata['chunk_count']
+        if not 0 <= index < chunk_count:
+            raise TransferError(f"Chunk index {index} out of range")
+
+        # Raises InvalidTag if the chunk was tampered with or misplaced
+        chunk = decrypt_chunk(
+            state['key'], state['nonce_prefix'], index, ciphertext,
+            index == chunk_count - 1, metadata['suite']
+        )
+        expected = min(metadata['chunk_size'], metadata['size'] - index * metadata['chunk_size'])
+        if len(chunk) != expected:
+            raise TransferError(f"Chunk {index} has the wrong length")
+
+        with state['lock']:
+            if index not in state['received']:
+                state['file'].seek(index * metadata['chunk_size'])
+                state['file'].write(chunk)
+                # The index log must never list a chunk whose bytes could still be lost
+                state['file'].flush()
+                os.fsync(state['file'].fileno())
+                state['received'].add(index)
+                state['index_log'].write(f"{index}\n")
+                state['index_log'].flush()
+
+            if len(state['received']) == chunk_count and not state.get('path'):
+                state['path'] = self._finish_incoming(transfer_id, state)
+            return state.get('path')
+
+    def _finish_incoming(self, transfer_id, state):
+        """Move a completed transfer into place and drop its bookkeeping."""
+        data_path, metadata_path, index_path = self._paths(transfer_id)
+        state['file'].close()
+        state['index_log'].close()
+
+        filename = os.path.basename(state['metadata']['filename']) or transfer_id
+        name, ext = os.path.splitext(filename)
+        path = os.path.join(self.directory, filename)
+        counter = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, f"{name}_{counter}{ext}")
+            counter += 1
+
+        os.replace(data_path, path)
+        os.remove(metadata_path)
+        os.remove(index_path)
+
+        self.app.handle_file_received(state['metadata']['sender_id'], path)
+        return path
+
+    def status(self, transfer_id):
+        """Return the received chunk indices and completion state of a transfer."""
+        with self.lock:
+            state = self.incoming.get(transfer_id)
+        if state is None:
+            raise KeyError(transfer_id)
+        return {
+            'received': sorted(state['received']),
+            'complete': bool(state.get('path'))
+        }
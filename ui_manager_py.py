@@ -26,6 +26,7 @@ class UIManager:
     def create_variables(self):
         """Initialize UI variables."""
         self.selected_peer = tk.StringVar()
+        self.selected_peers = []
         self.auto_delete_var = BooleanVar(value=False)
         self.priority_var = BooleanVar(value=False)
     
@@ -162,12 +163,51 @@ class UIManager:
             font=('Consolas', 10), 
             relief=tk.FLAT, 
             highlightthickness=0,
+            selectmode=tk.EXTENDED,
+            exportselection=False,
             yscrollcommand=scrollbar.set
         )
         self.peers_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.config(command=self.peers_listbox.yview)
         self.peers_listbox.bind('<<ListboxSelect>>', self.app.on_peer_select)
         
+        # History Search Section
+        search_frame = tk.LabelFrame(
+            parent, 
+            text=" SEARCH HISTORY ",
+            bg=COLORS['bg_medium'],
+            fg=COLORS['accent_green'], 
+            font=('Consolas', 10, 'bold'),
+            relief=tk.RIDGE, 
+            bd=1
+        )
+        search_frame.pack(fill=tk.X, padx=10, pady=5)
+        
+        self.search_entry = tk.Entry(
+            search_frame,
+            bg=COLORS['bg_light'], 
+            fg=COLORS['text_primary'],
+            insertbackground=COLORS['accent_green'], 
+            font=('Consolas', 10),
+            relief=tk.FLAT
+        )
+        self.search_entry.pack(fill=tk.X, padx=10, pady=(10, 5))
+        self.search_entry.bind('<Return>', self.app.search_history)
+        
+        MilitaryButton(
+            search_frame, 
+            text="◈ SEARCH",
+            command=self.app.search_history,
+            accent_color=COLORS['text_secondary']
+        ).pack(fill=tk.X, padx=10, pady=5)
+        
+        MilitaryButton(
+            search_frame, 
+            text="◈ OLDER MESSAGES",
+            command=self.app.load_older_history,
+            accent_color=COLORS['text_secondary']
+        ).pack(fill=tk.X, padx=10, pady=5)
+        
         # Operations Section
         ops_frame = tk.LabelFrame(
             parent, 
@@ -187,6 +227,13 @@ class UIManager:
             accent_color=COLORS['text_secondary']
         ).pack(fill=tk.X, padx=10, pady=5)
         
+        MilitaryButton(
+            ops_frame, 
+            text="◈ SEND FILE",
+            command=self.app.send_file,
+            accent_color=COLORS['text_secondary']
+        ).pack(fill=tk.X, padx=10, pady=5)
+        
         MilitaryButton(
             ops_frame, 
             text="◈ EXPORT KEYS",
@@ -243,6 +290,7 @@ class UIManager:
         self.message_display.tag_configure('received', foreground=COLORS['text_primary'])
         self.message_display.tag_configure('error', foreground=COLORS['accent_red'])
         self.message_display.tag_configure('timestamp', foreground=COLORS['text_dim'], font=('Consolas', 9))
+        self.message_display.tag_configure('pending', foreground=COLORS['accent_amber'], font=('Consolas', 9))
         
         # Input Area
         input_frame = tk.Frame(parent, bg=COLORS['bg_medium'])
@@ -353,12 +401,59 @@ class UIManager:
         
         self.root.after(0, _add)
     
+    def add_outgoing_message(self, msg_id, header, message):
+        """Show an outgoing message as QUEUED; set_message_status updates it in place."""
+        def _add():
+            self.message_display.config(state='normal')
+            self.message_display.insert(tk.END, f"{header} ", 'timestamp')
+            self.message_display.insert(tk.END, "[QUEUED]", ('pending', f"status-{msg_id}"))
+            self.message_display.insert(tk.END, f"\n  {message}\n", 'sent')
+            self.message_display.config(state='disabled')
+            self.message_display.yview(tk.END)
+        
+        self.root.after(0, _add)
+    
+    def set_message_status(self, msg_id, status, msg_type='pending'):
+        """Replace the status shown next to an outgoing message, e.g. QUEUED with DELIVERED."""
+        def _set():
+            tag = f"status-{msg_id}"
+            ranges = self.message_display.tag_ranges(tag)
+            if not ranges:
+                # Cleared from the display since
+                return
+            self.message_display.config(state='normal')
+            self.message_display.delete(ranges[0], ranges[1])
+            self.message_display.insert(ranges[0], f"[{status}]", (msg_type, tag))
+            self.message_display.config(state='disabled')
+        
+        self.root.after(0, _set)
+    
+    def prepend_to_display(self, lines):
+        """Insert (message, msg_type) lines above everything already shown, for scroll-back."""
+        def _add():
+            self.message_display.config(state='normal')
+            for message, msg_type in reversed(lines):
+                self.message_display.insert('1.0', f"{message}\n", msg_type)
+            self.message_display.config(state='disabled')
+            self.message_display.yview('1.0')
+        
+        self.root.after(0, _add)
+    
+    def get_selected_peers(self):
+        """Return the selected peer names (several when broadcasting)."""
+        if self.selected_peers:
+            return list(self.selected_peers)
+        return [self.selected_peer.get()] if self.selected_peer.get() else []
+    
     def update_peer_list(self, peers):
         """Update the peer list display."""
+        selected = self.get_selected_peers()
         self.peers_listbox.delete(0, tk.END)
-        for peer_name, peer_info in peers.items():
+        for index, (peer_name, peer_info) in enumerate(peers.items()):
             status = "●" if peer_info.get('status') == 'online' else "○"
             self.peers_listbox.insert(tk.END, f"{status} {peer_name}")
+            if peer_name in selected:
+                self.peers_listbox.selection_set(index)
         
         if peers and not self.selected_peer.get():
             self.selected_peer.set(list(peers.keys())[0])
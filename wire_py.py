@@ -0,0 +1,176 @@
+# wire.py - Message Envelope Encoding
+
+import struct
+import base64
+from config import WIRE_VERSION
+
+# Envelope layout (network byte order):
+#   magic "SN" | version | flags | len(sender_id) | len(suite) | len(key_id)
+#   | len(timestamp) | len(iv) | len(key) u16 | len(message) u32
+# followed by the fields themselves in the same order. With FLAG_MESSAGE_ID
+# the message is followed by len(msg_id) and the msg_id itself.
+MAGIC = b'SN'
+HEADER = struct.Struct('!2sBBBBBBBHI')
+
+FLAG_AUTO_DELETE = 0x01
+FLAG_PRIORITY = 0x02
+FLAG_BROADCAST = 0x04  # key is a content key wrapped under the session key_id
+FLAG_MESSAGE_ID = 0x08  # a msg_id trails the message; only sent to peers advertising message_id
+
+BINARY_FIELDS = ('key', 'iv', 'message')
+
+# Channel frames are a u32 sequence number followed by an encoded envelope
+CHANNEL_SEQ = struct.Struct('!I')
+
+# Batches are encoded envelopes, each preceded by its u32 length
+BATCH_LENGTH = struct.Struct('!I')
+
+def _text(value):
+    """Encode an optional text field."""
+    return value.encode() if value else b''
+
+def encode_envelope(envelope):
+    """Encode a message envelope into the binary wire format.
+
+    Raises ValueError if a field does not fit its length prefix.
+    """
+    sender_id = _text(envelope['sender_id'])
+    suite = _text(envelope.get('suite'))
+    key_id = _text(envelope.get('key_id'))
+    timestamp = _text(envelope.get('timestamp'))
+    iv = envelope['iv']
+    key = envelope.get('key') or b''
+    message = envelope['message']
+    msg_id = _text(envelope.get('msg_id'))
+
+    for name, value, limit in (
+        ('sender_id', sender_id, 0xFF), ('suite', suite, 0xFF), ('key_id', key_id, 0xFF),
+        ('timestamp', timestamp, 0xFF), ('iv', iv, 0xFF), ('key', key, 0xFFFF),
+        ('message', message, 0xFFFFFFFF), ('msg_id', msg_id, 0xFF)
+    ):
+        if len(value) > limit:
+            raise ValueError(f"Envelope field {name} too long ({len(value)} > {limit} bytes)")
+
+    flags = 0
+    if envelope.get('auto_delete'):
+        flags |= FLAG_AUTO_DELETE
+    if envelope.get('priority'):
+        flags |= FLAG_PRIORITY
+    if envelope.get('broadcast'):
+        flags |= FLAG_BROADCAST
+    if msg_id:
+        flags |= FLAG_MESSAGE_ID
+
+    header = HEADER.pack(
+        MAGIC, WIRE_VERSION, flags,
+        len(sender_id), len(suite), len(key_id), len(timestamp), len(iv),
+        len(key), len(message)
+    )
+    trailer = bytes((len(msg_id),)) + msg_id if msg_id else b''
+    return b''.join((header, sender_id, suite, key_id, timestamp, iv, key, message, trailer))
+
+def decode_envelope(data):
+    """Decode a binary envelope.
+
+    Binary fields are returned as memoryview slices of the input, so the
+    ciphertext is never copied before decryption. Raises ValueError on
+    malformed input.
+    """
+    view = memoryview(data)
+    if len(view) < HEADER.size:
+        raise ValueError("Envelope truncated")
+
+    (magic, version, flags, sender_len, suite_len, key_id_len,
+     timestamp_len, iv_len, key_len, message_len) = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("Not a SilentNet envelope")
+    if version != WIRE_VERSION:
+        raise ValueError(f"Unsupported envelope version {version}")
+
+    fields = []
+    offset = HEADER.size
+    for length in (sender_len, suite_len, key_id_len, timestamp_len, iv_len, key_len, message_len):
+        fields.append(view[offset:offset + length])
+        offset += length
+    msg_id = b''
+    if flags & FLAG_MESSAGE_ID and offset < len(view):
+        msg_id = view[offset + 1:offset + 1 + view[offset]]
+        offset += 1 + view[offset]
+    if offset != len(view):
+        raise ValueError("Envelope length mismatch")
+
+    sender_id, suite, key_id, timestamp, iv, key, message = fields
+    return {
+        'sender_id': str(sender_id, 'utf-8'),
+        'suite': str(suite, 'utf-8') or None,
+        'key_id': str(key_id, 'utf-8') or None,
+        'timestamp': str(timestamp, 'utf-8') or None,
+        'iv': iv,
+        'key': key if key_len else None,
+        'message': message,
+        'auto_delete': bool(flags & FLAG_AUTO_DELETE),
+        'priority': bool(flags & FLAG_PRIORITY),
+        'broadcast': bool(flags & FLAG_BROADCAST),
+        'msg_id': str(msg_id, 'utf-8') or None
+    }
+
+def encode_channel_frame(seq, data):
+    """Tag an encoded envelope with its sequence number for a channel."""
+    return CHANNEL_SEQ.pack(seq) + data
+
+def decode_channel_frame(data):
+    """Split a channel frame into (seq, envelope bytes). Raises ValueError if truncated."""
+    if len(data) < CHANNEL_SEQ.size:
+        raise ValueError("Channel frame truncated")
+    return CHANNEL_SEQ.unpack_from(data)[0], memoryview(data)[CHANNEL_SEQ.size:]
+
+def encode_batch(items):
+    """Frame several encoded envelopes into one batch body."""
+    return b''.join(BATCH_LENGTH.pack(len(item)) + item for item in items)
+
+def decode_batch(data):
+    """Split a batch body into encoded envelopes (memoryview slices). Raises ValueError if malformed."""
+    view = memoryview(data)
+    items = []
+    offset = 0
+    while offset < len(view):
+        if offset + BATCH_LENGTH.size > len(view):
+            raise ValueError("Batch truncated")
+        (length,) = BATCH_LENGTH.unpack_from(view, offset)
+        offset += BATCH_LENGTH.size
+        if offset + length > len(view):
+            raise ValueError("Batch truncated")
+        items.append(view[offset:offset + length])
+        offset += length
+    return items
+
+def envelope_to_json(envelope):
+    """Convert an envelope to the JSON payload used by older peers."""
+    payload = dict(envelope)
+    for field in BINARY_FIELDS:
+        if payload.get(field) is not None:
+            payload[field] = base64.b64encode(payload[field]).decode()
+    return payload
+
+def envelope_from_json(data):
+    """Convert a JSON payload into an envelope. Raises ValueError if incomplete."""
+    try:
+        envelope = {
+            'sender_id': data['sender_id'],
+            'suite': data.get('suite'),
+            'key_id': data.get('key_id'),
+            'timestamp': data.get('timestamp'),
+            'auto_delete': data.get('auto_delete', False),
+            'priority': data.get('priority', False),
+            'broadcast': data.get('broadcast', False),
+            'msg_id': data.get('msg_id')
+        }
+        for field in BINARY_FIELDS:
+            envelope[field] = base64.b64decode(data[field]) if data.get(field) else None
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Malformed message payload: {e}")
+    if envelope['iv'] is None or envelope['message'] is None:
+        raise ValueError("Malformed message payload: missing iv or message")
+    if envelope['msg_id'] is not None and not isinstance(envelope['msg_id'], str):
+        raise ValueError("Malformed message payload: msg_id must be a string")
+    return envelope
@@ -0,0 +1,66 @@
+# workers.py - Crypto Worker Pool
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from encryption import (
+    serialize_private_key, deserialize_private_key, unwrap_session_key, decrypt_message_bytes
+)
+from config import CRYPTO_WORKERS, CRYPTO_USE_PROCESSES, SUITE_X25519
+
+# Private keys loaded once per worker by _init_worker
+_worker_keys = {}
+
+def _init_worker(private_key_pem, x25519_private_key_pem):
+    """Load our private keys into a worker."""
+    _worker_keys['rsa'] = deserialize_private_key(private_key_pem, trusted=True)
+    if x25519_private_key_pem:
+        _worker_keys['x25519'] = deserialize_private_key(x25519_private_key_pem, trusted=True)
+
+def _unwrap_session_key(suite, wrapped_key):
+    """Worker task: unwrap a session key."""
+    key = _worker_keys['x25519'] if suite == SUITE_X25519 else _worker_keys['rsa']
+    return unwrap_session_key(key, wrapped_key)
+
+def _decrypt_legacy(encrypted_aes_key, iv, encrypted_message):
+    """Worker task: decrypt a legacy RSA + AES-CFB message."""
+    return decrypt_message_bytes(_worker_keys['rsa'], encrypted_aes_key, iv, encrypted_message)
+
+class DecryptPool:
+    """Run private-key operations for incoming messages on a pool of workers.
+
+    With processes (the default) RSA decryption runs in parallel across
+    cores instead of serializing on the API server thread. The methods
+    block until the result is ready, so call them off the event loop.
+    """
+
+    def __init__(self, private_key, x25519_private_key=None, workers=CRYPTO_WORKERS,
+                 use_processes=CRYPTO_USE_PROCESSES):
+        # Keys cross to the workers unencrypted over the executor's private pipe
+        initargs = (
+            serialize_private_key(private_key),
+            serialize_private_key(x25519_private_key) if x25519_private_key else None
+        )
+        if use_processes:
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=initargs
+            )
+        else:
+            _init_worker(*initargs)
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='crypto')
+
+    def unwrap_session_key(self, suite, wrapped_key):
+        """Unwrap a session key on a worker."""
+        return self.executor.submit(_unwrap_session_key, suite, bytes(wrapped_key)).result()
+
+    def decrypt_legacy(self, encrypted_aes_key, iv, encrypted_message):
+        """Decrypt a legacy message on a worker."""
+        return self.executor.submit(
+            _decrypt_legacy, bytes(encrypted_aes_key), bytes(iv), bytes(encrypted_message)
+        ).result()
+
+    def shutdown(self):
+        """Stop the workers."""
+        self.executor.shutdown(wait=False, cancel_futures=True)